@@ -4,13 +4,17 @@
 # Konvertierung nach Wave: $ sox -r 8000 -t raw -e u-law -c 1 HytBridge.TS1.raw out.wav
 
 import os
-import socket
-import _thread
 import time
 import signal
 import sys
-import audioop
+import HytConfig
+import HytDSP
+import HytMetrics
 import wave
+from HytSlotEngine import AsyncAudioSlot, getDefaultEngine
+from HytCodec import isQSOData, decodeQSOData
+from HytRecorder import CallRecorder, FORMAT_ULAW
+from HytRingBuffer import OVERFLOW_BLOCK
 
 # IP-Adresse vom Repeater:
 #LOCAL_IP = "127.0.0.1"
@@ -28,198 +32,116 @@ RCP_PORT_TS2 = 30010
 RTP_PORT_TS1 = 30012
 RTP_PORT_TS2 = 30014
 
-# Wave file output path:
+# Wave file output path (one file per call, see HytRecorder.py) and the index of all recordings in it:
 WAVE_PATH = './'
+RECORDING_INDEX = 'recordings.sqlite'
 
-# Maximum seconds per wave file:
+# Format of the recordings: FORMAT_ULAW ("ulaw") stores the received u-law bytes unchanged, "pcm" 16 bit PCM
+# at twice the size (convert later with HytWaveConvert.py):
+WAVE_FORMAT = FORMAT_ULAW
+
+# A call ends after this many seconds without voice:
+CALL_END_TIMEOUT = 1.0
+
+# Maximum seconds per wave file, longer calls (e.g. a stuck transmitter) are split:
 MAX_SEC_PER_WAVEFILE = 300
 
+# Prometheus metrics on http://METRICS_IP:METRICS_PORT/metrics (see HytMetrics.py), None: off:
+METRICS_IP = "127.0.0.1"
+METRICS_PORT = 9701
+
 # Bei STRG+C beenden:
-def signal_handler(signal, frame):
+def signal_handler(sig, frame):
   print("Exit!")
-  AudioSlot1.flushWave()
-  AudioSlot2.flushWave()
+  signal.signal(signal.SIGINT, signal.SIG_IGN) # A second CTRL+C must not interrupt the shutdown
+  getDefaultEngine().stop()
+  AudioSlot1.endRecording()
+  AudioSlot2.endRecording()
+  Recorder.close()
+  print("%(recordings)d recordings, %(seconds).0f s of audio" % Recorder.getStats())
   sys.exit(0)
 
-def decodeCallType(ct):
-  CallTypeList = ["Pvt", "Grp", "All"]
-  if ct >= 0 and ct < len(CallTypeList):
-    return CallTypeList[ct]
-  return "invalid"
-
-def isQSOData(data):
-  return len(data) == 38 and data[0] == 0x32 and data[1] == 0x42 and data[2] == 0x00 and data[3] == 0x20
-
-def printQSOData(threadName, data):
-  RptId = int("%02X%02X%02X" % (data[9], data[10], data[11]), 16)
-  CT = decodeCallType(data[26])
-  DstId = int("%02X%02X%02X" % (data[30], data[29], data[28]), 16)
-  SrcId = int("%02X%02X%02X" % (data[34], data[33], data[32]), 16)
-  print(threadName, ":", CT, "call from", SrcId, "to", DstId, "via", RptId)
-
 # Klasse, die sich um das Audio (RCP+RTP) für einen Timeslot kümmert.
-class AudioSlot:
+# Runs on the shared slot engine (see HytSlotEngine.py) instead of own threads.
+class AudioSlot(AsyncAudioSlot):
   def __init__(self, name, RptIP, RCP_Port, RTP_Port):
-    # Portnummern merken:
-    self.name = name
-    self.RptIP = RptIP
-    self.RCP_Port = RCP_Port
-    self.RTP_Port = RTP_Port
-
-    # Constants:
-    self.WakeCallPacket = bytes.fromhex('324200050000')
-    self.IdleKeepAlivePacket = bytes.fromhex('324200020000')
-    self.PCMSAMPLERATE = 8000
-    self.RTP_DATA_SIZE = 160
-
-    # Tx-Buffer:
-    self.TxBufferULaw = bytearray()
-    self.PTT = False
-    self.RTP_Seq = int(time.time() * self.PCMSAMPLERATE)
-    self.RTP_Timestamp = self.RTP_Seq
-
-    self.RCP_Seq = self.RTP_Seq
-    self.CallType = 0 # 0: Private 1: Group 2: AllCall
-    self.DstId = 0
-
-    # Wave files:
-    self.WaveSegmentName = ''
-    self.wavefile = None
-    self.WaveDataWritten = False
-
-    # Sockets anlegen:
-    self.RCP_Sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    self.RTP_Sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-    # Sockets an Ports binden:
-    self.RCP_Sock.bind((LOCAL_IP, RCP_Port))
-    self.RTP_Sock.bind((LOCAL_IP, RTP_Port))
-    _thread.start_new_thread(self.RCP_Rx_Thread, (name,))
-    _thread.start_new_thread(self.RTP_Rx_Thread, (name,))
-    _thread.start_new_thread(self.TxIdleMsgThread, (name,))
-    _thread.start_new_thread(self.TxAudioThread, (name,))
-
-  def __del__(self):
-    self.flushWave()
-
-  def getNextRCPSeq(self):
-    self.RCP_Seq = (self.RCP_Seq + 1) & 0xFF
-    return self.RCP_Seq
-
-  def sendACK(self, seq):
-    AckPacket = bytearray.fromhex('324200010100')
-    AckPacket[5] = seq;
-    self.RCP_Sock.sendto(AckPacket, (self.RptIP, self.RCP_Port))
-
-  def sendCallSetup(self, CallType, DstId):
-    packet = bytearray.fromhex('3242000000010241080500017c0900005e03')
-    packet[5] = self.getNextRCPSeq()
-    packet[11] = CallType
-    packet[12] = DstId & 0xFF
-    packet[13] = (DstId >> 8) & 0xFF
-    packet[14] = (DstId >> 16) & 0xFF
-    self.RCP_Sock.sendto(packet, (self.RptIP, self.RCP_Port))
-
-  def sendPTT(self, onoff):
-    packet = bytearray.fromhex('32420000000002410002000300ec03')
-    packet[5] = self.getNextRCPSeq()
-    if onoff:
-      packet[12:14] = bytes.fromhex('01eb')
-    self.RCP_Sock.sendto(packet, (self.RptIP, self.RCP_Port))
-
-  def sendAudioFrame(self):
-    bytesToSend = self.TxBufferULaw[0:self.RTP_DATA_SIZE]
-    self.TxBufferULaw = self.TxBufferULaw[self.RTP_DATA_SIZE:]
-    while len(bytesToSend) < self.RTP_DATA_SIZE:
-      bytesToSend.append(0xFF)
-    rtp = bytearray.fromhex('90000000000000000000000000150003000000000000000000000000') + bytesToSend
-    self.RTP_Seq = (self.RTP_Seq + 1) & 0xFFFF
-    self.RTP_Timestamp = (self.RTP_Timestamp + self.RTP_DATA_SIZE) & 0xFFFFFFFF
-    rtp[2] = (self.RTP_Seq >> 8) & 0xFF
-    rtp[3] = self.RTP_Seq & 0xFF
-    rtp[4] = (self.RTP_Timestamp >> 24) & 0xFF
-    rtp[5] = (self.RTP_Timestamp >> 16) & 0xFF
-    rtp[6] = (self.RTP_Timestamp >> 8) & 0xFF
-    rtp[7] = self.RTP_Timestamp & 0xFF
-    self.RTP_Sock.sendto(rtp, (self.RptIP, self.RTP_Port))
-
-  def flushWave(self):
-    if len(self.WaveSegmentName) > 0:
-      self.wavefile.close()
-      self.wavefile = None
-      if self.WaveDataWritten:
-        os.rename(self.WaveSegmentName + '.tmp', self.WaveSegmentName)
-        self.WaveDataWritten = False
-      else: os.remove(self.WaveSegmentName + '.tmp')
-      self.WaveSegmentName = ''
-
-  def RCP_Rx_Thread(self, threadName):
-    #print(threadName, "RCP_Rx_Thread started")
-    while True:
-      data, addr = self.RCP_Sock.recvfrom(1024)
-      #print(threadName, "RCP_Rx_Thread: received message:", data)
-      if isQSOData(data):
-        self.sendACK(data[5])
-        printQSOData(threadName, data)
-
-  def RTP_Rx_Thread(self, threadName):
-    #print(threadName, "RTP_Rx_Thread started")
-    self.flushWave()
-    LastWaveSegmentChangeTime = -MAX_SEC_PER_WAVEFILE
-    while True:
-      data, addr = self.RTP_Sock.recvfrom(1024)
-      #print(threadName, "RTP_Rx_Thread: received message:", data)
-      if time.time() - LastWaveSegmentChangeTime >= MAX_SEC_PER_WAVEFILE:
-        self.flushWave()
-        self.WaveSegmentName = WAVE_PATH + 'rec-' + threadName + '-' + time.strftime('%Y%m%d-%H%M') + '.wav'
-        print(threadName, ':', 'Beginning new segment \"' + self.WaveSegmentName + '\"...')
-        self.wavefile = wave.open(self.WaveSegmentName + '.tmp', 'wb')
-        self.wavefile.setparams((1, 2, self.PCMSAMPLERATE, 0, 'NONE', 'not compressed'))
-        LastWaveSegmentChangeTime = time.time()
-      if data[0:2] == bytes.fromhex('9000'):
-        self.wavefile.writeframes(audioop.ulaw2lin(data[28:], 2))
-        self.WaveDataWritten = True
-
-  def TxIdleMsgThread(self, threadName):
-    #print(threadName, "TxIdleMsgThread started")
-    self.RCP_Sock.sendto(self.WakeCallPacket, (self.RptIP, self.RCP_Port))
-    self.RTP_Sock.sendto(self.WakeCallPacket, (self.RptIP, self.RTP_Port))
-    while True:
-      self.RCP_Sock.sendto(self.IdleKeepAlivePacket, (self.RptIP, self.RCP_Port))
-      self.RTP_Sock.sendto(self.IdleKeepAlivePacket, (self.RptIP, self.RTP_Port))
-      time.sleep(2)
-
-  def TxAudioThread(self, threadName):
-    #print(threadName, "TxAudioThread started")
-    while True:
-      if len(self.TxBufferULaw) > 0:
-        if not self.PTT:
-          self.sendCallSetup(self.CallType, self.DstId)
-          time.sleep(0.1)
-          self.sendPTT(True)
-          self.PTT = True
-      else:
-        if self.PTT:
-          self.sendPTT(False)
-          self.sendPTT(False)
-          self.PTT = False
-      self.sendAudioFrame()
-      time.sleep(self.RTP_DATA_SIZE * 0.99 / self.PCMSAMPLERATE) # rough guess, not very accurate!
+    AsyncAudioSlot.__init__(self, name, LOCAL_IP, RptIP, RCP_Port, RTP_Port, TxOverflowPolicy = OVERFLOW_BLOCK)
+
+    # Call recording (written by the shared Recorder):
+    self.Recording = None # HytRecorder.Recording of the running call
+    self.QSO = None # Meta data of the last call announced by the repeater
+    self.QSOTime = 0
+    self.LastVoiceTime = 0
+
+    getDefaultEngine().addSlot(self)
+
+  def endRecording(self):
+    rec, self.Recording = self.Recording, None
+    if rec is not None: Recorder.end(rec)
+
+  def processRCPPacket(self, data):
+    #print(self.name, "processRCPPacket: received message:", data)
+    if isQSOData(data):
+      self.sendACK(data[5])
+      qso = decodeQSOData(data)
+      print(self.name, ":", qso)
+      rec = self.Recording
+      if rec is not None:
+        if not rec.hasQSO() and time.time() - rec.Start < CALL_END_TIMEOUT: rec.setQSO(qso) # Audio came first
+        elif (rec.CallType, rec.SrcId, rec.DstId) != (qso.CallType, qso.SrcId, qso.DstId): self.endRecording() # Next call without a pause
+      self.QSO = qso
+      self.QSOTime = time.monotonic()
+
+  def processRxAudio(self, payload):
+    rec = self.Recording
+    if rec is None:
+      rec = self.Recording = Recorder.start(self.name, self.RptIP, self.QSO)
+      print(self.name, ':', 'Recording', rec.getFileName())
+    elif time.time() - rec.Start >= MAX_SEC_PER_WAVEFILE:
+      self.endRecording()
+      rec = self.Recording = Recorder.start(self.name, self.RptIP, self.QSO)
+    Recorder.write(rec, payload, True)
+    self.LastVoiceTime = time.monotonic()
+
+  # Idle frames only matter within a call (lost frames), the recorder drops them if no voice follows:
+  def processRxIdle(self, payload):
+    if self.Recording is not None: Recorder.write(self.Recording, payload, False)
+
+  def tick(self, now):
+    AsyncAudioSlot.tick(self, now)
+    if self.Recording is not None and now - self.LastVoiceTime > CALL_END_TIMEOUT:
+      self.endRecording()
+      if self.QSOTime < self.LastVoiceTime: self.QSO = None # Belonged to this call
 
   def playFile(self, wavefilename, CallType, DstId):
     self.CallType = CallType
     self.DstId = DstId
     wavefile = wave.open(wavefilename, 'rb')
     # TODO: Check format and convert if necessary
-    self.TxBufferULaw += audioop.lin2ulaw(wavefile.readframes(3 * 60 * self.PCMSAMPLERATE), 2) # load max 3min
+    remaining = 3 * 60 * self.PCMSAMPLERATE # load max 3min
+    while remaining > 0:
+      frames = wavefile.readframes(min(remaining, self.PCMSAMPLERATE))
+      if len(frames) == 0: break
+      self.TxBufferULaw.write(HytDSP.lin2ulaw(frames, 2)) # Blocks while the transmit queue is full
+      remaining -= len(frames) // 2
     wavefile.close()
 
+# Settings from the command line (NAME=VALUE, see HytConfig.py), e.g. LOCAL_IP/RPT_IP for HytRepeaterSimulator.py:
+HytConfig.applyOverrides(globals(), sys.argv[1:])
+
 print("HytAudioBridge 0.01")
+Recorder = CallRecorder(WAVE_PATH, os.path.join(WAVE_PATH, RECORDING_INDEX), WAVE_FORMAT)
 signal.signal(signal.SIGINT, signal_handler)
 
 AudioSlot1 = AudioSlot("TS1", RPT_IP, RCP_PORT_TS1, RTP_PORT_TS1)
 AudioSlot2 = AudioSlot("TS2", RPT_IP, RCP_PORT_TS2, RTP_PORT_TS2)
 
+if METRICS_PORT is not None:
+  Metrics = HytMetrics.Registry()
+  getDefaultEngine().registerMetrics(Metrics)
+  Recorder.registerMetrics(Metrics)
+  Metrics.serve(METRICS_PORT, METRICS_IP)
+
 print("Recording (press CTRL+C to exit)...")
 #time.sleep(5)
 #print("Sending...")
@@ -0,0 +1,561 @@
+#!/usr/bin/python3
+
+# Offline analyzer for captures (pcap/pcapng) of the IP-dispatch traffic between repeater and PC.
+# Writes a call log (CSV) with time, timeslot, call type, source, destination and repeater id of every
+# call, one WAV file per call and the RTP loss and jitter of every audio stream. The Wireshark plugin
+# (wireshark/HytIPDispatch.lua) is the tool to look at single packets, this one is for long captures.
+#
+# Files are memory mapped. One pass over the record headers builds an index of all frames, everything
+# else works on NumPy arrays: link/IP/UDP headers, RTP sequence numbers, loss and jitter. Only the few
+# control packets (QSO data, call setup, PTT, text messages) are decoded one by one with HytCodec.
+# Several files are analyzed in parallel. Supported link types: Ethernet (with VLAN tags), Linux
+# cooked (SLL/SLL2), BSD loopback and raw IP, with IPv4 or IPv6.
+#
+# Calls from the repeater start with QSO data, calls to the repeater with call setup and PTT. Audio
+# without any of them (e.g. capture started mid-call) starts a call with unknown ids. A call ends
+# with PTT off, new QSO data or when no audio other than idle frames arrived for CALL_TIMEOUT seconds.
+#
+# Usage: HytCaptureAnalyzer.py capture.pcapng [capture2.pcap ...] [NAME=VALUE ...]
+#   e.g. HytCaptureAnalyzer.py night*.pcapng OUTPUT_DIR=analysis WRITE_WAV=False
+
+import csv
+import mmap
+import multiprocessing
+import os
+import socket
+import struct
+import sys
+import time
+import wave
+import numpy as np
+import HytCodec
+import HytConfig
+import HytDSP
+
+# Directory for the call log and the WAV files:
+OUTPUT_DIR = "./"
+CALL_LOG = "calls.csv"
+WRITE_WAV = True
+
+# Processes analyzing files in parallel, 0 = one per CPU:
+WORKERS = 0
+
+# Seconds without audio (idle frames do not count) ending a call:
+CALL_TIMEOUT = 2
+
+# Missing frames up to this many are filled with silence in the WAV file, longer gaps are cut out:
+MAX_GAP_FRAMES = 50
+
+# Sequence jumps larger than this are a restarted stream, not lost frames:
+MAX_SEQ_JUMP = 1000
+
+# UDP ports (SMS, RCP and RTP) -> timeslot:
+PORT_TIMESLOTS = {30007: 1, 30009: 1, 30012: 1, 30008: 2, 30010: 2, 30014: 2}
+
+# Frames decoded per NumPy batch, bounds the memory used for temporary arrays:
+BATCH_SIZE = 1 << 20
+
+PCMSAMPLERATE = 8000
+RTP_DATA_SIZE = 160
+
+# pcap/pcapng structures:
+PCAP_MAGIC_US = 0xA1B2C3D4
+PCAP_MAGIC_NS = 0xA1B23C4D
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_IDB = 1
+PCAPNG_SPB = 3
+PCAPNG_EPB = 6
+PCAPNG_OPT_TSRESOL = 9
+
+# Link types:
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+# Offset of the IP header for link types with a fixed size header:
+LINK_HEADER_SIZES = {LINKTYPE_NULL: 4, LINKTYPE_RAW: 0, LINKTYPE_IPV4: 0, LINKTYPE_IPV6: 0, LINKTYPE_LINUX_SLL: 16, LINKTYPE_LINUX_SLL2: 20}
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+IPPROTO_UDP = 17
+
+# Control events of a stream:
+EVENT_QSO = 0
+EVENT_SETUP = 1
+EVENT_PTT_ON = 2
+EVENT_PTT_OFF = 3
+
+IPV4_MAPPED = bytes(10) + b'\xff\xff'
+BE32 = np.dtype('>u4')
+
+# Frame index of a pcap file as arrays (time, link type, frame start, frame length):
+def indexPcap(mm):
+  magic = struct.unpack_from('<I', mm)[0]
+  order = '<' if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS) else '>'
+  magic = struct.unpack_from(order + 'I', mm)[0]
+  if magic not in (PCAP_MAGIC_US, PCAP_MAGIC_NS): raise ValueError("not a pcap file")
+  linktype = struct.unpack_from(order + 'I', mm, 20)[0] & 0xFFFF
+  unpack = struct.Struct(order + 'I').unpack_from
+  records = []
+  append = records.append
+  pos = 24
+  end = len(mm) - 16
+  while pos <= end:
+    append(pos)
+    pos += 16 + unpack(mm, pos + 8)[0]
+  if records and pos > len(mm): records.pop() # Truncated capture
+  records = np.array(records, dtype=np.int64)
+  buf = np.frombuffer(mm, dtype=np.uint8)
+  dt = np.dtype(np.uint32).newbyteorder(order)
+  times = u32(buf, records, dt) + u32(buf, records + 4, dt) * (1e-6 if magic == PCAP_MAGIC_US else 1e-9)
+  return times, np.full(len(records), linktype, dtype=np.int32), records + 16, u32(buf, records + 8, dt)
+
+# Frame index of a pcapng file as arrays (time, link type, frame start, frame length):
+def indexPcapng(mm):
+  end = len(mm)
+  unpack = struct.Struct('<II').unpack_from
+  interfaces = [] # Of all sections: (link type, seconds per timestamp unit)
+  base = 0 # Index of the first interface of the current section
+  blocks = [] # Start of the enhanced packet blocks
+  sections = [] # (first block, interface base, byte order) per section
+  simple = [] # (block start, frame length, interface) of simple packet blocks
+  append = blocks.append
+  pos = 0
+  while pos + 12 <= end:
+    btype, blen = unpack(mm, pos)
+    if btype == PCAPNG_EPB:
+      append(pos)
+    elif btype == PCAPNG_SHB:
+      order = '<' if struct.unpack_from('<I', mm, pos + 8)[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+      unpack = struct.Struct(order + 'II').unpack_from
+      btype, blen = unpack(mm, pos)
+      base = len(interfaces)
+      sections.append((len(blocks), base, order))
+    elif btype == PCAPNG_IDB:
+      interfaces.append(readInterface(mm, pos, blen, order))
+    elif btype == PCAPNG_SPB:
+      simple.append((pos, min(struct.unpack_from(order + 'I', mm, pos + 8)[0], blen - 16), base))
+    if blen < 12 or pos + blen > end: # Corrupt or truncated
+      if blocks and blocks[-1] == pos: blocks.pop()
+      break
+    pos += blen
+  if not interfaces: raise ValueError("not a pcapng file or no interface")
+
+  blocks = np.array(blocks, dtype=np.int64)
+  buf = np.frombuffer(mm, dtype=np.uint8)
+  linktypes = np.array([i[0] for i in interfaces], dtype=np.int32)
+  resolutions = np.array([i[1] for i in interfaces])
+  times = np.empty(len(blocks))
+  iface = np.empty(len(blocks), dtype=np.int64)
+  lengths = np.empty(len(blocks), dtype=np.int64)
+  sections.append((len(blocks), 0, '<'))
+  for (first, base, order), (last, _, _) in zip(sections, sections[1:]):
+    b = blocks[first:last]
+    dt = np.dtype(np.uint32).newbyteorder(order)
+    iface[first:last] = np.minimum(base + u32(buf, b + 8, dt), len(interfaces) - 1)
+    ticks = (u32(buf, b + 12, dt).astype(np.uint64) << np.uint64(32)) | u32(buf, b + 16, dt).astype(np.uint64)
+    times[first:last] = ticks * resolutions[iface[first:last]]
+    lengths[first:last] = u32(buf, b + 20, dt)
+  starts = blocks + 28
+  for pos, n, base in simple: # No time stamp, rare enough to take the time of the block before
+    i = np.searchsorted(blocks, pos)
+    times = np.insert(times, i, times[i - 1] if i > 0 else 0)
+    iface = np.insert(iface, i, base)
+    starts = np.insert(starts, i, pos + 12)
+    lengths = np.insert(lengths, i, n)
+    blocks = np.insert(blocks, i, pos)
+  return times, linktypes[iface], starts, lengths
+
+# Link type and time stamp resolution of an interface description block:
+def readInterface(mm, pos, blen, order):
+  linktype = struct.unpack_from(order + 'H', mm, pos + 8)[0]
+  resolution = 1e-6
+  opt = pos + 16
+  while opt + 4 <= pos + blen - 4:
+    code, length = struct.unpack_from(order + 'HH', mm, opt)
+    if code == 0: break
+    if code == PCAPNG_OPT_TSRESOL:
+      r = mm[opt + 4]
+      resolution = 2.0 ** -(r & 0x7F) if r & 0x80 else 10.0 ** -r
+    opt += 4 + (length + 3) // 4 * 4
+  return linktype, resolution
+
+# Gather helpers, read a field at the given offsets of the buffer:
+def u16(buf, offsets):
+  return (buf[offsets].astype(np.int64) << 8) | buf[offsets + 1]
+
+def u32(buf, offsets, dt):
+  return gather(buf, offsets, 4).view(dt)[:, 0].astype(np.int64)
+
+def gather(buf, offsets, n):
+  return buf[offsets[:, None] + np.arange(n)]
+
+# View of the file as 64 bit words starting at every byte, gathers whole frames 8 bytes at a time:
+def wordView(mm):
+  return np.ndarray((len(mm) - 7,), dtype='<u8', buffer=mm, strides=(1,))
+
+def gatherFrames(words, offsets):
+  return words[offsets[:, None] + np.arange(0, RTP_DATA_SIZE, 8)].view(np.uint8)
+
+# Exponentially smoothed values (RFC 3550 jitter, factor 1/16), starting from j.
+# Works in blocks to keep the powers of 15/16 within floating point range:
+def smoothJitter(x, j = 0.0, block = 256):
+  out = np.empty(len(x))
+  powers = (15 / 16) ** np.arange(1, block + 1)
+  for s in range(0, len(x), block):
+    xb = x[s:s + block]
+    p = powers[:len(xb)]
+    out[s:s + block] = p * (j + np.cumsum(xb / p) / 16)
+    j = out[s + len(xb) - 1]
+  return out
+
+def formatIP(ip):
+  return socket.inet_ntop(socket.AF_INET, ip[12:]) if ip[:12] == IPV4_MAPPED else socket.inet_ntop(socket.AF_INET6, ip)
+
+def formatTime(t):
+  return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t)) + '.%03d' % (int(t * 1000) % 1000)
+
+# RTP loss, reordering and jitter of the frames of a stream or call (arrays in capture order):
+class RTPStats:
+  def __init__(self, t, seq, timestamp):
+    n = len(seq)
+    self.Frames = n
+    # Unwrapped sequence numbers, restarts continue with the next number:
+    d = ((np.diff(seq) + 0x8000) & 0xFFFF) - 0x8000
+    restart = np.concatenate(([False], np.abs(d) > MAX_SEQ_JUMP))
+    d[restart[1:]] = 1
+    ext = np.concatenate(([0], np.cumsum(d)))
+    # Frames at or below the highest sequence number so far are late (reordered or duplicate):
+    self.InOrder = np.ones(n, dtype=bool)
+    self.InOrder[1:] = ext[1:] > np.maximum.accumulate(ext)[:-1]
+    self.Late = n - int(self.InOrder.sum())
+    ext = ext[self.InOrder]
+    self.Gaps = np.diff(ext, prepend=ext[0]) - 1 # Frames missing before each in-order frame
+    self.Gaps[0] = 0
+    self.Lost = int(self.Gaps.sum())
+    # Jitter from frames directly following their predecessor:
+    t = t[self.InOrder]
+    timestamp = timestamp[self.InOrder]
+    i = np.flatnonzero((self.Gaps[1:] == 0) & ~restart[self.InOrder][1:]) + 1
+    elapsed = (((timestamp[i] - timestamp[i - 1]) + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+    j = smoothJitter(np.abs((t[i] - t[i - 1]) - elapsed / PCMSAMPLERATE))
+    self.Jitter = float(j[-1]) if len(j) else 0.0
+    self.MaxJitter = float(j.max()) if len(j) else 0.0
+
+class Call:
+  def __init__(self, t, meta):
+    self.Start = t
+    self.LastActive = t
+    self.CallType, self.SrcId, self.DstId, self.RptId = meta if meta is not None else (None, None, None, None)
+
+# Traffic in one direction (src IP -> dst IP) of one timeslot:
+class Stream:
+  def __init__(self, SrcIP, DstIP, TS):
+    self.SrcIP = SrcIP
+    self.DstIP = DstIP
+    self.TS = TS
+    self.Events = [] # (time, event, meta) in capture order
+    self.RTP = None
+
+  # Split the stream into calls like a receiver going through the packets in order would. Only active
+  # (not idle) frames and control events change the state, so this works on runs of active frames.
+  # active are the arrival times of the active frames. Returns the calls.
+  def findCalls(self, active):
+    calls = []
+    call = None
+    meta = None
+    MetaTime = 0
+    def startCall(t):
+      return Call(t, meta if meta is not None and t - MetaTime < CALL_TIMEOUT else None)
+    # Runs of active frames without gaps above the timeout, split at the events:
+    runs = np.unique(np.concatenate(([0], np.flatnonzero(np.diff(active) > CALL_TIMEOUT) + 1,
+      np.searchsorted(active, [e[0] for e in self.Events])))).astype(np.int64)
+    runs = runs[runs < len(active)]
+    ends = np.append(runs[1:], len(active)) - 1
+    r = 0
+    for t, event, m in self.Events + [(float('inf'), None, None)]:
+      while r < len(runs) and active[runs[r]] < t:
+        first = active[runs[r]]
+        if call is not None and first - call.LastActive > CALL_TIMEOUT:
+          calls.append(call)
+          call = None
+        if call is None:
+          call = startCall(first)
+          meta = None
+        call.LastActive = active[ends[r]]
+        r += 1
+      if event is None: break
+      if call is not None and (event == EVENT_QSO or event == EVENT_PTT_OFF or t - call.LastActive > CALL_TIMEOUT):
+        calls.append(call)
+        call = None
+      if event == EVENT_QSO or event == EVENT_SETUP:
+        meta = m
+        MetaTime = t
+      if event == EVENT_QSO or (event == EVENT_PTT_ON and call is None):
+        call = startCall(t)
+        meta = None
+    if call is not None: calls.append(call)
+    return calls
+
+# Analysis of one capture file:
+class CaptureAnalyzer:
+  def __init__(self, path):
+    self.Path = path
+    self.Name = os.path.splitext(os.path.basename(path))[0]
+    self.StreamIds = {} # (src IP, dst IP, timeslot) -> index in Streams
+    self.Streams = []
+    self.Repeaters = set() # IPs known to be repeaters (send QSO data, receive call setup/wake-call)
+    self.QSOData = HytCodec.QSOData()
+    self.Rows = [] # Call log
+
+    # Stats:
+    self.Bytes = 0
+    self.Frames = 0
+    self.HyteraPackets = 0
+    self.BadChecksums = 0
+    self.Texts = 0
+
+  def run(self):
+    with open(self.Path, 'rb') as f:
+      self.Bytes = os.fstat(f.fileno()).st_size
+      if self.Bytes < 24: return self # Not even a file header
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        self.analyze(mm)
+    return self
+
+  def analyze(self, mm):
+    times, linktypes, starts, lengths = indexPcapng(mm) if struct.unpack_from('<I', mm)[0] == PCAPNG_SHB else indexPcap(mm)
+    self.Frames = len(times)
+    parts = [self.decodeBatch(mm, times[i:i + BATCH_SIZE], linktypes[i:i + BATCH_SIZE], starts[i:i + BATCH_SIZE], lengths[i:i + BATCH_SIZE])
+      for i in range(0, len(times), BATCH_SIZE)]
+    if parts:
+      # RTP frames grouped by stream, in capture order within a stream:
+      rtp = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+      order = np.argsort(rtp["stream"], kind='stable')
+      rtp = {k: v[order] for k, v in rtp.items()}
+      bounds = np.flatnonzero(np.diff(rtp["stream"])) + 1
+      for lo, hi in zip(np.concatenate(([0], bounds)), np.append(bounds, len(order))):
+        if hi > lo: self.analyzeAudio(mm, self.Streams[rtp["stream"][lo]], {k: v[lo:hi] for k, v in rtp.items()})
+    for s in self.Streams:
+      if s.RTP is None: self.analyzeAudio(mm, s, None) # Calls without audio
+
+  # Decode a batch of frames. Control packets are handled right away, the RTP frames are returned as arrays:
+  def decodeBatch(self, mm, times, linktypes, starts, lengths):
+    buf = np.frombuffer(mm, dtype=np.uint8)
+    # IP header:
+    ip = np.full(len(starts), -1, dtype=np.int64)
+    for lt in np.unique(linktypes):
+      sel = linktypes == lt
+      if lt == LINKTYPE_ETHERNET:
+        s = starts[sel]
+        n = lengths[sel]
+        off = np.full(len(s), 12, dtype=np.int64)
+        for i in range(2): # Up to two VLAN tags
+          ok = n >= off + 2
+          off += (ok & np.isin(u16(buf, s + np.where(ok, off, 0)), ETHERTYPE_VLAN)) * 4
+        ok = n >= off + 2
+        ethertype = u16(buf, s + np.where(ok, off, 0))
+        ip[sel] = np.where(ok & ((ethertype == ETHERTYPE_IPV4) | (ethertype == ETHERTYPE_IPV6)), off + 2, -1)
+      elif int(lt) in LINK_HEADER_SIZES:
+        ip[sel] = LINK_HEADER_SIZES[int(lt)]
+    idx = np.flatnonzero((ip >= 0) & (lengths >= ip + 28))
+    ipos = starts[idx] + ip[idx]
+    version = buf[ipos] >> 4
+    v4 = (version == 4) & (buf[ipos + 9] == IPPROTO_UDP) & ((u16(buf, ipos + 6) & 0x1FFF) == 0) # UDP, first fragment
+    v6 = (version == 6) & (buf[ipos + 6] == IPPROTO_UDP) & (lengths[idx] >= ip[idx] + 48) # Extension headers are not followed
+    udp = ipos + np.where(v4, (buf[ipos] & 0x0F).astype(np.int64) * 4, 40)
+    keep = (v4 | v6) & (udp + 8 <= starts[idx] + lengths[idx])
+    idx, ipos, udp, v4 = idx[keep], ipos[keep], udp[keep], v4[keep]
+
+    # IP-dispatch ports:
+    slots = np.zeros(65536, dtype=np.int64)
+    for port, ts in PORT_TIMESLOTS.items(): slots[port] = ts
+    sport = slots[u16(buf, udp)]
+    dport = slots[u16(buf, udp + 2)]
+    ts = np.where(dport > 0, dport, sport)
+    keep = ts > 0
+    idx, ipos, udp, v4, ts = idx[keep], ipos[keep], udp[keep], v4[keep], ts[keep]
+    start = udp + 8
+    end = np.minimum(starts[idx] + lengths[idx], udp + u16(buf, udp + 4))
+    n = end - start
+    t = times[idx]
+
+    # Stream ids from the addresses (16 bytes each, IPv4 mapped into IPv6) and the timeslot. IPv4
+    # address pairs fit into one 64 bit number, which is much faster to sort:
+    stream = np.empty(len(idx), dtype=np.int64)
+    a4 = np.flatnonzero(v4)
+    pairs, inverse = np.unique((u32(buf, ipos[a4] + 12, BE32).astype(np.uint64) << np.uint64(32)) | u32(buf, ipos[a4] + 16, BE32).astype(np.uint64),
+      return_inverse=True)
+    keys, inverse = np.unique(inverse.reshape(-1) * 4 + ts[a4], return_inverse=True)
+    stream[a4] = np.array([self.getStreamId(IPV4_MAPPED + int(pairs[k // 4] >> np.uint64(32)).to_bytes(4, 'big') + IPV4_MAPPED +
+      int(pairs[k // 4] & np.uint64(0xFFFFFFFF)).to_bytes(4, 'big') + bytes([k % 4])) for k in keys], dtype=np.int64)[inverse.reshape(-1)]
+    a6 = np.flatnonzero(~v4)
+    key = np.empty((len(a6), 33), dtype=np.uint8)
+    key[:, 0:32] = gather(buf, ipos[a6] + 8, 32)
+    key[:, 32] = ts[a6]
+    keys, inverse = np.unique(key.view('V33')[:, 0], return_inverse=True)
+    stream[a6] = np.array([self.getStreamId(k.tobytes()) for k in keys], dtype=np.int64)[inverse.reshape(-1)]
+
+    # Packet kind:
+    safe = np.where(n >= HytCodec.HYT_HEADER_SIZE, start, 0)
+    b0, b1 = buf[safe], buf[safe + 1]
+    hytera = (n >= HytCodec.HYT_HEADER_SIZE) & (b0 == 0x32) & (b1 == 0x42) & (buf[safe + 2] == 0x00)
+    rtp = np.flatnonzero((n > HytCodec.RTP_HEADER_SIZE) & (b0 == 0x90) & (b1 == 0x00))
+
+    for i in np.flatnonzero(hytera):
+      self.processControlPacket(t[i], self.Streams[stream[i]], mm[start[i]:end[i]])
+
+    p = start[rtp]
+    return {"stream": stream[rtp], "time": t[rtp], "seq": u16(buf, p + 2), "timestamp": u32(buf, p + 4, BE32),
+      "payload": p + HytCodec.RTP_HEADER_SIZE, "length": n[rtp] - HytCodec.RTP_HEADER_SIZE}
+
+  def getStreamId(self, key):
+    i = self.StreamIds.get(key)
+    if i is None:
+      i = self.StreamIds[key] = len(self.Streams)
+      self.Streams.append(Stream(key[:16], key[16:32], key[32]))
+    return i
+
+  def processControlPacket(self, t, s, data):
+    self.HyteraPackets += 1
+    PacketType = data[3]
+    n = len(data)
+    if PacketType == HytCodec.TYPE_QSODATA and HytCodec.isQSOData(data):
+      self.Repeaters.add(s.SrcIP)
+      q = HytCodec.decodeQSOData(data, self.QSOData)
+      s.Events.append((t, EVENT_QSO, (q.CallType, q.SrcId, q.DstId, q.RptId)))
+    elif PacketType == HytCodec.TYPE_WAKECALL:
+      self.Repeaters.add(s.DstIP)
+    elif PacketType == HytCodec.TYPE_DATA and n > HytCodec.HYT_HEADER_SIZE + 2:
+      if data[n - 1] != HytCodec.HDAP_END or HytCodec.HDAPChecksum(data, HytCodec.HYT_HEADER_SIZE + 1, n - 2) != data[n - 2]:
+        self.BadChecksums += 1
+      elif data[6] == HytCodec.HDAP_TMP:
+        self.Texts += 1
+      elif data[6] == HytCodec.HDAP_RCP and n == HytCodec.CALL_SETUP_SIZE:
+        self.Repeaters.add(s.DstIP)
+        s.Events.append((t, EVENT_SETUP, (data[11], None, data[12] | (data[13] << 8) | (data[14] << 16), None)))
+      elif data[6] == HytCodec.HDAP_RCP and n == HytCodec.PTT_SIZE:
+        s.Events.append((t, EVENT_PTT_ON if data[12] else EVENT_PTT_OFF, None))
+
+  # Loss and jitter of the stream, split it into calls and log them:
+  def analyzeAudio(self, mm, s, rtp):
+    if rtp is None:
+      active = np.zeros(0)
+    else:
+      s.RTP = RTPStats(rtp["time"], rtp["seq"], rtp["timestamp"])
+      active = rtp["time"][self.findActive(mm, rtp["payload"], rtp["length"])]
+    for c in s.findCalls(active):
+      self.Rows.append(self.logCall(mm, s, c, rtp))
+
+  # Frames that are not idle (all bytes 0xFF):
+  def findActive(self, mm, payload, length):
+    words = wordView(mm)
+    active = np.ones(len(payload), dtype=bool)
+    full = np.flatnonzero(length == RTP_DATA_SIZE)
+    for i in range(0, len(full), 65536):
+      sel = full[i:i + 65536]
+      active[sel] = (gatherFrames(words, payload[sel]) != 0xFF).any(axis=1)
+    for i in np.flatnonzero(length != RTP_DATA_SIZE):
+      active[i] = mm[payload[i]:payload[i] + length[i]].count(0xFF) != length[i]
+    return active
+
+  # Call log row, writes the WAV file:
+  def logCall(self, mm, s, c, rtp):
+    if s.SrcIP in self.Repeaters: direction, rpt, other = "rx", s.SrcIP, s.DstIP
+    elif s.DstIP in self.Repeaters: direction, rpt, other = "tx", s.DstIP, s.SrcIP
+    else: direction, rpt, other = "?", s.SrcIP, s.DstIP
+    frames = lost = late = 0
+    jitter = 0.0
+    wav = ""
+    if rtp is not None:
+      lo = np.searchsorted(rtp["time"], c.Start, side='left')
+      hi = np.searchsorted(rtp["time"], c.LastActive, side='right')
+      if hi > lo:
+        stats = RTPStats(rtp["time"][lo:hi], rtp["seq"][lo:hi], rtp["timestamp"][lo:hi])
+        frames, lost, late, jitter = stats.Frames, stats.Lost, stats.Late, stats.Jitter
+        if WRITE_WAV:
+          wav = "%s-%s-%s-TS%d-%s-%s.wav" % (self.Name, time.strftime('%Y%m%d-%H%M%S', time.gmtime(c.Start)), formatIP(rpt).replace(':', '_'),
+            s.TS, c.SrcId if c.SrcId is not None else "unknown", c.DstId if c.DstId is not None else "unknown")
+          writeWave(os.path.join(OUTPUT_DIR, wav), self.getAudio(mm, stats, rtp["payload"][lo:hi], rtp["length"][lo:hi]))
+    return (c.Start, formatTime(c.Start), "%.1f" % (c.LastActive - c.Start), direction, formatIP(rpt), formatIP(other), s.TS,
+      HytCodec.decodeCallType(c.CallType) if c.CallType is not None else "", c.SrcId or "", c.DstId or "", c.RptId or "",
+      frames, lost, late, "%.1f" % (jitter * 1000), wav, self.Path)
+
+  # u-law audio of the in-order frames, short gaps filled with silence:
+  def getAudio(self, mm, stats, payload, length):
+    payload = payload[stats.InOrder]
+    length = length[stats.InOrder]
+    if not (length == RTP_DATA_SIZE).all():
+      return b''.join(mm[p:p + n] for p, n in zip(payload, length))
+    slot = np.cumsum(np.where(stats.Gaps <= MAX_GAP_FRAMES, stats.Gaps, 0) + 1) - 1
+    audio = np.full((slot[-1] + 1, RTP_DATA_SIZE), 0xFF, dtype=np.uint8)
+    audio[slot] = gatherFrames(wordView(mm), payload)
+    return audio.tobytes()
+
+  def getStreamStats(self):
+    return [(formatIP(s.SrcIP), formatIP(s.DstIP), s.TS, s.RTP.Frames, s.RTP.Lost, s.RTP.Late, s.RTP.MaxJitter * 1000)
+      for s in self.Streams if s.RTP is not None]
+
+def writeWave(path, ulaw):
+  w = wave.open(path, 'wb')
+  w.setparams((1, 2, PCMSAMPLERATE, 0, 'NONE', 'not compressed'))
+  w.writeframes(HytDSP.ulaw2lin(ulaw, 2))
+  w.close()
+
+# Worker: analyze one file, return everything the report needs:
+def analyzeFile(path):
+  start = time.monotonic()
+  try:
+    a = CaptureAnalyzer(path).run()
+  except (OSError, ValueError, struct.error, IndexError) as e:
+    return {"path": path, "error": str(e)}
+  return {"path": path, "seconds": time.monotonic() - start, "bytes": a.Bytes, "frames": a.Frames, "hytera_packets": a.HyteraPackets,
+    "bad_checksums": a.BadChecksums, "texts": a.Texts, "calls": a.Rows, "streams": a.getStreamStats()}
+
+CALL_LOG_HEADER = ("time", "duration", "direction", "repeater_ip", "pc_ip", "ts", "call_type", "src_id", "dst_id", "rpt_id",
+  "frames", "lost", "late", "jitter_ms", "wav", "capture")
+
+if __name__ == "__main__":
+  files = []
+  settings = []
+  for arg in sys.argv[1:]:
+    if arg.partition("=")[0].isupper(): settings.append(arg)
+    else: files.append(arg)
+  HytConfig.applyOverrides(globals(), settings)
+
+  print("HytCaptureAnalyzer 0.01")
+  if not files:
+    print("Usage: HytCaptureAnalyzer.py capture.pcapng [capture2.pcap ...] [NAME=VALUE ...]")
+    sys.exit(1)
+  os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+  calls = []
+  start = time.monotonic()
+  total = 0
+  with multiprocessing.Pool(min(len(files), WORKERS if WORKERS > 0 else os.cpu_count())) as pool:
+    for r in pool.imap_unordered(analyzeFile, files):
+      if "error" in r:
+        print(r["path"], ": error:", r["error"])
+        continue
+      total += r["bytes"]
+      calls += r["calls"]
+      print("%s: %.1f MB, %d frames, %d IP-dispatch packets, %d calls, %d texts, %d bad checksums, %.1f MB/s" % (r["path"], r["bytes"] / 1e6,
+        r["frames"], r["hytera_packets"], len(r["calls"]), r["texts"], r["bad_checksums"], r["bytes"] / 1e6 / max(r["seconds"], 1e-6)))
+      for src, dst, ts, frames, lost, late, jitter in r["streams"]:
+        print("  RTP %s -> %s TS%d: %d frames, %d lost (%.2f%%), %d late, max jitter %.1f ms" % (src, dst, ts, frames, lost,
+          100 * lost / max(1, frames + lost), late, jitter))
+
+  calls.sort()
+  path = os.path.join(OUTPUT_DIR, CALL_LOG)
+  with open(path, 'w', newline='') as f:
+    w = csv.writer(f)
+    w.writerow(CALL_LOG_HEADER)
+    for row in calls: w.writerow(row[1:])
+  elapsed = time.monotonic() - start
+  print("%d calls written to %s, %.1f MB in %.1f s (%.1f MB/s)" % (len(calls), path, total / 1e6, elapsed, total / 1e6 / max(elapsed, 1e-6)))
@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+# Packet codec for the Hytera IP-dispatch protocols (RCP, RTP, QSO-data, TMP) and the DMR data link.
+# All layouts are precompiled struct.Struct objects. Encoders write into caller supplied, reusable
+# buffers with pack_into() and return the packet length, decoders read with unpack_from() into
+# small __slots__ records that can be reused as well.
+#
+# Hytera packet layout (see doc/HytIPDispatch-Protokoll.odt and wireshark/HytIPDispatch.lua):
+#   0-2 signature 0x32 0x42 0x00, 3 packet type, 4 flag, 5 sequence counter, 6.. HDAP message
+# HDAP message: MsgHdr, opcode, length, payload, checksum, 0x03
+#   checksum = (~(sum of opcode, length and payload bytes) + 0x33) & 0xFF
+
+import struct
+
+# Packet types (byte 3):
+TYPE_DATA = 0x00 # Tx-Ctrl / messages
+TYPE_ACK = 0x01
+TYPE_KEEPALIVE = 0x02
+TYPE_WAKECALL = 0x05
+TYPE_QSODATA = 0x20
+
+# HDAP message headers:
+HDAP_RCP = 0x02
+HDAP_TMP = 0x09
+HDAP_END = 0x03
+
+# RCP opcodes (little-endian on the wire):
+RCP_OPCODE_CALL_REQUEST = 0x0841
+RCP_OPCODE_BUTTON_REQUEST = 0x0041
+RCP_BUTTON_PTT = 0x03
+
+# TMP opcodes (big-endian on the wire):
+TMP_OPCODE_PRIVATE_MSG = 0x00A1
+
+HYT_SIGNATURE = 0x3242
+
+# Layouts:
+HYT_HEADER = struct.Struct('>HBBBB') # signature, 0x00, type, flag, seq
+RCP_CALL_SETUP = struct.Struct('<6BBHHBIBB') # Hytera header, MsgHdr, opcode, length, call type, dst id (24 bit + 0x00), checksum, end
+RCP_PTT = struct.Struct('<6BBHHBBBB') # Hytera header, MsgHdr, opcode, length, button, state, checksum, end
+RTP_HEADER = struct.Struct('>BBHIIHH12x') # V/P/X/CC, M/PT, seq, timestamp, SSRC, ext profile, ext length (3 words)
+QSO_IDS = struct.Struct('<26xB1xII') # call type, dst id (24 bit LE), src id (24 bit LE)
+QSO_RPT_ID = struct.Struct('>8xI') # repeater id (24 bit BE in bytes 9-11)
+TMP_HEADER = struct.Struct('>BHHIII') # MsgHdr, opcode, length, request id, dst IP, src IP
+# DMR data link: virtual circuit id, seq, flags, ack, sack (see HytDataLink.py). Replaced the 3 byte header
+# of the original HytDataBridge (virtual circuit id, seq), both ends of a link must run the same version:
+DATA_HEADER = struct.Struct('>HBBBH')
+DATA_SUBFRAME_LENGTH = struct.Struct('>H') # DMR data link: data length of a sub-frame followed by more
+
+HYT_HEADER_SIZE = HYT_HEADER.size
+ACK_SIZE = HYT_HEADER.size
+CALL_SETUP_SIZE = RCP_CALL_SETUP.size
+PTT_SIZE = RCP_PTT.size
+RTP_HEADER_SIZE = RTP_HEADER.size
+QSO_DATA_SIZE = 38
+TMP_OVERHEAD = HYT_HEADER.size + TMP_HEADER.size + 2 # Headers, checksum and end byte around the text
+
+WAKE_CALL_PACKET = bytes.fromhex('324200050000')
+IDLE_KEEPALIVE_PACKET = bytes.fromhex('324200020000')
+
+CallTypeList = ["Pvt", "Grp", "All"]
+
+def decodeCallType(ct):
+  if ct >= 0 and ct < len(CallTypeList):
+    return CallTypeList[ct]
+  return "invalid"
+
+def HDAPChecksum(buf, start, end):
+  return (~sum(memoryview(buf)[start:end]) + 0x33) & 0xFF
+
+def encodeHeader(buf, PacketType, flag, seq):
+  HYT_HEADER.pack_into(buf, 0, HYT_SIGNATURE, 0, PacketType, flag, seq)
+  return HYT_HEADER_SIZE
+
+def encodeACK(buf, seq):
+  return encodeHeader(buf, TYPE_ACK, 1, seq)
+
+# Byte sums of the constant opcode and length fields, the checksums only need the variable bytes added:
+CALL_SETUP_SUM = 0x41 + 0x08 + 5
+PTT_SUM = 0x41 + 0x00 + 2 + RCP_BUTTON_PTT
+
+def encodeCallSetup(buf, seq, CallType, DstId):
+  DstId &= 0xFFFFFF
+  chk = (~(CALL_SETUP_SUM + CallType + (DstId & 0xFF) + ((DstId >> 8) & 0xFF) + (DstId >> 16)) + 0x33) & 0xFF
+  RCP_CALL_SETUP.pack_into(buf, 0, 0x32, 0x42, 0, TYPE_DATA, 0, seq, HDAP_RCP, RCP_OPCODE_CALL_REQUEST, 5, CallType, DstId, chk, HDAP_END)
+  return CALL_SETUP_SIZE
+
+def encodePTT(buf, seq, onoff):
+  state = 1 if onoff else 0
+  chk = (~(PTT_SUM + state) + 0x33) & 0xFF
+  RCP_PTT.pack_into(buf, 0, 0x32, 0x42, 0, TYPE_DATA, 0, seq, HDAP_RCP, RCP_OPCODE_BUTTON_REQUEST, 2, RCP_BUTTON_PTT, state, chk, HDAP_END)
+  return PTT_SIZE
+
+# Write the 28 byte RTP header (PCMU with Hytera header extension), the payload follows at RTP_HEADER_SIZE:
+def encodeRTPHeader(buf, seq, timestamp):
+  RTP_HEADER.pack_into(buf, 0, 0x90, 0x00, seq, timestamp, 0, 0x15, 3)
+  return RTP_HEADER_SIZE
+
+# Write a text message (text is UTF-16LE encoded). Returns the packet length. The checksum is the
+# same HDAP checksum as for RCP, over everything between MsgHdr and checksum:
+def encodeTextMessage(buf, seq, SrcId, DstId, text):
+  n = len(text)
+  encodeHeader(buf, TYPE_DATA, 0, seq)
+  TMP_HEADER.pack_into(buf, HYT_HEADER_SIZE, HDAP_TMP, TMP_OPCODE_PRIVATE_MSG, 12 + n, 0x30000000 | seq, 0x0A000000 | DstId, 0x0A000000 | SrcId)
+  pos = HYT_HEADER_SIZE + TMP_HEADER.size
+  buf[pos:pos + n] = text
+  buf[pos + n] = HDAPChecksum(buf, HYT_HEADER_SIZE + 1, pos + n)
+  buf[pos + n + 1] = HDAP_END
+  return pos + n + 2
+
+# Decoded text message:
+class TextMessage:
+  __slots__ = ('Seq', 'RequestId', 'SrcId', 'DstId', 'Text')
+
+  def __init__(self):
+    self.Seq = self.RequestId = self.SrcId = self.DstId = 0
+    self.Text = ''
+
+  def __str__(self):
+    return "Text from " + str(self.SrcId) + " to " + str(self.DstId) + ": " + self.Text
+
+# HDAP packet (Tx-Ctrl, RCP or TMP) with end byte and valid checksum:
+def isValidHDAP(data):
+  n = len(data)
+  return n > HYT_HEADER_SIZE + 2 and data[n - 1] == HDAP_END and HDAPChecksum(data, HYT_HEADER_SIZE + 1, n - 2) == data[n - 2]
+
+def isTextMessage(data):
+  return len(data) >= TMP_OVERHEAD and data[3] == TYPE_DATA and data[6] == HDAP_TMP and isHyteraPacket(data)
+
+def decodeTextMessage(data, rec = None):
+  if rec is None: rec = TextMessage()
+  rec.Seq = data[5]
+  _, _, length, rec.RequestId, dst, src = TMP_HEADER.unpack_from(data, HYT_HEADER_SIZE)
+  rec.DstId = dst & 0xFFFFFF
+  rec.SrcId = src & 0xFFFFFF
+  pos = HYT_HEADER_SIZE + TMP_HEADER.size
+  end = min(len(data) - 2, pos + length - 12)
+  rec.Text = bytes(data[pos:end - (end - pos) % 2]).decode("utf-16le", "replace").rstrip('\0')
+  return rec
+
+def isHyteraPacket(data):
+  return len(data) >= HYT_HEADER_SIZE and data[0] == 0x32 and data[1] == 0x42 and data[2] == 0x00
+
+def isQSOData(data):
+  return len(data) == QSO_DATA_SIZE and data[0] == 0x32 and data[1] == 0x42 and data[2] == 0x00 and data[3] == TYPE_QSODATA
+
+def isRTPAudio(data):
+  return len(data) > RTP_HEADER_SIZE and data[0] == 0x90 and data[1] == 0x00
+
+# Decoded QSO meta data:
+class QSOData:
+  __slots__ = ('Seq', 'RptId', 'CallType', 'DstId', 'SrcId')
+
+  def __init__(self):
+    self.Seq = self.RptId = self.CallType = self.DstId = self.SrcId = 0
+
+  def __str__(self):
+    return decodeCallType(self.CallType) + " call from " + str(self.SrcId) + " to " + str(self.DstId) + " via " + str(self.RptId)
+
+def decodeQSOData(data, rec = None):
+  if rec is None: rec = QSOData()
+  rec.Seq = data[5]
+  rec.CallType, dst, src = QSO_IDS.unpack_from(data)
+  rec.DstId = dst & 0xFFFFFF
+  rec.SrcId = src & 0xFFFFFF
+  rec.RptId = QSO_RPT_ID.unpack_from(data)[0] & 0xFFFFFF
+  return rec
+
+# Write a QSO data packet as the repeater sends it at the start of a call (only the fields decodeQSOData() reads):
+def encodeQSOData(buf, seq, RptId, CallType, DstId, SrcId):
+  QSO_IDS.pack_into(buf, 0, CallType, DstId & 0xFFFFFF, SrcId & 0xFFFFFF)
+  QSO_RPT_ID.pack_into(buf, 0, RptId & 0xFFFFFF)
+  buf[QSO_IDS.size:QSO_DATA_SIZE] = bytes(QSO_DATA_SIZE - QSO_IDS.size)
+  encodeHeader(buf, TYPE_QSODATA, 0, seq)
+  return QSO_DATA_SIZE
+
+def printQSOData(threadName, data):
+  print(threadName, ":", decodeQSOData(data))
+
+# Decoded RTP header:
+class RTPInfo:
+  __slots__ = ('Seq', 'Timestamp', 'SSRC')
+
+  def __init__(self):
+    self.Seq = self.Timestamp = self.SSRC = 0
+
+def decodeRTPHeader(data, rec = None):
+  if rec is None: rec = RTPInfo()
+  _, _, rec.Seq, rec.Timestamp, rec.SSRC, _, _ = RTP_HEADER.unpack_from(data)
+  return rec
@@ -0,0 +1,32 @@
+#!/usr/bin/python3
+
+# Command line overrides for the settings at the top of the bridge scripts.
+# Every argument has the form NAME=VALUE and replaces the module-level setting NAME, e.g.
+#   python3 HytDataBridge.py LOCAL_TCP_PORT=8001 LOCAL_RADIO_NET_IP=127.0.0.2 "RADIO_LINKS=[('127.0.0.2', 3)]"
+#   python3 HytMumbleBridge.py MumbleServer=mumble.example.org DMR_DstId=2428
+# Settings are the module's public variables (any case), not its functions, classes or imported modules.
+# VALUE is read as Python literal (number, string, list, tuple, dict, True/False/None). Anything
+# else is taken as plain string, so IP addresses need no quotes.
+
+import ast
+import sys
+import types
+
+def isSetting(settings, name):
+  if name.startswith("_") or name not in settings: return False
+  value = settings[name]
+  return not callable(value) and not isinstance(value, types.ModuleType)
+
+# Apply NAME=VALUE arguments to the dict of settings (usually globals()). Unknown names and
+# malformed arguments end the program, a typo must not silently run with the default:
+def applyOverrides(settings, args):
+  for arg in args:
+    name, sep, value = arg.partition("=")
+    if not sep or not isSetting(settings, name):
+      print("Unknown setting:", arg)
+      sys.exit(1)
+    try:
+      value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+      pass # Plain string
+    settings[name] = value
@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+
+# Audio DSP helpers built on lookup tables and NumPy, replacing the audioop module
+# (deprecated, removed in Python 3.13).
+#
+# The byte oriented functions ulaw2lin(), lin2ulaw(), mul() and ratecv() take the same arguments as
+# their audioop counterparts (16 bit native-endian mono only), so they can be swapped in directly.
+# ulaw2lin(), lin2ulaw() and mul() are bit-exact with audioop. ratecv() interpolates linearly between
+# samples and keeps its position in the state, but does not reproduce audioop's filter bit by bit.
+# The array functions (ulawDecode(), ulawEncode(), gain(), resample()) work on NumPy arrays and are
+# meant for batches of many frames at once.
+
+import numpy as np
+
+# G.711 u-law constants (same as CCITT reference code used by audioop):
+ULAW_BIAS = 0x84
+ULAW_CLIP = 8159
+
+class error(Exception):
+  pass
+
+def _buildDecodeTable():
+  u = ~np.arange(256, dtype=np.int32) & 0xFF
+  t = ((u & 0x0F) << 3) + ULAW_BIAS
+  t <<= (u & 0x70) >> 4
+  return np.where(u & 0x80, ULAW_BIAS - t, t - ULAW_BIAS).astype(np.int16)
+
+def _buildEncodeTable():
+  # Index: 16 bit sample reinterpreted as uint16. audioop encodes the 14 bit value sample >> 2.
+  pcm = np.arange(65536, dtype=np.int32)
+  pcm = np.where(pcm >= 32768, pcm - 65536, pcm) >> 2
+  mask = np.where(pcm < 0, 0x7F, 0xFF)
+  mag = np.minimum(np.abs(pcm), ULAW_CLIP) + (ULAW_BIAS >> 2)
+  seg = np.searchsorted(np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF]), mag)
+  uval = (seg << 4) | ((mag >> (seg + 1)) & 0x0F)
+  uval = np.where(seg >= 8, 0x7F, uval)
+  return (uval ^ mask).astype(np.uint8)
+
+ULAW_DECODE = _buildDecodeTable()
+ULAW_ENCODE = _buildEncodeTable()
+
+def _checkWidth(width):
+  if width != 2: raise error("only 16 bit samples are supported")
+
+# Array API:
+
+def ulawDecode(ulaw):
+  return ULAW_DECODE.take(np.frombuffer(ulaw, dtype=np.uint8))
+
+def ulawEncode(samples):
+  return ULAW_ENCODE.take(np.asarray(samples, dtype=np.int16).view(np.uint16))
+
+# Multiply with clipping, rounding towards minus infinity like audioop.mul():
+def gain(samples, factor):
+  y = np.multiply(samples, factor, dtype=np.float64)
+  np.clip(y, -32768, 32767, out=y)
+  np.floor(y, out=y)
+  return y.astype(np.int16)
+
+# Linear interpolation resampler. pos is the position of the first output sample in units of
+# 1/outrate input samples, relative to prev (the last sample of the previous chunk).
+def resample(samples, inrate, outrate, prev = 0, pos = None):
+  samples = np.asarray(samples, dtype=np.int16)
+  g = np.gcd(inrate, outrate)
+  up = outrate // g # Ticks per input sample
+  step = inrate // g # Ticks per output sample
+  if pos is None: pos = up # Start exactly at the first new sample
+  n = len(samples)
+  end = n * up # Position of the last input sample
+  if pos > end: return np.zeros(0, dtype=np.int16), prev, pos - end
+  count = (end - pos) // step + 1
+  ticks = pos + np.arange(count, dtype=np.int64) * step
+  xx = np.empty(n + 1, dtype=np.float64)
+  xx[0] = prev
+  xx[1:] = samples
+  idx = ticks // up
+  frac = (ticks - idx * up) / up
+  nxt = np.minimum(idx + 1, n)
+  out = xx[idx] + (xx[nxt] - xx[idx]) * frac
+  newpos = pos + count * step - end
+  newprev = int(samples[-1]) if n > 0 else prev
+  return np.round(out).astype(np.int16), newprev, newpos
+
+# audioop compatible API:
+
+def ulaw2lin(fragment, width):
+  _checkWidth(width)
+  return ulawDecode(fragment).tobytes()
+
+def lin2ulaw(fragment, width):
+  _checkWidth(width)
+  return ULAW_ENCODE.take(np.frombuffer(fragment, dtype=np.uint16)).tobytes()
+
+def mul(fragment, width, factor):
+  _checkWidth(width)
+  return gain(np.frombuffer(fragment, dtype=np.int16), factor).tobytes()
+
+def ratecv(fragment, width, nchannels, inrate, outrate, state, weightA = 1, weightB = 0):
+  _checkWidth(width)
+  if nchannels != 1: raise error("only mono is supported")
+  prev, pos = state if state is not None else (0, None)
+  out, prev, pos = resample(np.frombuffer(fragment, dtype=np.int16), inrate, outrate, prev, pos)
+  return out.tobytes(), (prev, pos)
+
+# Stateful polyphase resampler for one audio stream (e.g. 8 kHz <-> 48 kHz).
+# The rate ratio L/M is applied with a Kaiser windowed sinc low-pass split into L phases of
+# K taps each. Filter history and phase position are kept between calls, so chunks of any size
+# (20 ms RTP frames, Mumble packets) give the same output as one long buffer, without restarting
+# the filter at every chunk boundary.
+class PolyphaseResampler:
+  def __init__(self, inrate, outrate, ZeroCrossings = 8, Beta = 8.0, Rolloff = 0.9):
+    g = int(np.gcd(inrate, outrate))
+    self.L = outrate // g # Upsampling factor
+    self.M = inrate // g # Downsampling factor
+    L, M = self.L, self.M
+
+    # Prototype low-pass at the upsampled rate:
+    K = int(np.ceil(2 * ZeroCrossings * max(L, M) / L)) # Taps per phase
+    N = K * L
+    fc = 0.5 * Rolloff / max(L, M)
+    n = np.arange(N) - (N - 1) / 2
+    h = 2 * fc * np.sinc(2 * fc * n) * np.kaiser(N, Beta) * L
+
+    # Phase p uses h[p], h[p + L], ... Stored reversed to match a sliding window over the input:
+    self.K = K
+    self.Phases = h.reshape(K, L).T[:, ::-1].copy()
+
+    self.reset()
+
+  def reset(self):
+    self.History = np.zeros(self.K - 1, dtype=np.float64) # Last K-1 input samples
+    self.Pos = 0 # Upsampled position of the next output relative to the start of the next chunk
+
+  # Resample a chunk of int16 samples, returns int16 samples. An empty chunk gives no output and keeps the state:
+  def process(self, samples):
+    x = np.asarray(samples, dtype=np.float64)
+    n = len(x)
+    if n == 0: return np.zeros(0, dtype=np.int16)
+    L, M = self.L, self.M
+    xh = np.concatenate((self.History, x))
+    count = max(0, -(-(n * L - self.Pos) // M)) # Outputs whose input sample lies in this chunk
+    windows = np.lib.stride_tricks.sliding_window_view(xh, self.K)
+    if M == 1:
+      # Pure upsampling: every phase of every input sample is needed, one matrix product
+      y = (windows @ self.Phases.T).reshape(-1)[self.Pos:self.Pos + count]
+    else:
+      t = self.Pos + np.arange(count) * M
+      j = t // L
+      if L == 1: y = windows[j] @ self.Phases[0]
+      else: y = np.einsum('nk,nk->n', windows[j], self.Phases[t % L])
+    self.Pos += count * M - n * L
+    if self.K > 1: self.History = xh[len(xh) - (self.K - 1):]
+    np.clip(np.round(y), -32768, 32767, out=y)
+    return y.astype(np.int16)
+
+  # Byte oriented variant for 16 bit native-endian PCM:
+  def processBytes(self, fragment):
+    return self.process(np.frombuffer(fragment, dtype=np.int16)).tobytes()
+
+# Energy based voice activity detector for the transmit path, one frame (int16 samples) at a time.
+# A frame counts as voice when its level is at least MinLevel dBFS and Margin dB above the noise floor.
+# The noise floor follows quieter frames at once and louder ones with a time constant of NoiseAdapt
+# seconds, or SpeechAdapt seconds while the detector is open, so steady background noise is learned
+# quickly but a long talk does not raise it. Attack voice frames in a row open the detector (the frames
+# before are passed on as pre-roll), it closes Hangover seconds after the last voice frame.
+class EnergyVAD:
+  def __init__(self, SampleRate = 8000, FrameSize = 160, MinLevel = -45.0, Margin = 9.0, Attack = 2, Hangover = 0.5, NoiseAdapt = 0.5, SpeechAdapt = 10.0):
+    FrameTime = FrameSize / SampleRate
+    self.MinLevel = MinLevel
+    self.Margin = Margin
+    self.Attack = Attack
+    self.HangoverFrames = max(1, int(round(Hangover / FrameTime)))
+    self.NoiseRate = min(1.0, FrameTime / NoiseAdapt)
+    self.SpeechRate = min(1.0, FrameTime / SpeechAdapt)
+    self.NoiseFloor = None # dBFS
+    self.Run = 0 # Voice frames in a row
+    self.Hold = 0 # Frames until the detector closes
+    self.PreRoll = [] # Last Attack - 1 frames while closed
+
+    # Stats:
+    self.VoiceFrames = 0
+    self.GatedFrames = 0
+
+  def isOpen(self):
+    return self.Hold > 0
+
+  # Level in dBFS of int16 samples:
+  @staticmethod
+  def level(samples):
+    x = np.asarray(samples, dtype=np.float32)
+    return 10 * np.log10(float(np.dot(x, x)) / (len(x) * 32768.0 * 32768.0) + 1e-10)
+
+  # Feed one frame, returns the frames to send: none while closed, the pre-roll and this frame when opening.
+  def process(self, samples):
+    level = self.level(samples)
+    if self.NoiseFloor is None or level < self.NoiseFloor: self.NoiseFloor = level
+    else: self.NoiseFloor += (level - self.NoiseFloor) * (self.SpeechRate if self.Hold > 0 else self.NoiseRate)
+    if level >= self.MinLevel and level >= self.NoiseFloor + self.Margin: self.Run += 1
+    else: self.Run = 0
+    if self.Run >= self.Attack:
+      self.Hold = self.HangoverFrames
+    elif self.Hold > 0:
+      self.Hold -= 1
+      if self.Hold == 0: self.PreRoll = []
+    if self.Hold == 0:
+      self.GatedFrames += 1
+      if self.Attack > 1:
+        self.PreRoll.append(samples)
+        if len(self.PreRoll) >= self.Attack: del self.PreRoll[0]
+      return []
+    frames = self.PreRoll + [samples]
+    self.VoiceFrames += len(frames)
+    self.GatedFrames -= len(self.PreRoll)
+    self.PreRoll = []
+    return frames
+
+  def getStats(self):
+    return {
+      "voice_frames": self.VoiceFrames,
+      "gated_frames": self.GatedFrames,
+      "noise_floor": self.NoiseFloor,
+      "open": self.isOpen(),
+    }
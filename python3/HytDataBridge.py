@@ -1,28 +1,52 @@
 #!/usr/bin/python3
 
 # Forward TCP/IP ports over DMR-data-links (for use with radios, not repeaters).
+# The radio packet format changed with the sliding window ARQ (see HytDataLink.py), both stations
+# need this version of the bridge.
 
 # Warning: This is a proof of concept and not yet fully functional!
 # TODO:
-# - Flow control and sequence numbers
-# - Timeouts, resends
-# - Implement non-blocking connect()
 # - Much more error handling needed
 # - Read DMR-ID from local radio and check whether radio is reachable
 
 import socket
-import select
+import selectors
+import errno
+import os
 import time
 import signal
 import sys
 import random
+import zlib
+import heapq
+import itertools
+import collections
+import HytConfig
+import HytMetrics
+from HytCodec import DATA_HEADER, DATA_SUBFRAME_LENGTH
+from HytDataLink import (FLAG_DATA, FLAG_ACK, FLAG_SYN, FLAG_FIN, FLAG_RST, FLAG_COMPRESSED, FLAG_MORE,
+  LINK_CIRCUIT_ID, LINK_SEQ, LINK_PROBE, LINK_PROBE_ACK, LINK_FRAGMENT, COMPRESSION_OVERHEAD, SendWindow, ReceiveWindow,
+  RTTEstimator, StreamCompressor, StreamDecompressor, PayloadSizeProber, Reassembler, LinkMonitor, compressionRatio, dmrIdToIP)
+from HytRadioScheduler import RadioScheduler, RateController, PRIORITY_INTERACTIVE, PRIORITY_BULK
 
 # DMR subnet prefix. Radios will uses DMR_SUBNET_PREFIX.x.y.z IP addresses. Needs to match codeplug settings!
-#DMR_SUBNET_PREFIX = 10
+DMR_SUBNET_PREFIX = 10
 
 # Local IP address of network adapter connected to DMR radio. Needs to match codeplug settings!
 LOCAL_RADIO_NET_IP = "0.0.0.0" #TEST - "192.168.10.2"
 
+# DMR-ID of the radio of the other station, its IP address is derived from it. None: use OTHER_STATION_IP instead.
+OTHER_STATION_DMR_ID = None
+OTHER_STATION_IP = "127.0.0.1"
+
+# Bonding: one link per pair of radios, as (local IP address of network adapter connected to the radio,
+# DMR-ID of its partner radio at the other station). Packets of all virtual circuits are spread over
+# the links, each link gets its own rate limit and payload size. A link is left out while the other
+# station does not answer on it for LINK_TIMEOUT seconds. Both stations need the same number of links.
+# Empty: single link LOCAL_RADIO_NET_IP -> OTHER_STATION_DMR_ID.
+RADIO_LINKS = [] # e.g. [("192.168.10.2", 2620001), ("192.168.11.2", 2620002)]
+LINK_TIMEOUT = 30 # Well above RADIO_MAX_UDP_PAYLOAD_SIZE / RADIO_MIN_RATE, a busy radio delays answers that long
+
 # UDP/IP port the radio is listening for data packets. Needs to match codeplug settings!
 RADIO_UDP_PORT = 3007
 
@@ -35,6 +59,7 @@ LOCAL_TCP_PORT = 8000 # Local TCP-port to listen for connecting clients:
 ALLOW_SERVER_MODE = True
 DESTINATION_HOST = "127.0.0.1" # Host to forward connections to
 DESTINATION_PORT = 80  # Port of host to forward connections to
+CONNECT_TIMEOUT = 10 # Seconds to wait for the destination host to accept a connection
 
 # Client -> LOCAL_CLIENT_NET_IP:LOCAL_TCP_PORT@PC1 -> DMR -> LOCAL_RADIO_NET_IP:RADIO_UDP_PORT@PC2 -> DESTINATION_HOST:DESTINATION_PORT
 
@@ -42,52 +67,144 @@ DESTINATION_PORT = 80  # Port of host to forward connections to
 # (faster) but may crash the radio firmware. Decrease when radio reboots while sending.
 RADIO_MAX_UDP_PAYLOAD_SIZE = 1024
 
+# Probe for the largest payload size that gets through, between RADIO_MIN_UDP_PAYLOAD_SIZE and
+# RADIO_MAX_UDP_PAYLOAD_SIZE, starting at RADIO_START_UDP_PAYLOAD_SIZE. Without probing
+# RADIO_START_UDP_PAYLOAD_SIZE is used, lowered when packets get lost. Datagrams bigger than the
+# current size (e.g. retransmits after lowering it) are fragmented.
+PAYLOAD_SIZE_PROBING = True
+RADIO_MIN_UDP_PAYLOAD_SIZE = 128
+RADIO_START_UDP_PAYLOAD_SIZE = 512
+PROBE_INTERVAL = 10 # Seconds between probes, probes are only sent while data is waiting
+
 # Minimum time inverval in seconds between packets send to radio:
 RADIO_MIN_TIME_BETWEEN_PACKETS = 0.1
 
-# Max number of unconfirmed packets flying around
-# Has to be 1 for now!
-TRANSMIT_WINDOW_SIZE = 1
+# Bytes per second handed to each radio. Starts at RADIO_RATE and adapts between RADIO_MIN_RATE and
+# RADIO_MAX_RATE to acknowledgement latency and loss. RADIO_BURST bytes may be sent at once after idle time,
+# None: two packets of RADIO_MAX_UDP_PAYLOAD_SIZE (as set on the command line):
+RADIO_RATE = 200
+RADIO_MIN_RATE = 50
+RADIO_MAX_RATE = 2000
+RADIO_BURST = None
+
+# Priority class per TCP port (listening port in client mode, DESTINATION_PORT in server mode).
+# Interactive circuits are always served before bulk ones, circuits of the same class share airtime fairly:
+PRIORITY_PORTS = {} # e.g. {22: PRIORITY_INTERACTIVE, 80: PRIORITY_BULK}
+
+# Circuits without a configured class start as interactive and become bulk after sending this many bytes (0 = never):
+BULK_THRESHOLD = 16384
 
-# Time-out in seconds after a resend is triggered when packet is still not confirmed by other station:
+# Interval in seconds to print scheduler stats (queue depth and airtime share per circuit), 0 = off:
+STATS_INTERVAL = 60
+
+# Prometheus metrics on http://METRICS_IP:METRICS_PORT/metrics (see HytMetrics.py), None: off:
+METRICS_IP = "127.0.0.1"
+METRICS_PORT = 9704
+
+# Max number of unconfirmed packets flying around per virtual circuit (1..MAX_WINDOW_SIZE):
+TRANSMIT_WINDOW_SIZE = 8
+
+# Initial time-out in seconds after a resend is triggered when packet is still not confirmed by other station.
+# Adapted to the measured round trip time at runtime and doubled on every resend:
 PACKET_TIMEOUT = 10
+MIN_PACKET_TIMEOUT = 1
+MAX_PACKET_TIMEOUT = 60
+
+# Time in seconds an acknowledgement may be delayed to piggyback it on a data packet:
+ACK_DELAY = 0.3
+
+# Compress the data stream of each virtual circuit (zlib). Decompression is always supported, the other
+# station only compresses its direction when we offer it:
+COMPRESSION = True
+COMPRESSION_LEVEL = 9
+
+# Optional file with a preset dictionary (typical strings of the tunnelled protocol, e.g. HTTP headers).
+# Helps with short connections. Must be the same file on both stations!
+COMPRESSION_DICTIONARY_FILE = None
+
+# Time in seconds small client writes are held back to be merged into fuller radio packets (0 = send at once):
+COALESCE_DELAY = 0.2
 
 # Max number of times a packet is resent after time-out:
 MAX_RETRY_COUNT = 3
 
 # Size of headers:
-HEADER_SIZE = 3
+HEADER_SIZE = DATA_HEADER.size
+SUBFRAME_HEADER_SIZE = HEADER_SIZE + DATA_SUBFRAME_LENGTH.size
+
+# Split a radio datagram into its sub-frames (DataPacket objects):
+def decodeRadioDatagram(data):
+  frames = []
+  pos = 0
+  while len(data) - pos >= HEADER_SIZE:
+    p = DataPacket()
+    p.VirtualCircuitId, p.SeqNum, p.Flags, p.Ack, p.Sack = DATA_HEADER.unpack_from(data, pos)
+    pos += HEADER_SIZE
+    end = len(data)
+    if p.Flags & FLAG_MORE:
+      if len(data) - pos < DATA_SUBFRAME_LENGTH.size: break
+      end = pos + DATA_SUBFRAME_LENGTH.size + DATA_SUBFRAME_LENGTH.unpack_from(data, pos)[0]
+      pos += DATA_SUBFRAME_LENGTH.size
+      if end > len(data): break # Truncated
+      p.Flags &= ~FLAG_MORE
+    p.setData(data[pos:end])
+    frames.append(p)
+    pos = end
+  return frames
 
 # Class for data packets with header to be transmitted over the DMR link:
 class DataPacket:
   def __init__(self, data = None):
     if data == None:
-      self.header = bytearray(HEADER_SIZE)
+      self.VirtualCircuitId = 0
+      self.SeqNum = 0
+      self.Flags = 0
+      self.Ack = 0
+      self.Sack = 0
       self.data = bytearray()
     else:
       assert len(data) >= HEADER_SIZE
-      self.header = bytearray(data[:HEADER_SIZE])
+      self.VirtualCircuitId, self.SeqNum, self.Flags, self.Ack, self.Sack = DATA_HEADER.unpack_from(data)
       self.data = bytearray(data[HEADER_SIZE:])
     self.ScheduledTxTime = 0
-    self.RetryCount = 0
-
-  def send(self, OtherStationIP):
-    return RadioSocket.sendto(self.header + self.data, (OtherStationIP, RADIO_UDP_PORT))
+    self.RetryCount = 0 # Number of transmissions so far
+    self.FirstTxTime = 0
+    self.FastRetransmitted = False
+    self.Queued = False # In TxSchedule, not yet confirmed
+    self.Ready = False # Due, waiting for airtime
+    self.Link = None # RadioLink of the last transmission
+    self.LinkSeq = 0 # Link seq of the datagram of the last transmission (bonding)
+
+  # Header and data as sub-frame of a radio datagram. All but the last sub-frame carry their length:
+  def encode(self, more = False):
+    if not more: return DATA_HEADER.pack(self.VirtualCircuitId, self.SeqNum, self.Flags, self.Ack, self.Sack) + self.data
+    return DATA_HEADER.pack(self.VirtualCircuitId, self.SeqNum, self.Flags | FLAG_MORE, self.Ack, self.Sack) + DATA_SUBFRAME_LENGTH.pack(len(self.data)) + self.data
+
+  def send(self, link):
+    return link.sendDatagram(self.encode())
 
   def getVirtualCircuitId(self):
-    assert len(self.header) == HEADER_SIZE
-    return (self.header[0] << 8) | self.header[1]
+    return self.VirtualCircuitId
 
   def setVirtualCircuitId(self, id):
-    assert len(self.header) == HEADER_SIZE
-    self.header[0] = id >> 8
-    self.header[1] = id & 0xFF
+    self.VirtualCircuitId = id
 
   def getSeqNum(self):
-    return self.header[2]
+    return self.SeqNum
 
   def setSeqNum(self, n):
-    self.header[2] = n
+    self.SeqNum = n
+
+  def getFlags(self):
+    return self.Flags
+
+  def setFlags(self, flags):
+    self.Flags = flags
+
+  def setAck(self, ack, sack):
+    self.Ack = ack
+    self.Sack = sack
+    self.Flags |= FLAG_ACK
 
   def getData(self):
     return self.data
@@ -95,66 +212,445 @@ class DataPacket:
   def setData(self, data):
     self.data = bytearray(data)
 
-# Class for scheduling when to transmit which packet.
-class TxSchedule:
-  def __init__(self, OtherStationIP):
-    # The list of packets (data with header) to be send over the DMR link which are not yet confirmed by the other station
-    # and therefore may needed to be resend:
-    self.UnconfirmedPackets = []
+# Top entry of a timer heap, stale entries (valid() is false) are dropped. None if the heap is empty:
+def peekTimer(timers, valid):
+  while timers:
+    if valid(timers[0]): return timers[0]
+    heapq.heappop(timers)
+  return None
+
+def isPacketTimerValid(e):
+  return e[2].Queued and e[0] == e[2].ScheduledTxTime
+
+def isAckTimerValid(e):
+  return e[0] == e[2].AckDueTime and ConList.get(e[2].VirtualCircuitId) is e[2]
+
+def isFlushTimerValid(e):
+  return e[0] == e[2].FlushDeadline and e[2].Socket is not None
+
+# One radio of this station and its partner radio at the other station:
+class RadioLink:
+  def __init__(self, Index, LocalIP, OtherStationIP):
+    self.Index = Index
     self.OtherStationIP = OtherStationIP
+    self.Socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.Socket.bind((LocalIP, RADIO_UDP_PORT))
+    self.Socket.setblocking(0)
+
+    # Timestamp of last radio tx:
+    self.LastTxTime = 0
+
+    # Rate limit adapted to this radio:
+    burst = RADIO_BURST if RADIO_BURST is not None else 2 * RADIO_MAX_UDP_PAYLOAD_SIZE
+    self.Rate = RateController(RADIO_RATE, RADIO_MIN_RATE, RADIO_MAX_RATE, burst, LatencySlack = 2 * ACK_DELAY)
+
+    # Usable payload size of this radio:
+    self.Prober = PayloadSizeProber(RADIO_MIN_UDP_PAYLOAD_SIZE, RADIO_MAX_UDP_PAYLOAD_SIZE, RADIO_START_UDP_PAYLOAD_SIZE, PROBE_INTERVAL)
+
+    # Fragments waiting for their radio slot:
+    self.PendingDatagrams = collections.deque()
 
-  # Anything in the output queue that is due to be transmitted?
-  def hasPacketToSend(self):
-    return len(self.UnconfirmedPackets) > 0 and time.time() >= self.UnconfirmedPackets[0].ScheduledTxTime
+    # Link seq, echo and up/down state (bonding only):
+    self.Monitor = LinkMonitor(LINK_TIMEOUT, ACK_DELAY)
+
+    # Stats:
+    self.SentDatagrams = 0
+    self.SentBytes = 0
+    self.ReceivedDatagrams = 0
+
+  def sendDatagram(self, buf):
+    self.Rate.consume(len(buf))
+    self.SentDatagrams += 1
+    self.SentBytes += len(buf)
+    return self.Socket.sendto(buf, (self.OtherStationIP, RADIO_UDP_PORT))
+
+  # LINK_SEQ frame to start a datagram with:
+  def makeSeqFrame(self, seq):
+    p = DataPacket()
+    p.setVirtualCircuitId(LINK_CIRCUIT_ID)
+    p.setSeqNum(LINK_SEQ)
+    p.Ack = seq
+    p.Sack = self.Monitor.getEcho()
+    return p
+
+  def close(self):
+    self.Socket.close()
+
+# Class for scheduling when to transmit which packet.
+# Unconfirmed packets are kept in a deque per virtual circuit, their (re-)transmission deadlines and the
+# deadlines of pending acknowledgements in min-heaps. Heap entries are not removed when a packet is
+# confirmed or rescheduled, they are skipped as stale when they reach the top.
+class TxSchedule:
+  def __init__(self, Links):
+    # The packets (data with header) to be send over the DMR link which are not yet confirmed by the other station
+    # and therefore may needed to be resend, indexed by virtual circuit id:
+    self.UnconfirmedPackets = {}
+    self.PacketCount = 0
+
+    # Radio links to the other station, more than one are bonded:
+    self.Links = Links
+    self.Bonding = len(Links) > 1
+
+    # Min-heaps of (deadline, tie breaker, packet/connection):
+    self.PacketTimers = []
+    self.AckTimers = []
+    self.FlushTimers = []
+    self.TimerSeq = itertools.count()
+
+    # Due packets waiting for airtime, indexed by virtual circuit id:
+    self.ReadyPackets = {}
+    self.ReadyCount = 0
+
+    # Round trip time to the other station, sets the resend time-out:
+    self.RTT = RTTEstimator(PACKET_TIMEOUT, MIN_PACKET_TIMEOUT, MAX_PACKET_TIMEOUT)
+
+    # Fragments of datagrams from the other station:
+    self.Reassembly = Reassembler(MAX_PACKET_TIMEOUT)
+    self.FragmentId = 0
+
+    # Fair share between virtual circuits, for all links together. The quantum covers a full size
+    # sub-frame (payload plus its length field), so it never needs two rounds:
+    self.Scheduler = RadioScheduler(RADIO_MAX_UDP_PAYLOAD_SIZE + DATA_SUBFRAME_LENGTH.size)
+
+    # Payload size the connections last saw, see checkPayloadSize():
+    self.LastPayloadSize = None
+
+    # Stats:
+    self.SentPackets = 0
+    self.Retransmits = 0
+    self.PureAcks = 0
+    self.SentDatagrams = 0
+    self.SentFrames = 0
+    self.FragmentedDatagrams = 0
+
+  def schedulePacket(self, p, t):
+    p.ScheduledTxTime = t
+    heapq.heappush(self.PacketTimers, (t, next(self.TimerSeq), p))
+    # Drop stale entries when they clearly outnumber the live ones:
+    if len(self.PacketTimers) > 64 + 4 * self.PacketCount:
+      self.PacketTimers = [e for e in self.PacketTimers if isPacketTimerValid(e)]
+      heapq.heapify(self.PacketTimers)
+
+  # Move all unconfirmed packets due for (re-)transmission to the ready queues of their circuits:
+  def collectDuePackets(self, now):
+    while True:
+      e = peekTimer(self.PacketTimers, isPacketTimerValid)
+      if e is None or e[0] > now: break
+      heapq.heappop(self.PacketTimers)
+      p = e[2]
+      p.Ready = True
+      c = p.getVirtualCircuitId()
+      q = self.ReadyPackets.get(c)
+      if q is None: q = self.ReadyPackets[c] = collections.deque()
+      q.append(p)
+      self.ReadyCount += 1
+      self.Scheduler.activate(c)
+
+  # Size of the next ready packet of a virtual circuit as sub-frame, None if there is none:
+  def getReadySize(self, c):
+    q = self.ReadyPackets.get(c)
+    while q:
+      if q[0].Ready: return SUBFRAME_HEADER_SIZE + len(q[0].getData())
+      q.popleft() # Confirmed meanwhile
+    return None
+
+  # The connection that has an acknowledgement due, None if none:
+  def getConnectionWithAckDue(self, now):
+    e = peekTimer(self.AckTimers, isAckTimerValid)
+    return e[2] if e is not None and e[0] <= now else None
+
+  # Pack partial radio packets whose flush deadline passed:
+  def runFlushTimers(self, now):
+    while True:
+      e = peekTimer(self.FlushTimers, isFlushTimerValid)
+      if e is None or e[0] > now: break
+      heapq.heappop(self.FlushTimers)
+      e[2].flushRadioBytes(False) # Stays pending when the window is full, flushed again on the next ACK
+
+  # Earliest deadline of all timers, None if there is none:
+  def getNextTimerTime(self):
+    t = None
+    for timers, valid in ((self.PacketTimers, isPacketTimerValid), (self.AckTimers, isAckTimerValid), (self.FlushTimers, isFlushTimerValid)):
+      e = peekTimer(timers, valid)
+      if e is not None and (t is None or e[0] < t): t = e[0]
+    if self.Bonding:
+      for link in self.Links:
+        due = link.Monitor.EchoDueTime
+        if due is not None and (t is None or due < t): t = due
+    return t
+
+  # Links that take new packets: all working ones, or all if none works (nothing better to do):
+  def getUsableLinks(self):
+    if not self.Bonding: return self.Links
+    up = [link for link in self.Links if link.Monitor.Up]
+    return up if len(up) > 0 else self.Links
+
+  # Usable payload size, packets must fit into the datagrams of every usable link:
+  def getPayloadSize(self):
+    size = min(link.Prober.PayloadSize for link in self.getUsableLinks())
+    return size - SUBFRAME_HEADER_SIZE if self.Bonding else size # LINK_SEQ frame
+
+  # The prober or a bond link going up/down changed the payload size: let every connection re-check
+  # whether it can take more client data (its selector registration only changes on touch()):
+  def checkPayloadSize(self):
+    size = self.getPayloadSize()
+    if size == self.LastPayloadSize: return
+    self.LastPayloadSize = size
+    for o in ConList.values(): o.touch()
+
+  # Anything in the output queue that is due to be transmitted over a link?
+  def hasPacketToSend(self, link):
+    if len(link.PendingDatagrams) > 0: return True
+    now = time.time()
+    if self.Bonding and (link.Monitor.isEchoDue(now) or link.Monitor.isKeepaliveDue(now)): return True
+    if link not in self.getUsableLinks(): return False
+    self.collectDuePackets(now)
+    return self.ReadyCount > 0 or self.getConnectionWithAckDue(now) is not None
+
+  # Does the rate limit allow to key the radio?
+  def canSend(self, link):
+    return link.Rate.canSend()
+
+  # Take links out of the bond that went quiet. Their unconfirmed packets are resent over the others:
+  def checkLinks(self, now):
+    if not self.Bonding: return
+    for link in self.Links:
+      if not link.Monitor.check(now): continue
+      print("Radio link", link.Index, "to", link.OtherStationIP, "is down, no answer for", LINK_TIMEOUT, "seconds.")
+      link.PendingDatagrams.clear()
+      for q in self.UnconfirmedPackets.values():
+        for p in q:
+          if p.Link is link: self.retransmitNow(p)
+
+  # LINK_SEQ frame received over a link:
+  def onLinkSeq(self, link, seq, echo):
+    if link.Monitor.onReceive(seq, echo, time.time()):
+      print("Radio link", link.Index, "to", link.OtherStationIP, "is up again.")
+
+  # Is a packet lost for sure? With bonding, a gap may just be a packet on a slower link:
+  def isLost(self, p):
+    return not self.Bonding or p.Link is None or p.Link.Monitor.isSettled(p.LinkSeq)
 
   # Put a packet in the queue to be send to the radio:
   def queuePacket(self, p):
-    self.UnconfirmedPackets.append(p)
-
-  # Send next packet and reschedule:
-  def sendNextPacket(self):
-    if not self.hasPacketToSend(): return False
-    p = self.UnconfirmedPackets[0]
-    p.send(self.OtherStationIP)
-
-    p.RetryCount += 1
-
-    # Move packet to end of queue.
-    # Packets get rescheduled and resend until reception is confirmed by other station or final timeout.
-    self.UnconfirmedPackets = self.UnconfirmedPackets[1:]
-    if p.RetryCount <= MAX_RETRY_COUNT:
-      p.ScheduledTxTime = time.time() + PACKET_TIMEOUT
-      self.UnconfirmedPackets.append(p)
-    else:
-      print("Packet for virtual circuit", p.getVirtualCircuitId(), "discarded because MAX_RETRY_COUNT reached.")
-      disconnectClient(ConList[p.getVirtualCircuitId()].Socket)
+    c = p.getVirtualCircuitId()
+    q = self.UnconfirmedPackets.get(c)
+    if q is None: q = self.UnconfirmedPackets[c] = collections.deque()
+    q.append(p)
+    p.Queued = True
+    self.PacketCount += 1
+    self.schedulePacket(p, time.time())
+
+  # Remember that a connection has to send an acknowledgement by o.AckDueTime:
+  def queueAck(self, o):
+    heapq.heappush(self.AckTimers, (o.AckDueTime, next(self.TimerSeq), o))
+
+  # Remember that a connection has to pack its pending client bytes by o.FlushDeadline:
+  def queueFlush(self, o):
+    heapq.heappush(self.FlushTimers, (o.FlushDeadline, next(self.TimerSeq), o))
+
+  # Remove a confirmed packet:
+  def removePacket(self, p):
+    if not p.Queued: return
+    q = self.UnconfirmedPackets[p.getVirtualCircuitId()]
+    if q[0] is p: q.popleft() # Usual case, packets are confirmed in order
+    else: q.remove(p)
+    p.Queued = False
+    self.PacketCount -= 1
+    if p.Ready:
+      p.Ready = False # Left in the ready queue, skipped there
+      self.ReadyCount -= 1
+
+  # Resend a packet as soon as possible (fast retransmit):
+  def retransmitNow(self, p):
+    if p.Queued and not p.Ready: self.schedulePacket(p, 0)
+
+  # Send next packet and reschedule.
+  # Further due packets and pending acknowledgements (also of other virtual circuits) are appended
+  # as sub-frames as long as they fit into the same radio datagram:
+  # With bonding every datagram starts with a LINK_SEQ frame, down links only send keepalives and echoes:
+  def sendNextPacket(self, link):
+    now = time.time()
+    if len(link.PendingDatagrams) > 0:
+      link.sendDatagram(link.PendingDatagrams.popleft())
+      return True
+    frames = []
+    sent = []
+    if link in self.getUsableLinks():
+      self.collectDuePackets(now)
+      link.Prober.checkProbeTimeout(now)
+      if PAYLOAD_SIZE_PROBING and self.ReadyCount > 0:
+        size = link.Prober.getProbeSize(now)
+        if size is not None:
+          self.sendProbe(link, size, now)
+          return True
+      self.fillFrames(link, frames, sent, now)
+    if self.Bonding:
+      if len(frames) > 0 or link.Monitor.needsKeepalive(now): seq = link.Monitor.nextSeq(now)
+      elif link.Monitor.isEchoDue(now): seq = link.Monitor.TxSeq # Pure echo, not echoed back
+      else: return False
+      for p in sent: p.LinkSeq = seq
+      frames.insert(0, link.makeSeqFrame(seq))
+    if len(frames) == 0: return False
+    self.sendFrames(link, frames)
     return True
 
+  # Collect due packets and acknowledgements for one datagram:
+  def fillFrames(self, link, frames, sent, now):
+    space = link.Prober.PayloadSize - (SUBFRAME_HEADER_SIZE if self.Bonding else 0)
+    while self.ReadyCount > 0:
+      # Circuit whose turn it is (the first packet always fits, it may just exceed the sub-frame budget):
+      c = self.Scheduler.select(self.getReadySize, space if len(frames) > 0 else None)
+      if c is None: break
+      p = self.ReadyPackets[c].popleft()
+      p.Ready = False
+      self.ReadyCount -= 1
+      if p.RetryCount > MAX_RETRY_COUNT:
+        print("Packet for virtual circuit", c, "discarded because MAX_RETRY_COUNT reached.")
+        abortCircuit(c)
+        continue
+
+      o = ConList.get(c)
+      if o is not None: o.fillAck(p) # Piggyback current acknowledgement
+      frames.append(p)
+      sent.append(p)
+      space -= SUBFRAME_HEADER_SIZE + len(p.getData())
+      self.SentPackets += 1
+      if p.RetryCount == 0: p.FirstTxTime = now
+      else:
+        # Blame the link the packet got lost on:
+        self.Retransmits += 1
+        lost = p.Link if p.Link is not None else link
+        lost.Rate.onLoss()
+        lost.Prober.onLoss(now)
+      p.Link = link
+      p.RetryCount += 1
+
+      # Packets get rescheduled and resend until reception is confirmed by other station or final timeout.
+      self.schedulePacket(p, now + self.RTT.getTimeout(p.RetryCount))
+      if o is not None: o.ackSent()
+
+    # Deliver due acknowledgements. When the radio is keyed anyway, not yet due ones ride along for free:
+    while space >= SUBFRAME_HEADER_SIZE:
+      o = self.getConnectionWithAckDue(now + ACK_DELAY if len(frames) > 0 else now)
+      if o is None: break
+      p = DataPacket()
+      p.setVirtualCircuitId(o.VirtualCircuitId)
+      o.fillAck(p)
+      frames.append(p)
+      space -= SUBFRAME_HEADER_SIZE
+      self.PureAcks += 1
+      o.ackSent()
+
+  # Send packets as one radio datagram:
+  # Datagrams bigger than the usable payload size are fragmented, the fragments go out one per radio slot:
+  def sendFrames(self, link, frames):
+    buf = bytearray()
+    last = len(frames) - 1
+    for i, p in enumerate(frames): buf += p.encode(i < last)
+    self.SentDatagrams += 1
+    self.SentFrames += len(frames)
+    if len(buf) <= link.Prober.PayloadSize: return link.sendDatagram(buf)
+    self.FragmentedDatagrams += 1
+    n = link.Prober.PayloadSize - HEADER_SIZE
+    count = -(-len(buf) // n)
+    self.FragmentId = (self.FragmentId + 1) & 0xFF
+    for i in range(count):
+      p = DataPacket()
+      p.setVirtualCircuitId(LINK_CIRCUIT_ID)
+      p.setSeqNum(LINK_FRAGMENT)
+      p.Ack = self.FragmentId
+      p.Sack = i << 8 | count
+      p.setData(buf[i * n:(i + 1) * n])
+      link.PendingDatagrams.append(p.encode())
+    return link.sendDatagram(link.PendingDatagrams.popleft())
+
+  # Probe whether datagrams of size bytes get through a link:
+  def sendProbe(self, link, size, now):
+    p = DataPacket()
+    p.setVirtualCircuitId(LINK_CIRCUIT_ID)
+    p.setSeqNum(LINK_PROBE)
+    p.Ack = link.Prober.onProbeSent(size, now, self.RTT.getTimeout(1))
+    p.setData(bytes(size - HEADER_SIZE))
+    p.send(link)
+
+  def printStats(self):
+    s = self.Scheduler.getStats()
+    print("Radio %d datagrams, %d frames, %d packets, %d retransmits, %d pure ACKs, %d fragmented datagrams" % (self.SentDatagrams,
+      self.SentFrames, self.SentPackets, self.Retransmits, self.PureAcks, self.FragmentedDatagrams))
+    for link in self.Links:
+      r = link.Rate.getStats()
+      m = link.Monitor
+      print("  Radio link %d to %s%s: rate %.0f bytes/s, SRTT %s, %d datagrams, payload size %d bytes (%s), %d probes, %d backoffs" % (link.Index,
+        link.OtherStationIP, "" if not self.Bonding else " (up)" if m.Up else " (down)", r["rate"], "%.2f s" % r["srtt"] if r["srtt"] is not None else "-",
+        link.SentDatagrams, link.Prober.PayloadSize, "fails at %d" % link.Prober.Ceiling if link.Prober.Ceiling <= RADIO_MAX_UDP_PAYLOAD_SIZE else "no failure seen",
+        link.Prober.Probes, link.Prober.Backoffs))
+      if self.Bonding:
+        print("    %d datagrams received, %d lost, %d failures" % (m.ReceivedDatagrams, m.LostDatagrams, m.Failures))
+    for c, f in s["flows"].items():
+      print("  Virtual circuit", c, "priority", f["priority"], "queue depth", self.countPacketsForVirtualCircuit(c),
+        "ready", len(self.ReadyPackets.get(c, ())), "airtime share %.1f%%" % (100 * f["airtime_share"]))
+
+  # Export the stats of the schedule and of all radio links to a HytMetrics.Registry:
+  def registerMetrics(self, registry):
+    registry.counter("hyt_data_sent_packets_total", "Data packets sent to the radio (first transmissions)", fn=lambda: self.SentPackets)
+    registry.counter("hyt_data_retransmits_total", "Data packets sent again", fn=lambda: self.Retransmits)
+    registry.counter("hyt_data_pure_acks_total", "ACKs sent without data", fn=lambda: self.PureAcks)
+    registry.counter("hyt_data_sent_frames_total", "Sub-frames sent to the radio", fn=lambda: self.SentFrames)
+    registry.counter("hyt_data_fragmented_datagrams_total", "Datagrams split into fragments", fn=lambda: self.FragmentedDatagrams)
+    registry.gauge("hyt_data_unconfirmed_packets", "Packets waiting for their ACK", fn=lambda: self.PacketCount)
+    registry.gauge("hyt_data_ready_packets", "Packets waiting for airtime", fn=lambda: self.ReadyCount)
+    registry.gauge("hyt_data_retransmit_timeout_seconds", "Current retransmission time-out", fn=lambda: self.RTT.getTimeout(1))
+    for link in self.Links:
+      labels = {"link": link.Index, "radio": link.OtherStationIP}
+      registry.counter("hyt_data_link_sent_datagrams_total", "Datagrams sent over the radio link", labels, fn=lambda link=link: link.SentDatagrams)
+      registry.counter("hyt_data_link_sent_bytes_total", "Bytes sent over the radio link", labels, fn=lambda link=link: link.SentBytes)
+      registry.counter("hyt_data_link_received_datagrams_total", "Datagrams received over the radio link", labels, fn=lambda link=link: link.ReceivedDatagrams)
+      registry.gauge("hyt_data_link_rate_bytes", "Rate limit of the radio link in bytes/s", labels, fn=lambda link=link: link.Rate.Bucket.Rate)
+      registry.gauge("hyt_data_link_payload_size_bytes", "Usable datagram payload size of the radio link", labels, fn=lambda link=link: link.Prober.PayloadSize)
+      registry.gauge("hyt_data_link_up", "1 while the link is up (bonding)", labels, fn=lambda link=link: link.Monitor.Up)
+
   def countPacketsForVirtualCircuit(self, id):
-    n = 0
-    for p in self.UnconfirmedPackets:
-      if p.getVirtualCircuitId() == id: n += 1
-    return n
+    q = self.UnconfirmedPackets.get(id)
+    return len(q) if q is not None else 0
 
   def deleteAllPacketsForVirtualCircuit(self, id):
-    for p in self.UnconfirmedPackets:
-      if p.getVirtualCircuitId() == id: self.UnconfirmedPackets.remove(p)
+    self.Scheduler.removeFlow(id)
+    self.ReadyPackets.pop(id, None)
+    q = self.UnconfirmedPackets.pop(id, None)
+    if q is None: return
+    for p in q:
+      p.Queued = False
+      if p.Ready:
+        p.Ready = False
+        self.ReadyCount -= 1
+    self.PacketCount -= len(q)
 
 # Class for handling connections:
 class Connection:
   def __init__(self, socket):
-    # The socket connected to the other TCP party:
+    # The socket connected to the other TCP party, None once the local side closed:
     self.Socket = socket
 
     # A virtual circuit id to multiplex different TCP data streams over a single DMR radio link.
     # Use random non-zero 16 bit number.
     self.VirtualCircuitId = random.randrange(1, 2**16)
 
-    # The next sequence number to assign for the next packet in this virtual circuit:
-    self.NextLocalSeqNum = random.randrange(1, 2**8)
+    # Packets in flight towards the other station, starting at a random sequence number:
+    self.SendWindow = SendWindow(TRANSMIT_WINDOW_SIZE, random.randrange(0, 2**8))
+    self.SynSent = False
 
-    # The last sequence number of the other party that we received and confirmed:
-    self.LastConfirmedRemoteSeqNum = -1
+    # Packets received from the other station, reordered:
+    self.ReceiveWindow = ReceiveWindow()
+
+    # Time an acknowledgement has to be sent at the latest, None if nothing to acknowledge:
+    self.AckDueTime = None
+
+    # Local TCP connection closed, FIN queued:
+    self.Closing = False
+
+    # Other station closed the circuit (FIN received):
+    self.RemoteClosed = False
 
     # The last time we send to the other station concerning this virtual circuit:
     self.LastTxTime = 0
@@ -165,35 +661,232 @@ class Connection:
     # Unsend data bytes (no header required) to the client because the client is busy:
     self.UnsentClientBytes = bytearray()
 
+    # Data bytes from the client not yet packed into radio packets and the time they have to go out at the latest:
+    self.UnsentRadioBytes = bytearray()
+    self.FlushDeadline = None
+    self.SentClientBytes = 0
+
+    # Airtime priority class, see PRIORITY_PORTS:
+    self.Priority = PRIORITY_INTERACTIVE
+    self.FixedPriority = False
+
+    # zlib streams when compression is used for the respective direction, None otherwise:
+    self.Compressor = None
+    self.Decompressor = None
+
+    self.CreationTime = time.time()
+
+    # Non-blocking connect to the destination host in progress:
+    self.Connecting = False
+
+    # Socket events currently registered in the selector:
+    self.Events = 0
+
   # Can this connection accept more client data?
   # We don't accept new data when there already is too much unconfirmed data flying around.
   def canAcceptMoreData(self):
-    return Schedule.countPacketsForVirtualCircuit(self.VirtualCircuitId) < TRANSMIT_WINDOW_SIZE
+    return self.Socket is not None and not self.Connecting and not self.Closing and not self.SendWindow.isFull() and len(self.UnsentRadioBytes) < self.getMaxPacketData()
+
+  # Max client bytes per radio packet:
+  def getMaxPacketData(self):
+    return Schedule.getPayloadSize() - HEADER_SIZE - (COMPRESSION_OVERHEAD if self.Compressor is not None else 0)
+
+  # Put client bytes in the queue to be send to the radio:
+  def queueRadioBytes(self, data):
+    self.UnsentRadioBytes += data
+    if self.FlushDeadline is None:
+      self.FlushDeadline = time.time() + COALESCE_DELAY
+      Schedule.queueFlush(self)
+    self.flushRadioBytes(False)
+
+  # Pack queued client bytes into radio packets. Full packets go out at once, a partial one only
+  # after the flush deadline. force ignores deadline and window (used before closing):
+  def flushRadioBytes(self, force):
+    n = self.getMaxPacketData()
+    while len(self.UnsentRadioBytes) > 0 and (force or not self.SendWindow.isFull()):
+      if not force and len(self.UnsentRadioBytes) < n and time.time() < self.FlushDeadline: break
+      p = DataPacket()
+      p.setData(self.UnsentRadioBytes[:n])
+      del self.UnsentRadioBytes[:n]
+      self.SentClientBytes += len(p.getData())
+      if not self.FixedPriority and BULK_THRESHOLD > 0 and self.SentClientBytes > BULK_THRESHOLD and self.Priority != PRIORITY_BULK:
+        self.Priority = PRIORITY_BULK
+        Schedule.Scheduler.setPriority(self.VirtualCircuitId, self.Priority)
+      print("processClientToRadio(): Sending", len(p.getData()), "bytes from virtual circuit", self.VirtualCircuitId, "to radio")
+      self.queueRadioPacket(p)
+    if len(self.UnsentRadioBytes) == 0: self.FlushDeadline = None
+    self.touch()
 
   # Put a packet in the queue to be send to the radio:
   def queueRadioPacket(self, p):
-    p.setSeqNum(self.NextLocalSeqNum)
-    self.NextLocalSeqNum = (self.NextLocalSeqNum + 1) & 0xFF
+    p.setVirtualCircuitId(self.VirtualCircuitId)
+    flags = p.getFlags() | FLAG_DATA
+    if not self.SynSent:
+      flags |= FLAG_SYN
+      if self.Compressor is not None: flags |= FLAG_COMPRESSED # Offer/accept compression
+      self.SynSent = True
+    if self.Compressor is not None and len(p.getData()) > 0:
+      # Compress once here, retransmits send the same bytes:
+      p.setData(self.Compressor.compress(p.getData()))
+      flags |= FLAG_COMPRESSED
+    p.setFlags(flags)
+    p.setSeqNum(self.SendWindow.assign(p))
     Schedule.queuePacket(p)
 
+  # Put the current acknowledgement into an outgoing packet:
+  def fillAck(self, p):
+    if self.ReceiveWindow.Synced:
+      ack, sack = self.ReceiveWindow.getAck()
+      p.setAck(ack, sack)
+
+  # A packet of this circuit went out, it carried our acknowledgement:
+  def ackSent(self):
+    self.LastTxTime = time.time()
+    self.AckDueTime = None
+    if self.RemoteClosed and not self.hasBytesToSendToClient(): removeCircuit(self) # Final ACK for the FIN sent
+
+  def scheduleAck(self, immediate):
+    due = time.time() + (0 if immediate else ACK_DELAY)
+    if self.AckDueTime is None or due < self.AckDueTime:
+      self.AckDueTime = due
+      Schedule.queueAck(self)
+
+  # Evaluate acknowledgement from the other station:
+  def processAck(self, ack, sack):
+    now = time.time()
+    acked, retransmit = self.SendWindow.processAck(ack, sack)
+    for p in acked:
+      Schedule.removePacket(p)
+      rtt = now - p.FirstTxTime if p.RetryCount == 1 else None # Karn: only unambiguous samples
+      if rtt is not None: Schedule.RTT.sample(rtt)
+      if p.Link is not None:
+        p.Link.Rate.onAck(SUBFRAME_HEADER_SIZE + len(p.getData()), rtt)
+        p.Link.Prober.onAck()
+    for p in retransmit:
+      if not Schedule.isLost(p):
+        p.FastRetransmitted = False # May still be on its way over another link, check again on the next ACK
+        continue
+      print("Fast retransmit of packet", p.getSeqNum(), "for virtual circuit", self.VirtualCircuitId)
+      Schedule.retransmitNow(p)
+    if len(acked) > 0: self.flushRadioBytes(False) # Window opened
+    if self.Closing and self.SendWindow.count() == 0:
+      print("Virtual circuit", self.VirtualCircuitId, "closed.")
+      removeCircuit(self)
+
+  # Process a packet for this circuit received from the radio:
+  def processRadioPacket(self, p):
+    self.LastRxTime = time.time()
+    flags = p.getFlags()
+    if flags & FLAG_RST:
+      print("Virtual circuit", self.VirtualCircuitId, "reset by other station.")
+      removeCircuit(self)
+      return
+    if flags & FLAG_ACK:
+      self.processAck(p.Ack, p.Sack)
+      if self.VirtualCircuitId not in ConList: return # Closed by this ACK
+    if not flags & FLAG_DATA: return
+
+    if flags & FLAG_SYN and not self.ReceiveWindow.Synced:
+      self.ReceiveWindow.sync(p.getSeqNum())
+      if flags & FLAG_COMPRESSED:
+        self.Decompressor = StreamDecompressor(CompressionDictionary)
+        # Compress our direction too when we haven't sent anything yet:
+        if COMPRESSION and not self.SynSent: self.Compressor = StreamCompressor(COMPRESSION_LEVEL, CompressionDictionary)
+    if not self.ReceiveWindow.Synced: return # Start of stream lost, wait for the SYN to be resent
+    delivered = self.ReceiveWindow.receive(p.getSeqNum(), p)
+    for q in delivered:
+      data = q.getData()
+      if len(data) > 0 and q.getFlags() & FLAG_COMPRESSED:
+        try:
+          if self.Decompressor is None: raise zlib.error("compressed data without compressed SYN")
+          data = self.Decompressor.decompress(data)
+        except zlib.error as e:
+          print("Virtual circuit", self.VirtualCircuitId, "decompression failed:", e)
+          abortCircuit(self.VirtualCircuitId)
+          return
+      if len(data) > 0:
+        print("processRadioToClient(): Sending", len(data), "bytes to virtual circuit", self.VirtualCircuitId)
+        self.queueClientBytes(data)
+      if q.getFlags() & FLAG_FIN: self.RemoteClosed = True
+    # ACK at once on duplicates and gaps (lets the sender fast retransmit), else wait for data to piggyback on:
+    self.scheduleAck(len(delivered) == 0 or self.ReceiveWindow.hasGaps() or self.RemoteClosed)
+
   def hasBytesToSendToClient(self):
-    return len(self.UnsentClientBytes) > 0
+    return len(self.UnsentClientBytes) > 0 and self.Socket is not None and not self.Connecting
 
   # Put a packet in the queue to be send to the client:
   def queueClientBytes(self, data):
     self.UnsentClientBytes += data
+    self.touch()
 
   # Send bytes to client via given socket and remove from queue:
   def sendBytesToClient(self, s):
     if not self.hasBytesToSendToClient(): return False
-    bytes = s.send(self.UnsentClientBytes)
-    self.UnsentClientBytes = self.UnsentClientBytes[bytes:]
+    try:
+      bytes = s.send(self.UnsentClientBytes)
+    except BlockingIOError:
+      return False
+    del self.UnsentClientBytes[:bytes]
+    self.touch()
     return True
 
+  # Socket events to wait for:
+  def getEvents(self):
+    if self.Socket is None: return 0
+    if self.Connecting: return selectors.EVENT_WRITE
+    events = 0
+    if self.canAcceptMoreData(): events |= selectors.EVENT_READ
+    if self.hasBytesToSendToClient(): events |= selectors.EVENT_WRITE
+    return events
+
+  # Something changed that may change the socket events to wait for:
+  def touch(self):
+    if self.Socket is not None: DirtyConnections.add(self)
+
+  # Update registration in the selector, only when the events to wait for changed:
+  def updateEvents(self):
+    events = self.getEvents()
+    if events == self.Events: return
+    if self.Events == 0: Selector.register(self.Socket, events, self)
+    elif events == 0: Selector.unregister(self.Socket)
+    else: Selector.modify(self.Socket, events, self)
+    self.Events = events
+
+  # Compression stats of this circuit:
+  def printStats(self):
+    duration = max(time.time() - self.CreationTime, 1e-3)
+    for name, z in (("sent", self.Compressor), ("received", self.Decompressor)):
+      if z is None or z.RawBytes == 0: continue
+      ratio = compressionRatio(z.RawBytes, z.CompressedBytes)
+      print("Virtual circuit", self.VirtualCircuitId, name, z.RawBytes, "bytes as", z.CompressedBytes,
+        "compressed bytes, ratio %.2f, %.0f -> %.0f bytes/s effective" % (ratio, z.CompressedBytes / duration, z.RawBytes / duration))
+      Stats[name + "_raw_bytes"] += z.RawBytes
+      Stats[name + "_compressed_bytes"] += z.CompressedBytes
+
   # Add this connection to the connection list:
   def save(self):
-    global ConList
+    global ConList, SocketList
     ConList[self.VirtualCircuitId] = self
+    if self.Socket is not None:
+      SocketList[self.Socket] = self
+      for port in getSocketPorts(self.Socket):
+        if port in PRIORITY_PORTS:
+          self.Priority = PRIORITY_PORTS[port]
+          self.FixedPriority = True
+          break
+    Schedule.Scheduler.addFlow(self.VirtualCircuitId, self.Priority)
+    self.touch()
+
+  # Close the TCP connection, the virtual circuit may live on until the other station confirmed everything:
+  def closeSocket(self):
+    if self.Socket is None: return
+    if self.Events != 0: Selector.unregister(self.Socket)
+    self.Events = 0
+    ConnectingList.pop(self, None)
+    DirtyConnections.discard(self)
+    del SocketList[self.Socket]
+    self.Socket.close()
+    self.Socket = None
 
 # Exit on CTRL+C:
 def signal_handler(signal, frame):
@@ -204,154 +897,340 @@ def signal_handler(signal, frame):
   print("Aborting...")
   AbortRequest = True
 
+# Local and remote TCP port of a socket:
+def getSocketPorts(s):
+  ports = []
+  for f in (s.getsockname, s.getpeername):
+    try:
+      ports.append(f()[1])
+    except OSError:
+      pass # Not connected (yet)
+  return ports
+
 # Find virtual circuit id by socket:
 def getVirtualCircuitIdBySocket(socket):
+  o = SocketList.get(socket)
+  return o.VirtualCircuitId if o is not None else 0
+
+# Forget a virtual circuit and close its socket:
+def removeCircuit(con):
   global ConList
-  for c in ConList:
-    o = ConList[c]
-    if o.Socket is socket: return o.VirtualCircuitId
-  return 0
+  Schedule.deleteAllPacketsForVirtualCircuit(con.VirtualCircuitId)
+  if ConList.get(con.VirtualCircuitId) is con:
+    del ConList[con.VirtualCircuitId]
+    con.printStats()
+  con.closeSocket()
+
+# Tell the other station to drop a virtual circuit:
+def sendReset(c, link = None):
+  p = DataPacket()
+  p.setVirtualCircuitId(c)
+  p.setFlags(FLAG_RST)
+  p.send(link if link is not None else Schedule.getUsableLinks()[0])
+
+# Give up a virtual circuit at once:
+def abortCircuit(c):
+  print("Aborting virtual circuit", c, ".")
+  sendReset(c)
+  if c in ConList: removeCircuit(ConList[c])
 
 # Disconnect a client:
 def disconnectClient(s):
-  global ConList
-  c = getVirtualCircuitIdBySocket(s)
-  assert c > 0
+  con = SocketList[s]
+  c = con.VirtualCircuitId
   print("Closing virtual circuit", c, ".")
-  Schedule.deleteAllPacketsForVirtualCircuit(c)
-  del ConList[c]
-  s.close()
+  con.closeSocket()
+  if con.RemoteClosed:
+    removeCircuit(con)
+    return
+  # Send FIN behind the remaining data, the circuit is removed once everything is confirmed:
+  con.flushRadioBytes(True)
+  con.Closing = True
+  p = DataPacket()
+  p.setVirtualCircuitId(c)
+  p.setFlags(FLAG_FIN)
+  con.queueRadioPacket(p)
 
 # Process packet from client socket and send with proper header to radio:
 def processClientToRadio(s):
-  global ConList, RadioSocket
+  global ConList
   #try:
-  data = s.recv(RADIO_MAX_UDP_PAYLOAD_SIZE - HEADER_SIZE)
+  try:
+    con = SocketList[s]
+    room = con.getMaxPacketData() - len(con.UnsentRadioBytes)
+    if room <= 0:
+      # The payload size shrank below the partial packet held back: send full packets first
+      # (this also updates the socket's events), read again once there is room:
+      con.flushRadioBytes(False)
+      return
+    data = s.recv(room)
+  except BlockingIOError:
+    return
+  except ConnectionError:
+    data = b''
   if len(data) == 0:
     # Connection problem - disconnect lost client:
     disconnectClient(s)
     return
-  c = getVirtualCircuitIdBySocket(s)
-  print("processClientToRadio(): Sending", len(data), "bytes from virtual circuit", c, "to radio")
-  p = DataPacket()
-  p.setVirtualCircuitId(c)
-  p.setData(data)
-  ConList[c].queueRadioPacket(p)
+  con.queueRadioBytes(data)
   #except: print("Error in ClientToRadio()!")
 
 # Process packet from radio and send to client socket:
-def processRadioToClient():
-  global ConList, RadioSocket
+def processRadioToClient(link):
+  global ConList
   #try:
-  data = RadioSocket.recv(RADIO_MAX_UDP_PAYLOAD_SIZE)
-  if len(data) < HEADER_SIZE: return # Packets without complete header are invalid
-  p = DataPacket(data)
+  try:
+    data = link.Socket.recv(RADIO_MAX_UDP_PAYLOAD_SIZE)
+  except (BlockingIOError, ConnectionRefusedError):
+    return # Nothing there or ICMP error for an earlier datagram
+  link.ReceivedDatagrams += 1
+  # Packets without complete header are invalid and yield no frames:
+  for p in decodeRadioDatagram(data): processRadioFrame(p, link)
+  #except: print("Error in RadioToClient()!")
+
+# Process one sub-frame received from the radio over a link:
+def processRadioFrame(p, link):
   c = p.getVirtualCircuitId()
+  if c == LINK_CIRCUIT_ID:
+    processLinkFrame(p, link)
+    return
+  flags = p.getFlags()
   if c not in ConList:
-    if not ALLOW_SERVER_MODE: return # Connection is unknown but we're not allowed to create it
+    if flags & FLAG_RST: return
+    if not flags & FLAG_SYN or not ALLOW_SERVER_MODE:
+      # Connection is unknown (e.g. already closed) or we're not allowed to create it:
+      sendReset(c, link)
+      return
     print("Forwarding new virtual circuit", c, "to", DESTINATION_HOST, "port", DESTINATION_PORT, "...")
-    newsocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    newsocket.connect((DESTINATION_HOST, DESTINATION_PORT))
+    newsocket = socket.socket(DestinationAddr[0], socket.SOCK_STREAM)
     newsocket.setblocking(0)
+    err = newsocket.connect_ex(DestinationAddr[4])
+    if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+      print("Connection to", DESTINATION_HOST, "port", DESTINATION_PORT, "failed:", os.strerror(err))
+      newsocket.close()
+      sendReset(c, link)
+      return
     newcon = Connection(newsocket)
     newcon.VirtualCircuitId = c
+    if DESTINATION_PORT in PRIORITY_PORTS:
+      newcon.Priority = PRIORITY_PORTS[DESTINATION_PORT]
+      newcon.FixedPriority = True
+    if err != 0:
+      # Wait for the socket to become writable, data from the radio is queued meanwhile:
+      newcon.Connecting = True
+      ConnectingList[newcon] = time.time() + CONNECT_TIMEOUT
     newcon.save()
-  print("processRadioToClient(): Sending", len(data) - HEADER_SIZE, "bytes to virtual circuit", c)
-  ConList[c].queueClientBytes(p.getData())
-  #Schedule.queueAckForPacket(p) !TODO!
-  #except: print("Error in RadioToClient()!")
-
-print("HytDataBridge 0.01")
-AbortRequest = False
-signal.signal(signal.SIGINT, signal_handler)
-
-# Shake it!
-random.seed()
-
-# Create and bind radio socket:
-RadioSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-RadioSocket.bind((LOCAL_RADIO_NET_IP, RADIO_UDP_PORT))
-RadioSocket.setblocking(0)
-
-# Create transmit schedule:
-Schedule = TxSchedule("127.0.0.1") # TODO: Compute IP from DMR-ID!
-
-# Create empty dict of open connections indexed by virtual circuit id:
-ConList = {}
-
-# Timestamp of last radio tx:
-LastRadioTxTime = 0
-
-# Create and bind client socket for connections from clients which like to be forwarded:
-if ALLOW_CLIENT_MODE:
-  ClientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-  ClientSocket.bind((LOCAL_CLIENT_NET_IP, LOCAL_TCP_PORT))
-  ClientSocket.listen()
-  print("Waiting for incoming TCP client connections on port", LOCAL_TCP_PORT,"of interface", LOCAL_CLIENT_NET_IP, "...")
-
-# Main Loop
-while not AbortRequest:
-  #print("main loop is alive")
-
-  # Create lists of sockets to watch:
-  InList = [RadioSocket]
-  OutList = []
-  if ALLOW_CLIENT_MODE: InList.append(ClientSocket)
-  for c in ConList:
-    o = ConList[c]
-    if o.hasBytesToSendToClient(): OutList.append(o.Socket)
-    if o.canAcceptMoreData(): InList.append(o.Socket)
-
-  # When rate limit allows to send new packets to the radio and someone has packets to send:
-  if time.time() - LastRadioTxTime >= RADIO_MIN_TIME_BETWEEN_PACKETS and Schedule.hasPacketToSend(): OutList.append(RadioSocket)
-
-  # Wait for activity on sockets or timeout:
-  readable, writable, exceptional = select.select(InList, OutList, InList, RADIO_MIN_TIME_BETWEEN_PACKETS)
-  if AbortRequest: break
-
-  # Check all sockets ready to be read:
-  for s in readable:
-    if s is RadioSocket:
-      # New data from radio received:
-      processRadioToClient()
-    elif ALLOW_CLIENT_MODE and s is ClientSocket:
-      # New connection request:
-      newsocket, addr = s.accept()
-      newsocket.setblocking(0)
-      newcon = Connection(newsocket)
-      print("New client connection from", addr, "creating new virtual circuit", newcon.VirtualCircuitId, "...")
-      newcon.save()
-    else:
-      # Data from TCP client connection received:
-      processClientToRadio(s)
-
-  # Check all sockets ready for write:
-  for s in writable:
-    if s is RadioSocket:
-      Schedule.sendNextPacket()
-      LastRadioTxTime = time.time()
-    else:
-      c = getVirtualCircuitIdBySocket(s)
-      assert c > 0
-      try:
-        ConList[c].sendBytesToClient(s)
-      except BrokenPipeError:
-        print("TCP-connection for virtual circuit", c, "closed by client!")
-        disconnectClient(s)
-
-  # Clean up defective sockets:
-  for s in exceptional:
-    if s is RadioSocket:
-      print("FATAL ERROR: radio UDP socket failed!")
-      AbortRequest = True
-      break
-    if ALLOW_CLIENT_MODE and s is ClientSocket:
-      print("FATAL ERROR: client listener socket failed!")
-      AbortRequest = True
-      break
+  ConList[c].processRadioPacket(p)
+
+# Process a link control frame received from the radio over a link:
+def processLinkFrame(p, link):
+  t = p.getSeqNum()
+  if t == LINK_PROBE:
+    # Tell the other station the probe got through (over the same link):
+    reply = DataPacket()
+    reply.setVirtualCircuitId(LINK_CIRCUIT_ID)
+    reply.setSeqNum(LINK_PROBE_ACK)
+    reply.Ack = p.Ack
+    reply.Sack = HEADER_SIZE + len(p.getData())
+    reply.send(link)
+  elif t == LINK_PROBE_ACK:
+    link.Prober.onProbeAck(p.Sack)
+  elif t == LINK_FRAGMENT:
+    data = Schedule.Reassembly.add(p.Ack, p.Sack >> 8, p.Sack & 0xFF, p.getData(), time.time())
+    if data is not None:
+      for q in decodeRadioDatagram(data): processRadioFrame(q, link)
+  elif t == LINK_SEQ:
+    Schedule.onLinkSeq(link, p.Ack, p.Sack)
+
+# Non-blocking connect to the destination host finished:
+def finishConnect(con):
+  del ConnectingList[con]
+  con.Connecting = False
+  err = con.Socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+  if err != 0:
+    print("Connection to", DESTINATION_HOST, "port", DESTINATION_PORT, "for virtual circuit", con.VirtualCircuitId, "failed:", os.strerror(err))
+    abortCircuit(con.VirtualCircuitId)
+    return
+  con.touch()
+
+# Give up connects the destination host did not answer in time:
+def checkConnectTimeouts(now):
+  for con, deadline in list(ConnectingList.items()):
+    if now < deadline: continue
+    print("Connection to", DESTINATION_HOST, "port", DESTINATION_PORT, "for virtual circuit", con.VirtualCircuitId, "timed out.")
+    abortCircuit(con.VirtualCircuitId)
+
+# Accept a new client connection:
+def acceptClient():
+  try:
+    newsocket, addr = ClientSocket.accept()
+  except BlockingIOError:
+    return
+  newsocket.setblocking(0)
+  newcon = Connection(newsocket)
+  print("New client connection from", addr, "creating new virtual circuit", newcon.VirtualCircuitId, "...")
+  if COMPRESSION: newcon.Compressor = StreamCompressor(COMPRESSION_LEVEL, CompressionDictionary)
+  newcon.save()
+  # Open the virtual circuit at the other station right away:
+  newcon.queueRadioPacket(DataPacket())
+
+# Send queued bytes to a TCP client:
+def processRadioBytesToClient(con):
+  s = con.Socket
+  try:
+    con.sendBytesToClient(s)
+  except (BrokenPipeError, ConnectionResetError):
+    print("TCP-connection for virtual circuit", con.VirtualCircuitId, "closed by client!")
     disconnectClient(s)
-
-print("Exit!")
-if ALLOW_CLIENT_MODE: ClientSocket.close()
-RadioSocket.close()
-sys.exit(0)
+    return
+  # Other station closed the circuit and everything is delivered:
+  if con.RemoteClosed and not con.hasBytesToSendToClient(): removeCircuit(con)
+
+# Seconds to wait for socket events until the next timer or radio transmission is due:
+def getSelectTimeout(now):
+  wake = Schedule.getNextTimerTime()
+  if wake is None: wake = now + MAX_SELECT_TIMEOUT
+  for link in Links:
+    if Schedule.hasPacketToSend(link):
+      wake = min(wake, max(link.LastTxTime + RADIO_MIN_TIME_BETWEEN_PACKETS, now + link.Rate.timeToSend()))
+  if len(ConnectingList) > 0: wake = min(wake, min(ConnectingList.values()))
+  return min(MAX_SELECT_TIMEOUT, max(0, wake - now))
+
+if __name__ == "__main__":
+  # Settings from the command line (NAME=VALUE, see HytConfig.py):
+  HytConfig.applyOverrides(globals(), sys.argv[1:])
+
+  print("HytDataBridge 0.01")
+  AbortRequest = False
+  signal.signal(signal.SIGINT, signal_handler)
+
+  # Shake it!
+  random.seed()
+
+  # Create and bind radio sockets, one per link:
+  if len(RADIO_LINKS) > 0:
+    Links = [RadioLink(i, ip, dmrIdToIP(id, DMR_SUBNET_PREFIX)) for i, (ip, id) in enumerate(RADIO_LINKS)]
+  else:
+    Links = [RadioLink(0, LOCAL_RADIO_NET_IP, dmrIdToIP(OTHER_STATION_DMR_ID, DMR_SUBNET_PREFIX) if OTHER_STATION_DMR_ID is not None else OTHER_STATION_IP)]
+  for link in Links: print("Radio link", link.Index, "to", link.OtherStationIP)
+
+  # Load preset dictionary for compression:
+  CompressionDictionary = None
+  if COMPRESSION_DICTIONARY_FILE is not None:
+    with open(COMPRESSION_DICTIONARY_FILE, "rb") as f: CompressionDictionary = f.read()
+
+  # Compression totals of closed virtual circuits:
+  Stats = {"sent_raw_bytes": 0, "sent_compressed_bytes": 0, "received_raw_bytes": 0, "received_compressed_bytes": 0}
+
+  # Create transmit schedule:
+  Schedule = TxSchedule(Links)
+
+  # Create empty dict of open connections indexed by virtual circuit id:
+  ConList = {}
+
+  # Create empty dict of open connections indexed by their TCP socket:
+  SocketList = {}
+
+  # Timestamp of last stats output:
+  LastStatsTime = time.time()
+
+  # Resolve destination host once, connects must not block on name lookups:
+  if ALLOW_SERVER_MODE: DestinationAddr = socket.getaddrinfo(DESTINATION_HOST, DESTINATION_PORT, 0, socket.SOCK_STREAM)[0]
+
+  # Longest time in seconds to sleep in select() (abort requests and stats are checked in between):
+  MAX_SELECT_TIMEOUT = 1
+
+  # Socket event loop:
+  Selector = selectors.DefaultSelector()
+  for link in Links: Selector.register(link.Socket, selectors.EVENT_READ, link)
+
+  # Connections whose socket events may have changed since the last pass:
+  DirtyConnections = set()
+
+  # Server connections with connect in progress and their time-out:
+  ConnectingList = {}
+
+  # Metrics, radio datagram handling is timed in the main loop:
+  RadioTime = None
+  if METRICS_PORT is not None:
+    Metrics = HytMetrics.Registry()
+    Schedule.registerMetrics(Metrics)
+    Metrics.gauge("hyt_data_connections", "Open virtual circuits (ConList)", fn=lambda: len(ConList))
+    Metrics.gauge("hyt_data_connecting", "Connections to the destination host in progress", fn=lambda: len(ConnectingList))
+    for name in ("sent", "received"):
+      Metrics.counter("hyt_data_%s_raw_bytes_total" % name, "Bytes %s before compression, closed virtual circuits" % name, fn=lambda name=name: Stats[name + "_raw_bytes"])
+      Metrics.counter("hyt_data_%s_compressed_bytes_total" % name, "Bytes %s after compression, closed virtual circuits" % name, fn=lambda name=name: Stats[name + "_compressed_bytes"])
+    RadioTime = Metrics.histogram("hyt_data_radio_handling_seconds", "Time to handle one datagram from the radio")
+    Metrics.serve(METRICS_PORT, METRICS_IP)
+
+  # Create and bind client socket for connections from clients which like to be forwarded:
+  if ALLOW_CLIENT_MODE:
+    ClientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    ClientSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Restart while old connections linger in TIME_WAIT
+    ClientSocket.bind((LOCAL_CLIENT_NET_IP, LOCAL_TCP_PORT))
+    ClientSocket.listen()
+    ClientSocket.setblocking(0)
+    Selector.register(ClientSocket, selectors.EVENT_READ)
+    print("Waiting for incoming TCP client connections on port", LOCAL_TCP_PORT,"of interface", LOCAL_CLIENT_NET_IP, "...")
+
+  # Main Loop
+  while not AbortRequest:
+    #print("main loop is alive")
+
+    if STATS_INTERVAL > 0 and time.time() - LastStatsTime >= STATS_INTERVAL:
+      Schedule.printStats()
+      LastStatsTime = time.time()
+
+    now = time.time()
+    Schedule.runFlushTimers(now)
+    Schedule.checkLinks(now)
+    checkConnectTimeouts(now)
+
+    # When rate limit allows to send new packets to a radio and someone has packets to send:
+    for link in Links:
+      if now - link.LastTxTime >= RADIO_MIN_TIME_BETWEEN_PACKETS and Schedule.canSend(link) and Schedule.hasPacketToSend(link):
+        Schedule.sendNextPacket(link)
+        link.LastTxTime = now
+
+    # Register changed socket events:
+    Schedule.checkPayloadSize()
+    while DirtyConnections: DirtyConnections.pop().updateEvents()
+
+    # Wait for activity on sockets or timeout:
+    events = Selector.select(getSelectTimeout(time.time()))
+    if AbortRequest: break
+
+    for key, mask in events:
+      s = key.fileobj
+      if isinstance(key.data, RadioLink):
+        # New data from radio received:
+        if RadioTime is None: processRadioToClient(key.data)
+        else:
+          start = time.perf_counter_ns()
+          processRadioToClient(key.data)
+          RadioTime.observe((time.perf_counter_ns() - start) / 1000000000)
+      elif ALLOW_CLIENT_MODE and s is ClientSocket:
+        # New connection request:
+        acceptClient()
+      else:
+        con = key.data
+        if con.Socket is not s: continue # Closed meanwhile
+        if con.Connecting:
+          finishConnect(con)
+          continue
+        # Data from TCP client connection received:
+        if mask & selectors.EVENT_READ: processClientToRadio(s)
+        # TCP client ready for more data:
+        if mask & selectors.EVENT_WRITE and con.Socket is s: processRadioBytesToClient(con)
+
+  print("Exit!")
+  Schedule.printStats()
+  for c in ConList: ConList[c].printStats()
+  for name in ("sent", "received"):
+    if Stats[name + "_raw_bytes"] > 0:
+      print("Total", name, Stats[name + "_raw_bytes"], "bytes as", Stats[name + "_compressed_bytes"],
+        "compressed bytes, ratio %.2f" % compressionRatio(Stats[name + "_raw_bytes"], Stats[name + "_compressed_bytes"]))
+  Selector.close()
+  if ALLOW_CLIENT_MODE: ClientSocket.close()
+  for link in Links: link.close()
+  sys.exit(0)
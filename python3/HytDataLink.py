@@ -0,0 +1,389 @@
+#!/usr/bin/python3
+
+# Sliding window ARQ building blocks for the DMR data link (see HytDataBridge.py).
+#
+# Every radio packet carries the header DATA_HEADER from HytCodec:
+#   virtual circuit id (16 bit), seq (8 bit), flags (8 bit), ack (8 bit), sack (16 bit)
+# seq numbers the packets of one direction of a virtual circuit. ack is cumulative: the receiver got
+# every packet before ack. Bit i of sack means packet ack + 1 + i arrived out of order. ack/sack are
+# sent on every packet (piggybacked on data) when FLAG_ACK is set, pure ACKs are packets without
+# FLAG_DATA. Sequence arithmetic is modulo 256, so windows must stay well below 128 packets.
+# This 7 byte header is not compatible with the 3 byte header (virtual circuit id, seq) of the original
+# HytDataBridge, which had no flags and no acknowledgements. Stations of both versions can not talk to
+# each other, so all stations of a network have to be updated together.
+# One radio datagram may carry several such packets (sub-frames, possibly of different circuits).
+# All but the last have FLAG_MORE set and a 16 bit data length after the header.
+#
+# Compression: a SYN with FLAG_COMPRESSED announces that the sender compresses its direction of the
+# circuit with one zlib stream and that it accepts a compressed stream in return. The answering side
+# compresses its own direction only when it was offered. Payloads are compressed once when queued, so
+# retransmits carry identical bytes, and decompressed in sequence order at delivery.
+
+import zlib
+
+# Header flags:
+FLAG_DATA = 0x01 # seq is valid, packet is part of the reliable stream (may carry 0 bytes)
+FLAG_ACK = 0x02 # ack and sack are valid
+FLAG_SYN = 0x04 # seq is the first seq of this direction of the circuit
+FLAG_FIN = 0x08 # Sender closed the circuit, last packet of the stream
+FLAG_RST = 0x10 # Circuit unknown or aborted, receiver drops it at once
+FLAG_COMPRESSED = 0x20 # Payload is part of the circuit's zlib stream (on SYN: compression offered)
+FLAG_MORE = 0x40 # Another sub-frame follows in the same datagram, DATA_SUBFRAME_LENGTH follows the header
+
+SACK_BITS = 16
+MAX_WINDOW_SIZE = SACK_BITS + 1 # Largest window the receiver can acknowledge selectively
+
+# Number of packets SACKed behind an unacknowledged packet that trigger a fast retransmit:
+FAST_RETRANSMIT_THRESHOLD = 3
+
+# Signed distance a - b of two 8 bit sequence numbers:
+def seqDiff(a, b):
+  return ((a - b + 128) & 0xFF) - 128
+
+# Retransmission timeout from smoothed round trip time (RFC 6298):
+class RTTEstimator:
+  def __init__(self, InitialRTO = 10, MinRTO = 1, MaxRTO = 60):
+    self.MinRTO = MinRTO
+    self.MaxRTO = MaxRTO
+    self.SRTT = None
+    self.RTTVAR = None
+    self.RTO = InitialRTO
+    self.Samples = 0
+
+  # New round trip measurement (only from packets that were not retransmitted, Karn's algorithm):
+  def sample(self, rtt):
+    if self.SRTT is None:
+      self.SRTT = rtt
+      self.RTTVAR = rtt / 2
+    else:
+      self.RTTVAR = 0.75 * self.RTTVAR + 0.25 * abs(self.SRTT - rtt)
+      self.SRTT = 0.875 * self.SRTT + 0.125 * rtt
+    self.RTO = min(self.MaxRTO, max(self.MinRTO, self.SRTT + 4 * self.RTTVAR))
+    self.Samples += 1
+
+  # Timeout for the n-th transmission of a packet (exponential backoff):
+  def getTimeout(self, RetryCount):
+    return min(self.MaxRTO, self.RTO * (2 ** max(0, RetryCount - 1)))
+
+# Sender side of one direction of a virtual circuit.
+# Tracks the packets in flight and evaluates incoming ack/sack fields.
+class SendWindow:
+  def __init__(self, size, InitialSeq):
+    assert 1 <= size <= MAX_WINDOW_SIZE
+    self.Size = size
+    self.NextSeq = InitialSeq
+    self.InitialSeq = InitialSeq
+    self.Unacked = {} # seq -> packet, insertion order = send order
+
+  def isFull(self):
+    return len(self.Unacked) >= self.Size
+
+  def count(self):
+    return len(self.Unacked)
+
+  # Assign the next seq number to a packet and put it in flight:
+  def assign(self, p):
+    seq = self.NextSeq
+    self.NextSeq = (seq + 1) & 0xFF
+    self.Unacked[seq] = p
+    return seq
+
+  # Evaluate ack/sack. Returns (acked packets, packets to fast retransmit).
+  def processAck(self, ack, sack):
+    if len(self.Unacked) == 0: return [], []
+    oldest = next(iter(self.Unacked))
+    if seqDiff(ack, oldest) < 0 or seqDiff(self.NextSeq, ack) < 0: return [], [] # Outside window, stale
+
+    acked = []
+    for seq in list(self.Unacked):
+      if seqDiff(ack, seq) > 0: acked.append(self.Unacked.pop(seq))
+    highest = None
+    for i in range(SACK_BITS):
+      if sack & (1 << i):
+        seq = (ack + 1 + i) & 0xFF
+        highest = seq
+        p = self.Unacked.pop(seq, None)
+        if p is not None: acked.append(p)
+
+    retransmit = []
+    if highest is not None:
+      for seq, p in self.Unacked.items():
+        if seqDiff(highest, seq) <= 0: break
+        # Count packets SACKed behind this one:
+        behind = sum(1 for i in range(SACK_BITS) if sack & (1 << i) and seqDiff((ack + 1 + i) & 0xFF, seq) > 0)
+        if behind >= FAST_RETRANSMIT_THRESHOLD and not p.FastRetransmitted:
+          p.FastRetransmitted = True
+          retransmit.append(p)
+    return acked, retransmit
+
+# Receiver side of one direction of a virtual circuit.
+# Buffers out-of-order packets and releases them in sequence.
+class ReceiveWindow:
+  def __init__(self):
+    self.Synced = False
+    self.RcvNext = 0 # Next seq expected in order
+    self.OutOfOrder = {} # seq -> packet
+    self.Duplicates = 0
+    self.Reordered = 0
+
+  def sync(self, seq):
+    self.Synced = True
+    self.RcvNext = seq
+    self.OutOfOrder.clear()
+
+  # Accept a packet. Returns the list of packets now deliverable in order.
+  def receive(self, seq, p):
+    d = seqDiff(seq, self.RcvNext)
+    if d < 0 or seq in self.OutOfOrder:
+      self.Duplicates += 1 # Our ACK was lost, the caller acknowledges again
+      return []
+    if d > SACK_BITS: return [] # Beyond what we can acknowledge
+    if d > 0: self.Reordered += 1
+    self.OutOfOrder[seq] = p
+    out = []
+    while self.RcvNext in self.OutOfOrder:
+      out.append(self.OutOfOrder.pop(self.RcvNext))
+      self.RcvNext = (self.RcvNext + 1) & 0xFF
+    return out
+
+  def hasGaps(self):
+    return len(self.OutOfOrder) > 0
+
+  # Current (ack, sack) to send to the other station:
+  def getAck(self):
+    sack = 0
+    for seq in self.OutOfOrder:
+      sack |= 1 << (seqDiff(seq, self.RcvNext) - 1)
+    return self.RcvNext, sack
+
+# Every compressed payload ends with a zlib sync flush marker, which is stripped before sending:
+SYNC_FLUSH_MARKER = b'\x00\x00\xff\xff'
+
+# Max bytes a payload can grow when compressed (incompressible data, block headers, stream header):
+COMPRESSION_OVERHEAD = 16
+
+# Compressing side of one direction of a virtual circuit.
+# Both ends have to use the same preset dictionary (or none), zlib checks this on the first packet.
+class StreamCompressor:
+  def __init__(self, level = 9, dictionary = None):
+    if dictionary: self.z = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=dictionary)
+    else: self.z = zlib.compressobj(level)
+    self.RawBytes = 0
+    self.CompressedBytes = 0
+
+  def compress(self, data):
+    out = self.z.compress(data) + self.z.flush(zlib.Z_SYNC_FLUSH)
+    if out.endswith(SYNC_FLUSH_MARKER): out = out[:-len(SYNC_FLUSH_MARKER)]
+    self.RawBytes += len(data)
+    self.CompressedBytes += len(out)
+    return out
+
+# Decompressing side of one direction of a virtual circuit. Raises zlib.error on corrupt input
+# or a dictionary mismatch.
+class StreamDecompressor:
+  def __init__(self, dictionary = None):
+    if dictionary: self.z = zlib.decompressobj(zlib.MAX_WBITS, zdict=dictionary)
+    else: self.z = zlib.decompressobj()
+    self.RawBytes = 0
+    self.CompressedBytes = 0
+
+  def decompress(self, data):
+    out = self.z.decompress(data + SYNC_FLUSH_MARKER)
+    self.RawBytes += len(out)
+    self.CompressedBytes += len(data)
+    return out
+
+# Ratio raw / compressed bytes (> 1 means airtime saved):
+def compressionRatio(RawBytes, CompressedBytes):
+  return RawBytes / CompressedBytes if CompressedBytes > 0 else 1.0
+
+# Link control: frames with virtual circuit id 0 belong to no circuit. Their seq field holds the type:
+LINK_CIRCUIT_ID = 0
+LINK_PROBE = 1 # Payload size probe, data is padding. ack = probe id
+LINK_PROBE_ACK = 2 # Probe received. ack = probe id, sack = size of the probe datagram
+LINK_FRAGMENT = 3 # Part of a datagram too big for the radio. ack = datagram id, sack = index << 8 | count
+LINK_SEQ = 4 # Bonding, first frame of every datagram. ack = link seq, sack = 0x100 | last link seq received (0: none yet)
+
+# IP address of a radio, the codeplug maps the 24 bit DMR-ID to Prefix.x.y.z:
+def dmrIdToIP(DmrId, Prefix = 10):
+  return "%d.%d.%d.%d" % (Prefix, (DmrId >> 16) & 0xFF, (DmrId >> 8) & 0xFF, DmrId & 0xFF)
+
+# Finds the largest radio datagram that gets through: binary search between the largest size known
+# to work (PayloadSize) and the smallest size known to fail (Ceiling), one probe at a time. When
+# several packets in a row need a retransmit without any acknowledgement in between, the radio is
+# struggling and PayloadSize is halved. Failed sizes are retried after ResetInterval seconds.
+class PayloadSizeProber:
+  def __init__(self, MinSize, MaxSize, StartSize, ProbeInterval = 10, ResetInterval = 600, Retries = 2,
+      LossThreshold = 3, Granularity = 16):
+    self.MinSize = MinSize
+    self.MaxSize = MaxSize
+    self.PayloadSize = min(MaxSize, max(MinSize, StartSize))
+    self.Ceiling = MaxSize + 1
+    self.CeilingTime = 0
+    self.ProbeInterval = ProbeInterval
+    self.ResetInterval = ResetInterval
+    self.Retries = Retries # Probes of one size lost before it counts as too big
+    self.LossThreshold = LossThreshold
+    self.Granularity = Granularity # Search stops when PayloadSize is this close to Ceiling
+
+    self.ProbeId = 0
+    self.ProbeSize = None # Size of the outstanding probe
+    self.ProbeDeadline = 0
+    self.ProbeTries = 0
+    self.LastProbeTime = 0
+    self.LossCount = 0
+
+    # Stats:
+    self.Probes = 0
+    self.Backoffs = 0
+
+  def _setCeiling(self, size, now):
+    self.Ceiling = size
+    self.CeilingTime = now
+
+  # Size to probe now, None if no probe is needed:
+  def getProbeSize(self, now):
+    if self.ProbeSize is not None or now - self.LastProbeTime < self.ProbeInterval: return None
+    if self.Ceiling <= self.MaxSize and now - self.CeilingTime > self.ResetInterval: self.Ceiling = self.MaxSize + 1
+    if self.Ceiling - self.PayloadSize <= self.Granularity: return None
+    if self.PayloadSize == self.MaxSize: return None
+    return min(self.MaxSize, (self.PayloadSize + self.Ceiling) // 2)
+
+  # Returns the id to put into the probe:
+  def onProbeSent(self, size, now, timeout):
+    self.ProbeId = (self.ProbeId + 1) & 0xFF
+    self.ProbeSize = size
+    self.ProbeDeadline = now + timeout
+    self.LastProbeTime = now
+    self.Probes += 1
+    return self.ProbeId
+
+  # A probe of size bytes got through (also late ones, they prove the size just as well):
+  def onProbeAck(self, size):
+    if size == self.ProbeSize:
+      self.ProbeSize = None
+      self.ProbeTries = 0
+    if size > self.PayloadSize:
+      self.PayloadSize = min(self.MaxSize, size)
+      if self.Ceiling <= self.PayloadSize: self.Ceiling = self.MaxSize + 1
+
+  def checkProbeTimeout(self, now):
+    if self.ProbeSize is None or now < self.ProbeDeadline: return
+    self.ProbeTries += 1
+    if self.ProbeTries >= self.Retries:
+      self._setCeiling(self.ProbeSize, now)
+      self.ProbeTries = 0
+    else:
+      self.LastProbeTime = 0 # Try the same size again right away
+    self.ProbeSize = None
+
+  # A packet needed a retransmit:
+  def onLoss(self, now):
+    self.LossCount += 1
+    if self.LossCount < self.LossThreshold: return
+    self.LossCount = 0
+    if self.PayloadSize > self.MinSize:
+      self._setCeiling(self.PayloadSize, now)
+      self.PayloadSize = max(self.MinSize, self.PayloadSize // 2)
+      self.Backoffs += 1
+
+  # A packet was acknowledged:
+  def onAck(self):
+    self.LossCount = 0
+
+# Collects the fragments of datagrams split by the sender:
+class Reassembler:
+  def __init__(self, Timeout = 60):
+    self.Timeout = Timeout
+    self.Datagrams = {} # id -> [count, {index: data}, time of first fragment]
+
+  # Add a fragment. Returns the complete datagram once all fragments are there, else None.
+  def add(self, id, index, count, data, now):
+    if count == 0 or index >= count: return None
+    d = self.Datagrams.get(id)
+    if d is None or d[0] != count or now - d[2] > self.Timeout:
+      d = self.Datagrams[id] = [count, {}, now]
+    d[1][index] = bytes(data)
+    if len(d[1]) < count: return None
+    del self.Datagrams[id]
+    return b''.join(d[1][i] for i in range(count))
+
+# State of one radio link of a bond, based on per link sequence numbers. Datagrams that need an
+# answer get the next link seq, the other station echoes the last link seq it received in its own
+# datagrams on the same link (pure echoes reuse the current seq, so they are not echoed back).
+# A radio delivers in order: once seq n is echoed, every datagram up to n either arrived or is lost
+# on this link. This tells loss on one link apart from reordering between links. A link whose
+# datagrams stay unechoed for Timeout seconds is down until an echo (e.g. for a keepalive) arrives.
+class LinkMonitor:
+  def __init__(self, Timeout = 30, EchoDelay = 0.3):
+    self.Timeout = Timeout
+    self.EchoDelay = EchoDelay # Time an echo may wait for a datagram to ride on
+    self.Up = True
+    self.TxSeq = 0 # Last seq sent
+    self.TxTimes = {} # Unechoed seq -> send time, oldest first
+    self.EchoedSeq = 0 # Last seq echoed by the other station
+    self.RxSeq = 0 # Last seq received from the other station
+    self.EchoDueTime = None
+    self.LastKeepaliveTime = 0
+
+    # Stats:
+    self.ReceivedDatagrams = 0
+    self.LostDatagrams = 0 # Gaps in the received seqs
+    self.Failures = 0
+
+  # Seq for a datagram that has to be echoed:
+  def nextSeq(self, now):
+    self.TxSeq = (self.TxSeq + 1) & 0xFF
+    self.TxTimes[self.TxSeq] = now
+    return self.TxSeq
+
+  # Value for the sack field of a LINK_SEQ frame, the echo is delivered with it:
+  def getEcho(self):
+    self.EchoDueTime = None
+    return 0x100 | self.RxSeq if self.ReceivedDatagrams > 0 else 0
+
+  # LINK_SEQ frame received. Returns True if the link just came back up:
+  def onReceive(self, seq, echo, now):
+    d = seqDiff(seq, self.RxSeq)
+    if d > 0:
+      if self.ReceivedDatagrams > 0: self.LostDatagrams += d - 1
+      self.ReceivedDatagrams += 1
+      self.RxSeq = seq
+      if self.EchoDueTime is None: self.EchoDueTime = now + self.EchoDelay
+    if not echo & 0x100: return False
+    echo &= 0xFF
+    if seqDiff(echo, self.EchoedSeq) <= 0 or seqDiff(self.TxSeq, echo) < 0: return False # Old or bogus
+    self.EchoedSeq = echo
+    while self.TxTimes:
+      s = next(iter(self.TxTimes))
+      if seqDiff(echo, s) < 0: break
+      del self.TxTimes[s]
+    if self.Up: return False
+    self.Up = True
+    return True
+
+  def isEchoDue(self, now):
+    return self.EchoDueTime is not None and self.EchoDueTime <= now
+
+  # Has the datagram with this seq arrived or is it lost for sure?
+  def isSettled(self, seq):
+    return seqDiff(self.EchoedSeq, seq) >= 0
+
+  # A down link is probed every Timeout / 2 seconds:
+  def isKeepaliveDue(self, now):
+    return not self.Up and now - self.LastKeepaliveTime >= self.Timeout / 2
+
+  def needsKeepalive(self, now):
+    if not self.isKeepaliveDue(now): return False
+    self.LastKeepaliveTime = now
+    self.TxTimes.clear() # Only the answer to the newest keepalive matters
+    return True
+
+  # Returns True if the link just went down:
+  def check(self, now):
+    if not self.Up or not self.TxTimes or now - next(iter(self.TxTimes.values())) < self.Timeout: return False
+    self.Up = False
+    self.Failures += 1
+    self.TxTimes.clear()
+    self.LastKeepaliveTime = now
+    return True
@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+
+# Adaptive jitter buffer for the RTP receive path.
+# Packets are ordered by (unwrapped) RTP sequence number and released on a playout timeline derived
+# from their RTP timestamps plus an adaptive delay. Missing packets are concealed with silence or by
+# repeating the last frame, packets arriving after their playout time are dropped and counted.
+# The delay follows the interarrival jitter estimate from RFC 3550 (section 6.4.1): it grows at once
+# when packets arrive too late and shrinks only between talkspurts, so a call is never cut.
+# A sequence number or timestamp far away from the playout position (e.g. the repeater starting a new
+# sequence for the next call) starts a new talkspurt instead of being dropped as late or waited for.
+
+# How to fill the gap of a lost packet:
+CONCEAL_SILENCE = 0
+CONCEAL_REPEAT = 1
+
+class JitterBuffer:
+  def __init__(self, SampleRate = 8000, MinDelay = 0.04, MaxDelay = 0.4, JitterFactor = 3, Conceal = CONCEAL_SILENCE, SilenceByte = 0xFF, IdleTimeout = 0.5, ResyncTime = None):
+    self.SampleRate = SampleRate
+    self.MinDelay = MinDelay
+    self.MaxDelay = MaxDelay
+    self.JitterFactor = JitterFactor # Target delay = JitterFactor * jitter estimate
+    self.Conceal = Conceal
+    self.SilenceByte = SilenceByte
+    self.IdleTimeout = IdleTimeout # Seconds without packets after which a talkspurt is considered over
+    self.ResyncTime = ResyncTime if ResyncTime is not None else 4 * MaxDelay # Larger jumps (seconds of audio) start a new talkspurt
+
+    self.Delay = MinDelay # Current playout delay in seconds
+    self.Jitter = 0.0 # Interarrival jitter estimate in seconds
+    self.LastArrival = 0
+
+    # Stats:
+    self.Received = 0
+    self.Played = 0
+    self.Lost = 0
+    self.LateDrops = 0
+    self.Duplicates = 0
+    self.Resyncs = 0
+
+    self.reset()
+
+  # Forget the current talkspurt, the next packet starts a new timeline:
+  def reset(self):
+    self.Tail = [] # Payloads left over from the previous talkspurt after a resync, played next
+    self.Packets = {} # Unwrapped seq -> (timestamp offset in samples, payload)
+    self.BufferedBytes = 0
+    self.NextSeq = None # Unwrapped seq of the next packet to play
+    self.LastSeq = None # Highest unwrapped seq seen, used to unwrap the next one
+    self.BaseTime = 0 # Arrival time of the first packet of the talkspurt
+    self.BaseTs = 0 # RTP timestamp of the first packet of the talkspurt
+    self.ExpectedTs = 0 # Timestamp offset of NextSeq
+    self.LastPayload = b''
+    self.LastTransit = None # The timestamp base may change between talkspurts, no jitter sample across them
+
+  def _unwrapSeq(self, seq):
+    if self.LastSeq is None: return seq
+    ext = self.LastSeq + (((seq - self.LastSeq) + 0x8000) & 0xFFFF) - 0x8000
+    return ext
+
+  def _tsOffset(self, ts):
+    return (((ts - self.BaseTs) + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+  def _playoutTime(self, TsOffset):
+    return self.BaseTime + TsOffset / self.SampleRate + self.Delay
+
+  # Update the jitter estimate with a new packet:
+  def _updateJitter(self, ts, now):
+    transit = now - ts / self.SampleRate
+    if self.LastTransit is not None:
+      d = abs(transit - self.LastTransit)
+      if d < 1: self.Jitter += (d - self.Jitter) / 16 # Ignore jumps of timestamp base between calls
+    self.LastTransit = transit
+
+  def _targetDelay(self):
+    return min(self.MaxDelay, max(self.MinDelay, self.JitterFactor * self.Jitter))
+
+  # Add a received packet. Returns False if it was dropped (late or duplicate).
+  def push(self, seq, ts, payload, now):
+    self.Received += 1
+    if self.NextSeq is not None and now - self.LastArrival > self.IdleTimeout and len(self.Packets) == 0:
+      self.reset() # Previous talkspurt is over
+    if self.NextSeq is not None:
+      limit = self.ResyncTime * self.SampleRate
+      if abs(self._unwrapSeq(seq) - self.NextSeq) * len(payload) > limit or abs(self._tsOffset(ts) - self.ExpectedTs) > limit:
+        # Sequence or timestamp jumped (new call or restarted sender), the buffered rest is played at once:
+        self.Resyncs += 1
+        tail = [self.Packets[k][1] for k in sorted(self.Packets)]
+        self.reset()
+        self.Tail = tail
+    self._updateJitter(ts, now)
+
+    if self.NextSeq is None:
+      # First packet of a talkspurt:
+      self.Delay = self._targetDelay()
+      self.BaseTime = now
+      self.BaseTs = ts
+      self.NextSeq = self.LastSeq = seq
+      self.ExpectedTs = 0
+
+    ext = self._unwrapSeq(seq)
+    if ext > self.LastSeq: self.LastSeq = ext
+    if ext < self.NextSeq:
+      # Too late, its slot was already played or concealed. Give future packets more time:
+      self.LateDrops += 1
+      self.Delay = min(self.MaxDelay, self.Delay + len(payload) / self.SampleRate)
+      return False
+    if ext in self.Packets:
+      self.Duplicates += 1
+      return False
+    self.Packets[ext] = (self._tsOffset(ts), bytes(payload))
+    self.BufferedBytes += len(payload)
+    self.LastArrival = now # Only accepted packets keep the talkspurt alive
+    return True
+
+  # Concealment for a lost packet of n samples:
+  def _concealment(self, n):
+    if self.Conceal == CONCEAL_REPEAT and len(self.LastPayload) > 0:
+      return (self.LastPayload * (n // len(self.LastPayload) + 1))[:n]
+    return bytes([self.SilenceByte]) * n
+
+  # Return the list of payloads (in order) that are due for playout at time now:
+  def pull(self, now):
+    out = []
+    if self.Tail:
+      out, self.Tail = self.Tail, []
+      self.Played += len(out)
+    while self.NextSeq is not None:
+      p = self.Packets.get(self.NextSeq)
+      if p is not None:
+        TsOffset, payload = p
+        if self._playoutTime(TsOffset) > now: break
+        del self.Packets[self.NextSeq]
+        self.BufferedBytes -= len(payload)
+        out.append(payload)
+        self.LastPayload = payload
+        self.ExpectedTs = TsOffset + len(payload)
+        self.NextSeq += 1
+        self.Played += 1
+        continue
+
+      if len(self.Packets) == 0:
+        if now - self.LastArrival > self.IdleTimeout:
+          # End of talkspurt, shrink towards the target delay for the next one:
+          self.reset()
+        break
+
+      # Packet NextSeq is missing. Conceal it once its playout time has passed:
+      nxt = min(self.Packets)
+      n = (self.Packets[nxt][0] - self.ExpectedTs) // (nxt - self.NextSeq)
+      if n <= 0 or n > self.SampleRate: n = len(self.LastPayload) or 160 # Implausible timestamps
+      if self._playoutTime(self.ExpectedTs) > now: break
+      out.append(self._concealment(n))
+      self.ExpectedTs += n
+      self.NextSeq += 1
+      self.Lost += 1
+    return out
+
+  # Buffered audio in seconds:
+  def getDepth(self):
+    return self.BufferedBytes / self.SampleRate
+
+  def getLossRate(self):
+    total = self.Played + self.Lost
+    return self.Lost / total if total > 0 else 0.0
+
+  def getStats(self):
+    return {
+      "depth_ms": self.getDepth() * 1000,
+      "delay_ms": self.Delay * 1000,
+      "jitter_ms": self.Jitter * 1000,
+      "received": self.Received,
+      "played": self.Played,
+      "lost": self.Lost,
+      "late_drops": self.LateDrops,
+      "duplicates": self.Duplicates,
+      "resyncs": self.Resyncs,
+      "loss_rate": self.getLossRate(),
+    }
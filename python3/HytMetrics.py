@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+# Metrics shared by the bridges: counters, gauges and histograms in one registry, served in the
+# Prometheus text format (GET /metrics) on a local HTTP port by one background thread.
+#
+# Updates are plain attribute arithmetic without locks, inc(), set() and observe() cost a few hundred
+# nanoseconds (see bench/bench_metrics.py), so they stay on in production. Every series is meant to be
+# updated by one thread only (the event loop or receive thread that owns it), the HTTP thread only reads.
+# Values a bridge already counts are exported with a callback instead (fn = ...), evaluated at scrape
+# time, which costs the hot path nothing. The lock only protects registration against scrapes.
+#
+# Usage:
+#   reg = HytMetrics.Registry()
+#   Packets = reg.counter("hyt_packets_total", "Received packets", {"slot": "TS1"})
+#   reg.gauge("hyt_tx_queue_seconds", "Audio waiting for transmission", {"slot": "TS1"}, fn=lambda: len(buf) / 8000)
+#   Packets.inc()
+#   reg.serve(9701)
+
+import bisect
+import http.server
+import math
+import threading
+import time
+
+# Histogram buckets in seconds for handling times, lateness and jitter (10 us to 1 s):
+LATENCY_BUCKETS = (0.00001, 0.00002, 0.00005, 0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+def formatLabels(labels):
+  if not labels: return ""
+  return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in labels.items()) + "}"
+
+def formatValue(v):
+  if isinstance(v, bool): return "1" if v else "0"
+  if isinstance(v, int): return str(v)
+  if math.isinf(v): return "+Inf" if v > 0 else "-Inf"
+  return repr(float(v))
+
+class Counter:
+  __slots__ = ('Value', 'Fn', 'Labels')
+
+  def __init__(self, labels = None, fn = None):
+    self.Value = 0
+    self.Fn = fn
+    self.Labels = formatLabels(labels)
+
+  def inc(self, n = 1):
+    self.Value += n
+
+  def get(self):
+    return self.Fn() if self.Fn is not None else self.Value
+
+class Gauge:
+  __slots__ = ('Value', 'Fn', 'Labels')
+
+  def __init__(self, labels = None, fn = None):
+    self.Value = 0
+    self.Fn = fn
+    self.Labels = formatLabels(labels)
+
+  def set(self, v):
+    self.Value = v
+
+  def inc(self, n = 1):
+    self.Value += n
+
+  def dec(self, n = 1):
+    self.Value -= n
+
+  def get(self):
+    return self.Fn() if self.Fn is not None else self.Value
+
+class Histogram:
+  __slots__ = ('Bounds', 'Counts', 'Sum', 'Labels', 'BucketLabels')
+
+  def __init__(self, labels = None, buckets = LATENCY_BUCKETS):
+    self.Bounds = tuple(sorted(buckets))
+    self.Counts = [0] * (len(self.Bounds) + 1) # Per bucket (not cumulative), the last one is +Inf
+    self.Sum = 0.0
+    self.Labels = formatLabels(labels)
+    self.BucketLabels = [formatLabels(dict(labels or {}, le=formatValue(b))) for b in self.Bounds + (math.inf,)]
+
+  def observe(self, v):
+    self.Counts[bisect.bisect_left(self.Bounds, v)] += 1
+    self.Sum += v
+
+  def getCount(self):
+    return sum(self.Counts)
+
+# All series of one metric name:
+class _Family:
+  __slots__ = ('Kind', 'Name', 'Help', 'Metrics')
+
+  def __init__(self, kind, name, help):
+    self.Kind = kind
+    self.Name = name
+    self.Help = help
+    self.Metrics = []
+
+class Registry:
+  def __init__(self):
+    self.Lock = threading.Lock()
+    self.Families = {} # Name -> _Family, in registration order
+    self.Server = None
+    self.ScrapeErrors = 0
+    StartTime = time.time()
+    self.counter("process_cpu_seconds_total", "CPU time used by the process", fn=time.process_time)
+    self.gauge("process_start_time_seconds", "Start time of the process since the epoch", fn=lambda: StartTime)
+    self.counter("hyt_metrics_scrape_errors_total", "Metric callbacks that failed during a scrape", fn=lambda: self.ScrapeErrors)
+
+  def _add(self, kind, name, help, metric):
+    with self.Lock:
+      f = self.Families.get(name)
+      if f is None: f = self.Families[name] = _Family(kind, name, help)
+      elif f.Kind != kind: raise ValueError(name + " is already registered as " + f.Kind)
+      f.Metrics = [m for m in f.Metrics if m.Labels != metric.Labels] + [metric] # Same labels: replace
+    return metric
+
+  def counter(self, name, help, labels = None, fn = None):
+    return self._add("counter", name, help, Counter(labels, fn))
+
+  def gauge(self, name, help, labels = None, fn = None):
+    return self._add("gauge", name, help, Gauge(labels, fn))
+
+  def histogram(self, name, help, labels = None, buckets = LATENCY_BUCKETS):
+    return self._add("histogram", name, help, Histogram(labels, buckets))
+
+  # Remove all series whose labels start with these (e.g. everything of a slot that was closed):
+  def unregister(self, labels):
+    prefix = formatLabels(labels)[:-1]
+    with self.Lock:
+      for f in self.Families.values(): f.Metrics = [m for m in f.Metrics if not (m.Labels.startswith(prefix) and m.Labels[len(prefix)] in ",}")]
+
+  # Prometheus text format (version 0.0.4):
+  def render(self):
+    with self.Lock:
+      families = [(f, list(f.Metrics)) for f in self.Families.values()]
+    lines = []
+    for f, metrics in families:
+      if not metrics: continue
+      lines.append("# HELP %s %s" % (f.Name, f.Help))
+      lines.append("# TYPE %s %s" % (f.Name, f.Kind))
+      for m in metrics:
+        if f.Kind == "histogram":
+          counts = list(m.Counts)
+          total = 0
+          for label, n in zip(m.BucketLabels, counts):
+            total += n
+            lines.append("%s_bucket%s %d" % (f.Name, label, total))
+          lines.append("%s_sum%s %s" % (f.Name, m.Labels, formatValue(m.Sum)))
+          lines.append("%s_count%s %d" % (f.Name, m.Labels, total))
+          continue
+        try:
+          v = m.get()
+        except Exception:
+          self.ScrapeErrors += 1
+          continue
+        if v is None: continue
+        lines.append("%s%s %s" % (f.Name, m.Labels, formatValue(v)))
+    return "\n".join(lines) + "\n"
+
+  # Serve GET /metrics on host:port from a background (daemon) thread:
+  def serve(self, port, host = "127.0.0.1"):
+    registry = self
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+      def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+          self.send_error(404)
+          return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, format, *args):
+        pass
+
+    self.Server = http.server.ThreadingHTTPServer((host, port), Handler)
+    self.Server.daemon_threads = True
+    threading.Thread(target=self.Server.serve_forever, name="Metrics", daemon=True).start()
+    print("Metrics on http://%s:%d/metrics" % (host, port))
+    return self.Server
+
+  def close(self):
+    if self.Server is not None:
+      self.Server.shutdown()
+      self.Server.server_close()
+      self.Server = None
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+# Time aligned multi-speaker mixer for the transmit path (e.g. several Mumble users -> one DMR timeslot).
+# Every speaker has its own buffer. Each tick, mixFrame() takes one frame from every active speaker,
+# sums them with clipping and returns exactly one frame. Speakers that talk at the same time are
+# mixed instead of queued one after another. A speaker's buffer never holds more than MaxLatency
+# seconds. Older audio is dropped, so latency does not keep climbing.
+# A speaker short of a full frame is held back for a tick instead of padded with silence, unless no audio
+# arrived for HoldTime seconds (end of speech), then the rest is played out. Silent speakers are forgotten.
+
+import threading
+import time
+
+import numpy as np
+
+class AudioMixer:
+  def __init__(self, SampleRate = 8000, FrameSize = 160, MaxLatency = 0.2, PreBuffer = 0.04, IdleTimeout = 1.0, HoldTime = 0.1):
+    self.FrameSize = FrameSize
+    self.MaxSamples = int(MaxLatency * SampleRate) # Latency bound per speaker
+    self.PreBufferSamples = int(PreBuffer * SampleRate) # Samples needed before a speaker starts (absorbs packet jitter)
+    self.IdleTimeout = IdleTimeout # Forget speakers silent for this many seconds
+    self.HoldTime = HoldTime # Wait this long for the rest of a partial frame before playing it padded
+    self.Lock = threading.Lock()
+    self.Speakers = {} # Speaker id -> _Speaker
+
+    # Stats:
+    self.MixedFrames = 0
+    self.ClippedSamples = 0
+    self.DroppedSamples = 0
+
+  # Add int16 samples of one speaker. Called from the producer thread(s).
+  def addAudio(self, SpeakerId, samples):
+    samples = np.asarray(samples, dtype=np.int16)
+    with self.Lock:
+      s = self.Speakers.get(SpeakerId)
+      if s is None: s = self.Speakers[SpeakerId] = _Speaker()
+      s.Buffer = np.concatenate((s.Buffer, samples)) if len(s.Buffer) > 0 else samples
+      s.LastInput = time.monotonic()
+      excess = len(s.Buffer) - self.MaxSamples
+      if excess > 0:
+        # Stale audio, keep only the newest MaxLatency seconds:
+        s.Buffer = s.Buffer[excess:]
+        self.DroppedSamples += excess
+      if not s.Active and len(s.Buffer) >= self.PreBufferSamples: s.Active = True
+
+  # Forget a speaker at once (e.g. user left), its buffered audio is dropped:
+  def removeSpeaker(self, SpeakerId):
+    with self.Lock:
+      self.Speakers.pop(SpeakerId, None)
+
+  def hasAudio(self):
+    return any(s.Active for s in self.Speakers.values())
+
+  # Mix one frame of all active speakers. Returns int16 samples or None if nobody is talking.
+  def mixFrame(self):
+    now = time.monotonic()
+    mix = None
+    with self.Lock:
+      for SpeakerId, s in list(self.Speakers.items()):
+        stopped = now - s.LastInput > self.HoldTime
+        if len(s.Buffer) == 0:
+          s.Active = False # Underrun, wait for pre-buffer again
+          if now - s.LastInput > self.IdleTimeout: del self.Speakers[SpeakerId]
+          continue
+        if not stopped and (not s.Active or len(s.Buffer) < self.FrameSize): continue # Pre-buffering or partial frame
+        frame = s.Buffer[:self.FrameSize]
+        s.Buffer = s.Buffer[self.FrameSize:]
+        s.Active = len(s.Buffer) > 0
+        if mix is None: mix = np.zeros(self.FrameSize, dtype=np.int32)
+        mix[:len(frame)] += frame
+    if mix is None: return None
+    self.MixedFrames += 1
+    clipped = int(np.count_nonzero((mix > 32767) | (mix < -32768)))
+    if clipped > 0:
+      self.ClippedSamples += clipped
+      np.clip(mix, -32768, 32767, out=mix)
+    return mix.astype(np.int16)
+
+  def getStats(self):
+    with self.Lock:
+      depth = {SpeakerId: len(s.Buffer) for SpeakerId, s in self.Speakers.items()}
+    return {
+      "speakers": len(depth),
+      "buffered_samples": depth,
+      "mixed_frames": self.MixedFrames,
+      "clipped_samples": self.ClippedSamples,
+      "dropped_samples": self.DroppedSamples,
+    }
+
+# Buffer of one speaker:
+class _Speaker:
+  __slots__ = ('Buffer', 'Active', 'LastInput')
+
+  def __init__(self):
+    self.Buffer = np.zeros(0, dtype=np.int16)
+    self.Active = False
+    self.LastInput = 0
@@ -4,14 +4,18 @@
 # Konvertierung nach Wave: $ sox -r 8000 -t raw -e u-law -c 1 HytBridge.TS1.raw out.wav
 
 import os
-import socket
-import _thread
 import time
 import signal
 import sys
-import audioop
+import numpy as np
+import HytConfig
+import HytDSP
+import HytMetrics
+from HytSlotEngine import AsyncAudioSlot, getDefaultEngine
+from HytCodec import isQSOData, printQSOData
+from HytMixer import AudioMixer
 import pymumble_py3 as pymumble # https://github.com/azlux/pymumble
-from pymumble_py3.callbacks import PYMUMBLE_CLBK_SOUNDRECEIVED # https://github.com/azlux/pymumble/blob/pymumble_py3/examples/echobot.py
+from pymumble_py3.callbacks import PYMUMBLE_CLBK_SOUNDRECEIVED, PYMUMBLE_CLBK_USERREMOVED # https://github.com/azlux/pymumble/blob/pymumble_py3/examples/echobot.py
 
 # IP-Adresse vom Repeater:
 LOCAL_IP = "192.168.4.161"
@@ -40,175 +44,110 @@ RepeaterVolume = 1.0
 DMR_CallType = 1 # 0: Private Call, 1: Group Call
 DMR_DstId = 1000 # Change me!
 
+# Voice activity detection for Mumble audio, so background noise does not key the repeater (see HytDSP.EnergyVAD):
+TX_VAD = True
+VAD_MIN_LEVEL = -45.0 # dBFS
+VAD_MARGIN = 9.0 # dB above the noise floor
+VAD_HANGOVER = 0.5 # Seconds
+
+# Prometheus metrics on http://METRICS_IP:METRICS_PORT/metrics (see HytMetrics.py), None: off:
+METRICS_IP = "127.0.0.1"
+METRICS_PORT = 9703
+
 # Bei STRG+C beenden:
 def signal_handler(signal, frame):
   print("Exit!")
   sys.exit(0)
 
-def decodeCallType(ct):
-  CallTypeList = ["Pvt", "Grp", "All"]
-  if ct >= 0 and ct < len(CallTypeList):
-    return CallTypeList[ct]
-  return "invalid"
-
-def isQSOData(data):
-  return len(data) == 38 and data[0] == 0x32 and data[1] == 0x42 and data[2] == 0x00 and data[3] == 0x20
-
-def printQSOData(threadName, data):
-  RptId = int("%02X%02X%02X" % (data[9], data[10], data[11]), 16)
-  CT = decodeCallType(data[26])
-  DstId = int("%02X%02X%02X" % (data[30], data[29], data[28]), 16)
-  SrcId = int("%02X%02X%02X" % (data[34], data[33], data[32]), 16)
-  print(threadName, ":", CT, "call from", SrcId, "to", DstId, "via", RptId)
-
 # Klasse, die sich um das Audio (RCP+RTP) für einen Timeslot kümmert.
-class AudioSlot:
+# Runs on the shared slot engine (see HytSlotEngine.py) instead of own threads.
+class AudioSlot(AsyncAudioSlot):
   def __init__(self, name, RptIP, RCP_Port, RTP_Port):
-    # Portnummern merken:
-    self.name = name
-    self.RptIP = RptIP
-    self.RCP_Port = RCP_Port
-    self.RTP_Port = RTP_Port
-
-    # Constants:
-    self.WakeCallPacket = bytes.fromhex('324200050000')
-    self.IdleKeepAlivePacket = bytes.fromhex('324200020000')
-    self.PCMSAMPLERATE = 8000
-    self.RTP_DATA_SIZE = 160
-
-    # Tx-Buffer:
-    self.TxBufferULaw = bytearray()
-    self.PTT = False
-    self.RTP_Seq = int(time.time() * self.PCMSAMPLERATE)
-    self.RTP_Timestamp = self.RTP_Seq
-
-    self.RCP_Seq = self.RTP_Seq
-    self.CallType = 0 # 0: Private 1: Group 2: AllCall
-    self.DstId = 0
-
-    # Sockets anlegen:
-    self.RCP_Sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    self.RTP_Sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-    # Sockets an Ports binden:
-    self.RCP_Sock.bind((LOCAL_IP, RCP_Port))
-    self.RTP_Sock.bind((LOCAL_IP, RTP_Port))
-    _thread.start_new_thread(self.RCP_Rx_Thread, (name,))
-    _thread.start_new_thread(self.RTP_Rx_Thread, (name,))
-    _thread.start_new_thread(self.TxIdleMsgThread, (name,))
-    _thread.start_new_thread(self.TxAudioThread, (name,))
-
-  def getNextRCPSeq(self):
-    self.RCP_Seq = (self.RCP_Seq + 1) & 0xFF
-    return self.RCP_Seq
-
-  def sendACK(self, seq):
-    AckPacket = bytearray.fromhex('324200010100')
-    AckPacket[5] = seq;
-    self.RCP_Sock.sendto(AckPacket, (self.RptIP, self.RCP_Port))
-
-  def sendCallSetup(self, CallType, DstId):
-    packet = bytearray.fromhex('3242000000010241080500017c0900005e03')
-    packet[5] = self.getNextRCPSeq()
-    packet[11] = CallType
-    packet[12] = DstId & 0xFF
-    packet[13] = (DstId >> 8) & 0xFF
-    packet[14] = (DstId >> 16) & 0xFF
-    self.RCP_Sock.sendto(packet, (self.RptIP, self.RCP_Port))
-
-  def sendPTT(self, onoff):
-    packet = bytearray.fromhex('32420000000002410002000300ec03')
-    packet[5] = self.getNextRCPSeq()
-    if onoff:
-      packet[12:14] = bytes.fromhex('01eb')
-    self.RCP_Sock.sendto(packet, (self.RptIP, self.RCP_Port))
-
-  def sendAudioFrame(self):
-    bytesToSend = self.TxBufferULaw[0:self.RTP_DATA_SIZE]
-    self.TxBufferULaw = self.TxBufferULaw[self.RTP_DATA_SIZE:]
-    while len(bytesToSend) < self.RTP_DATA_SIZE:
-      bytesToSend.append(0xFF)
-    rtp = bytearray.fromhex('90000000000000000000000000150003000000000000000000000000') + bytesToSend
-    self.RTP_Seq = (self.RTP_Seq + 1) & 0xFFFF
-    self.RTP_Timestamp = (self.RTP_Timestamp + self.RTP_DATA_SIZE) & 0xFFFFFFFF
-    rtp[2] = (self.RTP_Seq >> 8) & 0xFF
-    rtp[3] = self.RTP_Seq & 0xFF
-    rtp[4] = (self.RTP_Timestamp >> 24) & 0xFF
-    rtp[5] = (self.RTP_Timestamp >> 16) & 0xFF
-    rtp[6] = (self.RTP_Timestamp >> 8) & 0xFF
-    rtp[7] = self.RTP_Timestamp & 0xFF
-    self.RTP_Sock.sendto(rtp, (self.RptIP, self.RTP_Port))
-
-  def RCP_Rx_Thread(self, threadName):
-    #print(threadName, "RCP_Rx_Thread started")
-    while True:
-      data, addr = self.RCP_Sock.recvfrom(1024)
-      #print(threadName, "RCP_Rx_Thread: received message:", data)
-      if isQSOData(data):
-        self.sendACK(data[5])
-        printQSOData(threadName, data)
-
-  def RTP_Rx_Thread(self, threadName):
-    #print(threadName, "RTP_Rx_Thread started")
-    while True:
-      data, addr = self.RTP_Sock.recvfrom(1024)
-      #print(threadName, "RTP_Rx_Thread: received message:", data)
-      if data[0:2] == bytes.fromhex('9000'):
-        buffer = audioop.ulaw2lin(data[28:], 2)
-        if RepeaterVolume != 1: buffer = audioop.mul(buffer, 2, RepeaterVolume)
-        buffer, newstate = audioop.ratecv(buffer, 2, 1, self.PCMSAMPLERATE, 48000, None)
-        mumble.sound_output.add_sound(buffer)
-
-  def TxIdleMsgThread(self, threadName):
-    #print(threadName, "TxIdleMsgThread started")
-    self.RCP_Sock.sendto(self.WakeCallPacket, (self.RptIP, self.RCP_Port))
-    self.RTP_Sock.sendto(self.WakeCallPacket, (self.RptIP, self.RTP_Port))
-    while True:
-      self.RCP_Sock.sendto(self.IdleKeepAlivePacket, (self.RptIP, self.RCP_Port))
-      self.RTP_Sock.sendto(self.IdleKeepAlivePacket, (self.RptIP, self.RTP_Port))
-      time.sleep(2)
-
-  def TxAudioThread(self, threadName):
-    #print(threadName, "TxAudioThread started")
-    while True:
-      if len(self.TxBufferULaw) > 0:
-        if not self.PTT:
-          self.sendCallSetup(self.CallType, self.DstId)
-          time.sleep(0.1)
-          self.sendPTT(True)
-          self.PTT = True
-      else:
-        if self.PTT:
-          self.sendPTT(False)
-          self.sendPTT(False)
-          self.PTT = False
-      self.sendAudioFrame()
-      time.sleep(self.RTP_DATA_SIZE * 0.99 / self.PCMSAMPLERATE) # rough guess, not very accurate!
+    AsyncAudioSlot.__init__(self, name, LOCAL_IP, RptIP, RCP_Port, RTP_Port)
+    self.MumbleResampler = HytDSP.PolyphaseResampler(self.PCMSAMPLERATE, 48000)
+    if TX_VAD: self.TxVAD = HytDSP.EnergyVAD(self.PCMSAMPLERATE, self.RTP_DATA_SIZE, VAD_MIN_LEVEL, VAD_MARGIN, Hangover = VAD_HANGOVER)
+    getDefaultEngine().addSlot(self)
+
+  def processRCPPacket(self, data):
+    #print(self.name, "processRCPPacket: received message:", data)
+    if isQSOData(data):
+      self.sendACK(data[5])
+      printQSOData(self.name, data)
+
+  def processRxAudio(self, payload):
+    if not MumbleReady: return # Repeater audio while still connecting to Mumble is dropped
+    samples = HytDSP.ulawDecode(payload)
+    if RepeaterVolume != 1: samples = HytDSP.gain(samples, RepeaterVolume)
+    mumble.sound_output.add_sound(self.MumbleResampler.process(samples).tobytes())
+
+  def registerMetrics(self, registry):
+    AsyncAudioSlot.registerMetrics(self, registry)
+    labels = self.getMetricLabels()
+    registry.gauge("hyt_mixer_speakers", "Mumble users in the transmit mixer", labels, fn=lambda: len(self.TxMixer.Speakers) if self.TxMixer else 0)
+    registry.counter("hyt_mixer_frames_total", "Mixed transmit frames", labels, fn=lambda: self.TxMixer.MixedFrames if self.TxMixer else 0)
+    registry.counter("hyt_mixer_clipped_samples_total", "Samples clipped when mixing", labels, fn=lambda: self.TxMixer.ClippedSamples if self.TxMixer else 0)
+    registry.counter("hyt_mixer_dropped_samples_total", "Stale samples dropped by the mixer", labels, fn=lambda: self.TxMixer.DroppedSamples if self.TxMixer else 0)
+    if self.TxVAD is not None:
+      v = self.TxVAD
+      registry.counter("hyt_vad_voice_frames_total", "Mixed frames passed by the VAD", labels, fn=lambda: v.VoiceFrames)
+      registry.counter("hyt_vad_gated_frames_total", "Mixed frames held back by the VAD", labels, fn=lambda: v.GatedFrames)
+      registry.gauge("hyt_vad_noise_floor_dbfs", "Noise floor tracked by the VAD", labels, fn=lambda: v.NoiseFloor)
 
   def playBuffer(self, buffer, CallType, DstId): # Play buffer with 8 kHz 16-bit mono samples
     self.CallType = CallType
     self.DstId = DstId
-    self.TxBufferULaw += audioop.lin2ulaw(buffer, 2)
+    self.TxBufferULaw.write(HytDSP.lin2ulaw(buffer, 2))
+
+  def mixBuffer(self, SpeakerId, samples, CallType, DstId): # Mix 8 kHz 16-bit mono samples of one speaker into the transmission
+    self.CallType = CallType
+    self.DstId = DstId
+    if self.TxMixer is None: self.TxMixer = AudioMixer(self.PCMSAMPLERATE, self.RTP_DATA_SIZE)
+    self.TxMixer.addAudio(SpeakerId, samples)
+
+# Set once the Mumble connection is established:
+MumbleReady = False
+
+# Resampler state per Mumble user (session id), so every speaker keeps its own filter history:
+MumbleUserResamplers = {}
 
 def MumbleSoundReceivedHandler(user, soundchunk):
   #print("Received sound from user \"" + user['name'] + "\".")
   # Convert sound format. Mumble uses 16 bit mono 48 kHz little-endian, which needs to be downsampled to 8 kHz:
-  buffer, newstate = audioop.ratecv(soundchunk.pcm, 2, 1, 48000, AudioSlot1.PCMSAMPLERATE, None)
-  if MumbleVolume != 1: buffer = audioop.mul(buffer, 2, MumbleVolume)
-  AudioSlot1.playBuffer(buffer, DMR_CallType, DMR_DstId)
+  resampler = MumbleUserResamplers.get(user['session'])
+  if resampler is None:
+    resampler = MumbleUserResamplers[user['session']] = HytDSP.PolyphaseResampler(48000, AudioSlot1.PCMSAMPLERATE)
+  samples = resampler.process(np.frombuffer(soundchunk.pcm, dtype=np.int16))
+  if MumbleVolume != 1: samples = HytDSP.gain(samples, MumbleVolume)
+  AudioSlot1.mixBuffer(user['session'], samples, DMR_CallType, DMR_DstId)
+
+# User left: forget the resampler (the mixer plays out and expires the speaker by itself):
+def MumbleUserRemovedHandler(user, message):
+  MumbleUserResamplers.pop(user['session'], None)
+
+# Settings from the command line (NAME=VALUE, see HytConfig.py), e.g. LOCAL_IP/RPT_IP for HytRepeaterSimulator.py:
+HytConfig.applyOverrides(globals(), sys.argv[1:])
 
 print("HytMumbleBridge 0.01")
 signal.signal(signal.SIGINT, signal_handler)
 
+# The slots start receiving at once, so the Mumble client has to exist before them (it connects below):
+mumble = pymumble.Mumble(MumbleServer, MumbleNick, port=MumblePort, password=MumblePassword)
+
 AudioSlot1 = AudioSlot("TS1", RPT_IP, RCP_PORT_TS1, RTP_PORT_TS1)
 AudioSlot2 = AudioSlot("TS2", RPT_IP, RCP_PORT_TS2, RTP_PORT_TS2)
 
+if METRICS_PORT is not None:
+  Metrics = HytMetrics.Registry()
+  getDefaultEngine().registerMetrics(Metrics)
+  Metrics.serve(METRICS_PORT, METRICS_IP)
+
 print("Connecting to Mumble server \"" + MumbleServer + "\" on port " + str(MumblePort) + "...")
-mumble = pymumble.Mumble(MumbleServer, MumbleNick, port=MumblePort, password=MumblePassword)
 mumble.callbacks.set_callback(PYMUMBLE_CLBK_SOUNDRECEIVED, MumbleSoundReceivedHandler)
+mumble.callbacks.set_callback(PYMUMBLE_CLBK_USERREMOVED, MumbleUserRemovedHandler)
 mumble.set_receive_sound(True)
 mumble.start()
 mumble.is_ready()
+MumbleReady = True
 if MumbleChannel > "": mumble.channels.find_by_name(MumbleChannel).move_in()
 
 print("Running... (press CTRL+C to exit)")
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+
+# Deadline based pacer for fixed-rate audio frames (e.g. 160 samples @ 8 kHz = 20 ms per RTP frame).
+# Frame deadlines are absolute points on a time.monotonic_ns() grid, so a late wake-up never shifts
+# the following frames and long transmissions stay locked to the sample clock.
+
+import time
+
+# What to do when the pacer wakes up more than one frame period late:
+POLICY_CATCHUP = 0 # Send the missed frames back-to-back (up to MaxCatchUpFrames), keeps the sample count exact
+POLICY_SKIP = 1 # Drop the missed deadlines and continue on the grid, keeps latency low
+
+class FramePacer:
+  def __init__(self, SampleRate = 8000, FrameSize = 160, Policy = POLICY_CATCHUP, MaxCatchUpFrames = 5):
+    self.PeriodNs = FrameSize * 1000000000 // SampleRate
+    self.Policy = Policy
+    self.MaxCatchUpFrames = MaxCatchUpFrames
+    self.NextDeadline = None # Deadline of the next frame in ns, None until started
+    self.resetStats()
+
+  def resetStats(self):
+    self.Frames = 0 # Frames released
+    self.Wakeups = 0 # Calls to poll() that released at least one frame
+    self.LateFrames = 0 # Frames released more than one period after their deadline
+    self.CatchUpFrames = 0 # Frames released back-to-back to catch up
+    self.SkippedFrames = 0 # Deadlines dropped by the skip policy or the catch-up limit
+    self.LastLatenessNs = 0
+    self.MaxLatenessNs = 0
+    self.SumLatenessNs = 0
+
+  # Start the frame grid. The first frame is due immediately:
+  def start(self, now = None):
+    if now is None: now = time.monotonic_ns()
+    self.NextDeadline = now
+
+  # Number of frames due at time now (0 if the next deadline is still in the future).
+  # Advances the grid accordingly and updates the lateness counters.
+  def poll(self, now = None):
+    if now is None: now = time.monotonic_ns()
+    if self.NextDeadline is None: self.start(now)
+    if now < self.NextDeadline: return 0
+
+    self.Wakeups += 1
+    lateness = now - self.NextDeadline
+    self.LastLatenessNs = lateness
+    self.SumLatenessNs += lateness
+    if lateness > self.MaxLatenessNs: self.MaxLatenessNs = lateness
+
+    due = 1 + lateness // self.PeriodNs
+    if due > 1:
+      self.LateFrames += 1
+      if self.Policy == POLICY_SKIP: limit = 1
+      else: limit = 1 + self.MaxCatchUpFrames
+      if due > limit:
+        self.SkippedFrames += due - limit
+        self.NextDeadline += (due - limit) * self.PeriodNs
+        due = limit
+      self.CatchUpFrames += due - 1
+
+    self.NextDeadline += due * self.PeriodNs
+    self.Frames += due
+    return due
+
+  # Seconds until the next frame is due (0 if already due):
+  def timeToNextFrame(self, now = None):
+    if self.NextDeadline is None: return 0
+    if now is None: now = time.monotonic_ns()
+    return max(0, self.NextDeadline - now) / 1000000000
+
+  # Blocking wait for the next deadline, for use from plain threads:
+  def wait(self):
+    delay = self.timeToNextFrame()
+    if delay > 0: time.sleep(delay)
+    return self.poll()
+
+  def getStats(self):
+    return {
+      "frames": self.Frames,
+      "late_frames": self.LateFrames,
+      "catchup_frames": self.CatchUpFrames,
+      "skipped_frames": self.SkippedFrames,
+      "last_lateness_ms": self.LastLatenessNs / 1000000,
+      "max_lateness_ms": self.MaxLatenessNs / 1000000,
+      "avg_lateness_ms": self.SumLatenessNs / max(1, self.Wakeups) / 1000000,
+    }
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+
+# Loopback DMR radio emulator, to run HytDataBridge without radios (Linux, uses 127.0.0.x addresses).
+# Both bridges send to the emulator instead of to each other. It forwards their datagrams after the
+# time a pair of radios would need for them:
+#
+#   Bridge A (LOCAL_RADIO_NET_IP=127.0.0.2 OTHER_STATION_IP=127.0.0.10)
+#     <-> 127.0.0.10 [emulator] 127.0.0.11 <->
+#   Bridge B (LOCAL_RADIO_NET_IP=127.0.0.3 OTHER_STATION_IP=127.0.0.11)
+#
+# Every link is one channel (timeslot) that carries one datagram at a time, in both directions
+# unless DUPLEX is set. A datagram occupies the channel for TX_SETUP_TIME plus its size at BIT_RATE
+# and arrives LATENCY (+ up to JITTER) seconds after it went over the air. Datagrams bigger than
+# MAX_PAYLOAD_SIZE are dropped like the radio firmware does, as are datagrams that would wait more
+# than QUEUE_LIMIT seconds for the channel. LOSS and REORDER drop or hold back random datagrams.
+#
+# Settings can be given on the command line, e.g. HytRadioEmulator.py LOSS=0.05 BIT_RATE=4800
+
+import socket
+import selectors
+import heapq
+import itertools
+import random
+import signal
+import sys
+import time
+import HytConfig
+
+# UDP/IP port of the radios, same as RADIO_UDP_PORT of the bridges:
+RADIO_UDP_PORT = 3007
+
+# Links as (IP of station A, IP of the emulated radio A talks to, IP of station B, IP of the emulated radio B talks to).
+# Several links emulate bonded radios, each link is an independent channel:
+LINKS = [("127.0.0.2", "127.0.0.10", "127.0.0.3", "127.0.0.11")]
+
+# Net bit rate of the channel for data in bits per second:
+BIT_RATE = 2400
+
+# Airtime of every datagram in seconds for keying up, preamble and data header:
+TX_SETUP_TIME = 0.12
+
+# Bytes of protocol overhead per datagram on air (IP/UDP headers, CRCs):
+AIR_OVERHEAD = 28
+
+# Seconds from the end of the transmission until the datagram is delivered, plus random jitter up to JITTER:
+LATENCY = 0.05
+JITTER = 0.0
+
+# Both directions at once (two channels) instead of taking turns on one:
+DUPLEX = False
+
+# Largest UDP payload the radio firmware accepts, bigger datagrams are dropped:
+MAX_PAYLOAD_SIZE = 1024
+
+# Seconds of airtime the radio buffers, datagrams that would wait longer are dropped:
+QUEUE_LIMIT = 10
+
+# Probability a datagram is lost on air:
+LOSS = 0.0
+
+# Probability a datagram is held back REORDER_DELAY seconds, so later ones overtake it:
+REORDER = 0.0
+REORDER_DELAY = 0.5
+
+# Seed for loss and reordering, None: different every run:
+SEED = None
+
+# Interval in seconds to print stats, 0 = only on exit:
+STATS_INTERVAL = 0
+
+# Exit on CTRL+C:
+def signal_handler(signal, frame):
+  global AbortRequest
+  AbortRequest = True
+
+# One direction of a link:
+class Direction:
+  def __init__(self, name, InSocket, OutSocket, Destination):
+    self.Name = name
+    self.InSocket = InSocket # Emulator socket the sending station talks to
+    self.OutSocket = OutSocket # Emulator socket the receiving station hears from
+    self.Destination = Destination
+    self.Channel = None # Shared with the opposite direction unless DUPLEX
+
+    # Stats:
+    self.Received = 0
+    self.Delivered = 0
+    self.DeliveredBytes = 0
+    self.Lost = 0
+    self.TooBig = 0
+    self.QueueDrops = 0
+    self.Reordered = 0
+
+  def printStats(self):
+    print("%s: %d datagrams, %d delivered (%d bytes), %d lost, %d too big, %d queue drops, %d reordered" % (self.Name,
+      self.Received, self.Delivered, self.DeliveredBytes, self.Lost, self.TooBig, self.QueueDrops, self.Reordered))
+
+# Airtime of one channel:
+class Channel:
+  def __init__(self):
+    self.FreeTime = 0 # End of the last transmission
+    self.BusyTime = 0 # Total airtime used
+
+# Datagram received from a station, put it on air:
+def transmit(d, data, now):
+  d.Received += 1
+  if len(data) > MAX_PAYLOAD_SIZE:
+    d.TooBig += 1
+    return
+  start = max(now, d.Channel.FreeTime)
+  if start - now > QUEUE_LIMIT:
+    d.QueueDrops += 1
+    return
+  airtime = TX_SETUP_TIME + (len(data) + AIR_OVERHEAD) * 8 / BIT_RATE
+  d.Channel.FreeTime = start + airtime
+  d.Channel.BusyTime += airtime
+  if random.random() < LOSS:
+    d.Lost += 1
+    return
+  t = d.Channel.FreeTime + LATENCY + random.uniform(0, JITTER)
+  if random.random() < REORDER:
+    d.Reordered += 1
+    t += REORDER_DELAY
+  heapq.heappush(Deliveries, (t, next(DeliverySeq), d, data))
+
+def printStats():
+  elapsed = max(time.monotonic() - StartTime, 1e-3)
+  for d in Directions: d.printStats()
+  for i, c in enumerate(Channels): print("Channel %d: %.1f s airtime, %.0f%% busy" % (i, c.BusyTime, 100 * c.BusyTime / elapsed))
+
+def bindSocket(ip):
+  s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  s.bind((ip, RADIO_UDP_PORT))
+  s.setblocking(0)
+  return s
+
+# Settings from the command line (NAME=VALUE, see HytConfig.py):
+HytConfig.applyOverrides(globals(), sys.argv[1:])
+
+print("HytRadioEmulator 0.01")
+AbortRequest = False
+signal.signal(signal.SIGINT, signal_handler)
+signal.signal(signal.SIGTERM, signal_handler)
+random.seed(SEED)
+
+# Datagrams on their way, min-heap of (delivery time, tie breaker, direction, data):
+Deliveries = []
+DeliverySeq = itertools.count()
+
+Selector = selectors.DefaultSelector()
+Directions = []
+Channels = []
+for i, (ipA, emuA, ipB, emuB) in enumerate(LINKS):
+  sockA = bindSocket(emuA)
+  sockB = bindSocket(emuB)
+  AtoB = Direction("Link %d %s -> %s" % (i, ipA, ipB), sockA, sockB, (ipB, RADIO_UDP_PORT))
+  BtoA = Direction("Link %d %s -> %s" % (i, ipB, ipA), sockB, sockA, (ipA, RADIO_UDP_PORT))
+  AtoB.Channel = Channel()
+  BtoA.Channel = Channel() if DUPLEX else AtoB.Channel
+  Channels += [AtoB.Channel] if not DUPLEX else [AtoB.Channel, BtoA.Channel]
+  for d in (AtoB, BtoA):
+    Selector.register(d.InSocket, selectors.EVENT_READ, d)
+    Directions.append(d)
+  print("Link %d: %s <-> %s:%d | %s:%d <-> %s" % (i, ipA, emuA, RADIO_UDP_PORT, emuB, RADIO_UDP_PORT, ipB))
+
+StartTime = time.monotonic()
+LastStatsTime = StartTime
+
+# Main Loop
+while not AbortRequest:
+  now = time.monotonic()
+  while Deliveries and Deliveries[0][0] <= now:
+    t, seq, d, data = heapq.heappop(Deliveries)
+    try:
+      d.OutSocket.sendto(data, d.Destination)
+    except OSError:
+      pass # Station not running
+    d.Delivered += 1
+    d.DeliveredBytes += len(data)
+
+  if STATS_INTERVAL > 0 and now - LastStatsTime >= STATS_INTERVAL:
+    printStats()
+    LastStatsTime = now
+
+  timeout = 1 if not Deliveries else min(1, max(0, Deliveries[0][0] - now))
+  for key, mask in Selector.select(timeout):
+    d = key.data
+    try:
+      data = d.InSocket.recv(65536)
+    except (BlockingIOError, ConnectionRefusedError):
+      continue
+    transmit(d, data, time.monotonic())
+
+print("Exit!")
+printStats()
+Selector.close()
+for d in Directions: d.InSocket.close()
+sys.exit(0)
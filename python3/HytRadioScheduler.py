@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+
+# Airtime scheduler for the DMR data link (see HytDataBridge.py).
+#
+# RateController limits the bytes per second handed to one radio with a TokenBucket. The rate adapts
+# AIMD style: it grows slowly while packets are acknowledged quickly and is cut when packets get lost
+# or the round trip time rises well above the lowest one seen (the radio is queueing). Delayed
+# acknowledgements vary the round trip time too, so LatencySlack should be above the receiver's ACK delay.
+#
+# RadioScheduler decides which flow (virtual circuit) may send next: strict priority between classes,
+# deficit round robin (DRR) between the flows of one class, so one bulk transfer cannot starve
+# interactive sessions. With several radios one RadioScheduler serves all of them.
+#
+# The scheduler only keeps flow ids and deficits. The caller keeps the packets and tells select()
+# the size of the next packet of a flow through a callback.
+
+import collections
+import time
+
+# Priority classes, lower value is served first:
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+class TokenBucket:
+  def __init__(self, Rate, Burst):
+    self.Rate = Rate # Bytes per second
+    self.Burst = Burst # Max bytes saved up while idle
+    self.Tokens = Burst
+    self.LastTime = time.monotonic()
+
+  def refill(self, now):
+    self.Tokens = min(self.Burst, self.Tokens + (now - self.LastTime) * self.Rate)
+    self.LastTime = now
+
+  # A datagram may go out while the bucket is not in debt. Its size is charged afterwards, so
+  # datagrams larger than the current token count are not blocked forever:
+  def canSend(self, now = None):
+    self.refill(time.monotonic() if now is None else now)
+    return self.Tokens > 0
+
+  def consume(self, n):
+    self.Tokens -= n
+
+  # Seconds until canSend() becomes true:
+  def timeToSend(self):
+    return 0 if self.Tokens > 0 else -self.Tokens / self.Rate
+
+class RateController:
+  def __init__(self, Rate = 200, MinRate = 50, MaxRate = 2000, Burst = 2048,
+      AdditiveIncrease = 20, DecreaseFactor = 0.5, LatencyFactor = 2.0, LatencySlack = 0.5):
+    self.Bucket = TokenBucket(Rate, Burst)
+    self.MinRate = MinRate
+    self.MaxRate = MaxRate
+    self.AdditiveIncrease = AdditiveIncrease # Bytes/s added per second worth of acknowledged data
+    self.DecreaseFactor = DecreaseFactor # Rate multiplier on loss
+    self.LatencyFactor = LatencyFactor # RTT above LatencyFactor * lowest RTT counts as congestion...
+    self.LatencySlack = LatencySlack # ...if it also exceeds the lowest RTT by this many seconds (delayed ACKs, jitter)
+
+    self.MinRTT = None
+    self.SRTT = None
+    self.LastDecreaseTime = 0
+
+    # Stats:
+    self.Decreases = 0
+
+  def canSend(self, now = None):
+    return self.Bucket.canSend(now)
+
+  def consume(self, n):
+    self.Bucket.consume(n)
+
+  def timeToSend(self):
+    return self.Bucket.timeToSend()
+
+  def setRate(self, rate):
+    self.Bucket.Rate = min(self.MaxRate, max(self.MinRate, rate))
+
+  def getRate(self):
+    return self.Bucket.Rate
+
+  # Multiplicative decrease, at most once per round trip:
+  def _decrease(self, now):
+    if now - self.LastDecreaseTime < (self.SRTT or 0): return
+    self.LastDecreaseTime = now
+    self.Decreases += 1
+    self.setRate(self.Bucket.Rate * self.DecreaseFactor)
+
+  # Packet of nbytes acknowledged. rtt is None when it was retransmitted (ambiguous):
+  def onAck(self, nbytes, rtt = None, now = None):
+    if now is None: now = time.monotonic()
+    if rtt is not None:
+      self.MinRTT = rtt if self.MinRTT is None else min(self.MinRTT, rtt)
+      self.SRTT = rtt if self.SRTT is None else 0.875 * self.SRTT + 0.125 * rtt
+      if rtt > self.LatencyFactor * self.MinRTT and rtt - self.MinRTT > self.LatencySlack:
+        self._decrease(now)
+        return
+    self.setRate(self.Bucket.Rate + self.AdditiveIncrease * nbytes / self.Bucket.Rate)
+
+  # Packet presumed lost (retransmit):
+  def onLoss(self, now = None):
+    self._decrease(time.monotonic() if now is None else now)
+
+  def getStats(self):
+    return {
+      "rate": self.Bucket.Rate,
+      "srtt": self.SRTT,
+      "min_rtt": self.MinRTT,
+      "decreases": self.Decreases,
+    }
+
+class _Flow:
+  __slots__ = ('Priority', 'Deficit', 'Active', 'SentBytes', 'SentPackets')
+
+  def __init__(self, Priority):
+    self.Priority = Priority
+    self.Deficit = 0
+    self.Active = False
+    self.SentBytes = 0
+    self.SentPackets = 0
+
+class RadioScheduler:
+  def __init__(self, Quantum = 1024):
+    self.Quantum = Quantum # Bytes a flow may send per DRR round, at least one max size packet
+    self.Flows = {} # Flow id -> _Flow
+    self.Rings = {} # Priority -> deque of active flow ids
+
+    # Stats:
+    self.SentBytes = 0
+
+  def addFlow(self, FlowId, Priority = PRIORITY_INTERACTIVE):
+    if FlowId not in self.Flows: self.Flows[FlowId] = _Flow(Priority)
+
+  def removeFlow(self, FlowId):
+    f = self.Flows.pop(FlowId, None)
+    if f is not None and f.Active: self.Rings[f.Priority].remove(FlowId)
+
+  def setPriority(self, FlowId, Priority):
+    f = self.Flows[FlowId]
+    if f.Priority == Priority: return
+    if f.Active:
+      self.Rings[f.Priority].remove(FlowId)
+      self._ring(Priority).append(FlowId)
+    f.Priority = Priority
+
+  def _ring(self, Priority):
+    r = self.Rings.get(Priority)
+    if r is None:
+      r = self.Rings[Priority] = collections.deque()
+      self.Rings = dict(sorted(self.Rings.items()))
+    return r
+
+  # Flow has packets waiting:
+  def activate(self, FlowId):
+    f = self.Flows.get(FlowId)
+    if f is None:
+      self.addFlow(FlowId)
+      f = self.Flows[FlowId]
+    if f.Active: return
+    f.Active = True
+    self._ring(f.Priority).append(FlowId)
+
+  def hasActiveFlows(self):
+    return any(len(r) > 0 for r in self.Rings.values())
+
+  # Pick the flow to send next. headSize(FlowId) returns the size of the flow's next packet or None
+  # if the flow has nothing left. A flow whose next packet does not fit into MaxSize bytes is skipped
+  # and keeps its place for the next datagram. Returns None if nothing fits. The returned flow has
+  # been charged for its packet, the caller must send it.
+  def select(self, headSize, MaxSize = None):
+    for ring in self.Rings.values():
+      skipped = 0 # Flows at the front of the ring whose packet does not fit
+      while len(ring) > skipped:
+        FlowId = ring[skipped]
+        f = self.Flows[FlowId]
+        size = headSize(FlowId)
+        if size is None:
+          del ring[skipped]
+          f.Active = False
+          f.Deficit = 0
+          continue
+        if MaxSize is not None and size > MaxSize:
+          skipped += 1
+          continue
+        if f.Deficit >= size:
+          f.Deficit -= size
+          f.SentBytes += size
+          f.SentPackets += 1
+          self.SentBytes += size
+          return FlowId
+        # Turn is over, next round:
+        f.Deficit += self.Quantum
+        del ring[skipped]
+        ring.append(FlowId)
+    return None
+
+  def getStats(self):
+    flows = {}
+    for FlowId, f in self.Flows.items():
+      flows[FlowId] = {
+        "priority": f.Priority,
+        "sent_bytes": f.SentBytes,
+        "sent_packets": f.SentPackets,
+        "airtime_share": f.SentBytes / self.SentBytes if self.SentBytes > 0 else 0.0,
+      }
+    return {
+      "sent_bytes": self.SentBytes,
+      "flows": flows,
+    }
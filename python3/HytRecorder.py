@@ -0,0 +1,289 @@
+#!/usr/bin/python3
+
+# Call recording archive for HytAudioBridge.py: one WAV file per call and an SQLite index of all
+# recordings (start, duration, slot, repeater, call type, source and destination id, path).
+# The slots only collect the u-law audio of the running call and hand it over in chunks of about a
+# second. One writer thread writes them through a large file buffer, renames the finished file and
+# adds it to the index. A slow disk grows the queue but never stalls reception.
+# Files hold the received u-law bytes as they are (see HytWave.py), or 16 bit PCM with WaveFormat = FORMAT_PCM.
+#
+# Files: <WAVE_PATH>/YYYY/MM/DD/rec-<slot>-<YYYYMMDD-HHMMSS>-<src id>-<dst id>.wav (local time of the call start)
+#
+# Find recordings: HytRecorder.py [NAME=VALUE ...]
+#   e.g. HytRecorder.py INDEX=rec/recordings.sqlite SRC_ID=2620001 SINCE=2026-10-01
+
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import wave
+import HytCodec
+import HytConfig
+import HytDSP
+from HytWave import ULawWaveWriter
+
+# Settings for the command line search:
+INDEX = "recordings.sqlite"
+SRC_ID = None
+DST_ID = None
+RPT_ID = None
+SINCE = None # "YYYY-MM-DD", "YYYY-MM-DD HH:MM" or seconds since the epoch
+UNTIL = None
+LIMIT = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+  id INTEGER PRIMARY KEY,
+  start REAL NOT NULL,
+  duration REAL NOT NULL,
+  slot TEXT NOT NULL,
+  repeater TEXT NOT NULL,
+  rpt_id INTEGER,
+  call_type INTEGER,
+  src_id INTEGER,
+  dst_id INTEGER,
+  path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recordings_start ON recordings (start);
+CREATE INDEX IF NOT EXISTS recordings_src ON recordings (src_id, start);
+CREATE INDEX IF NOT EXISTS recordings_dst ON recordings (dst_id, start);
+CREATE INDEX IF NOT EXISTS recordings_rpt ON recordings (rpt_id, start);
+"""
+
+# Writer commands:
+CMD_START = 0
+CMD_DATA = 1
+CMD_END = 2
+
+PCMSAMPLERATE = 8000
+
+# Recording formats:
+FORMAT_ULAW = "ulaw" # G.711 u-law WAV, 8 kB/s
+FORMAT_PCM = "pcm" # 16 bit PCM WAV, 16 kB/s
+
+# Recording of one call. The slot may fill in the ids until the call ends (e.g. QSO data arriving after
+# the first audio), the file gets its final name only then:
+class Recording:
+  __slots__ = ('Start', 'Slot', 'Repeater', 'RptId', 'CallType', 'SrcId', 'DstId', 'Length', 'Buffer', 'Silence')
+
+  def __init__(self, Start, Slot, Repeater, qso = None):
+    self.Start = Start # Seconds since the epoch
+    self.Slot = Slot
+    self.Repeater = Repeater
+    self.setQSO(qso)
+    self.Length = 0 # Samples handed to the writer
+    self.Buffer = bytearray() # u-law audio not yet handed to the writer
+    self.Silence = bytearray() # Idle frames since the last voice, dropped at the end of the call
+
+  def setQSO(self, qso):
+    if qso is None: self.RptId = self.CallType = self.SrcId = self.DstId = None
+    else: self.RptId, self.CallType, self.SrcId, self.DstId = qso.RptId, qso.CallType, qso.SrcId, qso.DstId
+
+  def hasQSO(self):
+    return self.SrcId is not None
+
+  def getFileName(self):
+    return "rec-%s-%s-%s-%s.wav" % (self.Slot, time.strftime('%Y%m%d-%H%M%S', time.localtime(self.Start)),
+      self.SrcId if self.SrcId is not None else "unknown", self.DstId if self.DstId is not None else "unknown")
+
+class CallRecorder:
+  def __init__(self, WavePath, IndexPath, WaveFormat = FORMAT_ULAW, ChunkSize = PCMSAMPLERATE, WriteBufferSize = 1 << 20):
+    if WaveFormat not in (FORMAT_ULAW, FORMAT_PCM): raise ValueError("unknown recording format: " + str(WaveFormat))
+    self.WavePath = WavePath
+    self.IndexPath = IndexPath
+    self.WaveFormat = WaveFormat
+    self.ChunkSize = ChunkSize # u-law bytes per hand-over to the writer
+    self.WriteBufferSize = WriteBufferSize # File buffer of every open recording
+    self.Queue = queue.SimpleQueue()
+
+    # Stats:
+    self.Recordings = 0
+    self.Seconds = 0.0
+    self.Discarded = 0
+    self.Errors = 0
+
+    self.Thread = threading.Thread(target=self.writerThread, name="CallRecorder", daemon=True)
+    self.Thread.start()
+
+  # The following three are called by the slots and never block:
+  def start(self, Slot, Repeater, qso = None):
+    rec = Recording(time.time(), Slot, Repeater, qso)
+    self.Queue.put((CMD_START, rec, None))
+    return rec
+
+  # Add one frame of u-law audio. Idle frames (active = False) are only kept when voice follows:
+  def write(self, rec, ulaw, active):
+    if not active:
+      rec.Silence += ulaw
+      return
+    if rec.Silence:
+      rec.Buffer += rec.Silence
+      rec.Silence.clear()
+    rec.Buffer += ulaw
+    if len(rec.Buffer) >= self.ChunkSize: self._handOver(rec)
+
+  def end(self, rec):
+    if rec.Buffer: self._handOver(rec)
+    self.Queue.put((CMD_END, rec, None))
+
+  def _handOver(self, rec):
+    rec.Length += len(rec.Buffer)
+    self.Queue.put((CMD_DATA, rec, bytes(rec.Buffer)))
+    rec.Buffer.clear()
+
+  # Finish everything queued so far and stop the writer, end() running recordings first:
+  def close(self):
+    self.Queue.put(None)
+    self.Thread.join()
+
+  def writerThread(self):
+    db = self.openIndex()
+    files = {} # Recording -> (temporary path, file, wave writer)
+    while True:
+      item = self.Queue.get()
+      if item is None: break
+      cmd, rec, data = item
+      try:
+        if cmd == CMD_DATA:
+          if rec in files: # Not if the recording failed before
+            w = files[rec][2]
+            if self.WaveFormat == FORMAT_ULAW: w.write(data)
+            else: w.writeframesraw(HytDSP.ulaw2lin(data, 2))
+        elif cmd == CMD_START:
+          TmpPath = os.path.join(self.WavePath, "rec-%s-%d.wav.tmp" % (rec.Slot, id(rec)))
+          f = open(TmpPath, 'wb', buffering=self.WriteBufferSize)
+          if self.WaveFormat == FORMAT_ULAW:
+            w = ULawWaveWriter(f, PCMSAMPLERATE)
+          else:
+            w = wave.open(f, 'wb')
+            w.setparams((1, 2, PCMSAMPLERATE, 0, 'NONE', 'not compressed'))
+          files[rec] = (TmpPath, f, w)
+        elif cmd == CMD_END and rec in files:
+          TmpPath, f, w = files[rec]
+          w.close()
+          f.close()
+          del files[rec]
+          if rec.Length == 0:
+            os.remove(TmpPath)
+            self.Discarded += 1
+            continue
+          path = self.archive(TmpPath, rec)
+          duration = rec.Length / PCMSAMPLERATE
+          self.Recordings += 1
+          self.Seconds += duration
+          if db is None: db = self.openIndex() # Retry after an earlier failure
+          if db is None:
+            self.Errors += 1
+            print("CallRecorder: %s not added to the index" % path)
+            continue
+          db.execute("INSERT INTO recordings (start, duration, slot, repeater, rpt_id, call_type, src_id, dst_id, path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (rec.Start, duration, rec.Slot, rec.Repeater, rec.RptId, rec.CallType, rec.SrcId, rec.DstId, path))
+      except Exception as e:
+        # Full disk, locked index, ...: give up this recording (the partial file is kept), keep serving the others:
+        self.Errors += 1
+        print("CallRecorder: recording %s failed: %s" % (rec.getFileName(), e))
+        self.abandon(files, rec)
+      if db is not None and self.Queue.empty(): self.commitIndex(db) # One commit for everything that arrived in the meantime
+    for rec in list(files): self.abandon(files, rec) # Recordings not ended by the slots: keep the temporary file
+    if db is not None:
+      self.commitIndex(db)
+      db.close()
+
+  # Open the index, None if that fails (the writer keeps recording and retries later):
+  def openIndex(self):
+    db = None
+    try:
+      db = sqlite3.connect(self.IndexPath)
+      db.execute("PRAGMA journal_mode=WAL")
+      db.execute("PRAGMA synchronous=NORMAL")
+      db.executescript(SCHEMA)
+      return db
+    except sqlite3.Error as e:
+      if db is not None: db.close()
+      self.Errors += 1
+      print("CallRecorder: cannot open index %s: %s" % (self.IndexPath, e))
+      return None
+
+  # Commit, the pending rows stay in the transaction for the next attempt if the index is locked:
+  def commitIndex(self, db):
+    try:
+      db.commit()
+    except sqlite3.Error as e:
+      self.Errors += 1
+      print("CallRecorder: index commit failed:", e)
+
+  # Close the files of a recording without archiving it, the header is filled in if possible:
+  def abandon(self, files, rec):
+    entry = files.pop(rec, None)
+    if entry is None: return
+    TmpPath, f, w = entry
+    for c in (w.close, f.close):
+      try:
+        c()
+      except Exception:
+        pass
+    print("CallRecorder: partial recording kept as", TmpPath)
+
+  # Move a finished recording to its date directory, returns the path relative to WavePath:
+  def archive(self, TmpPath, rec):
+    DateDir = time.strftime('%Y/%m/%d', time.localtime(rec.Start))
+    os.makedirs(os.path.join(self.WavePath, DateDir), exist_ok=True)
+    name = rec.getFileName()
+    path = os.path.join(DateDir, name)
+    n = 1
+    while os.path.exists(os.path.join(self.WavePath, path)):
+      n += 1
+      path = os.path.join(DateDir, name[:-4] + "-%d.wav" % n)
+    os.rename(TmpPath, os.path.join(self.WavePath, path))
+    return path
+
+  # Export the stats to a HytMetrics.Registry:
+  def registerMetrics(self, registry):
+    registry.counter("hyt_recordings_total", "Calls recorded", fn=lambda: self.Recordings)
+    registry.counter("hyt_recorded_seconds_total", "Audio recorded", fn=lambda: self.Seconds)
+    registry.counter("hyt_recordings_discarded_total", "Recordings without audio", fn=lambda: self.Discarded)
+    registry.counter("hyt_recorder_errors_total", "File or index errors of the writer thread", fn=lambda: self.Errors)
+    registry.gauge("hyt_recorder_queue", "Chunks waiting for the writer thread", fn=self.Queue.qsize)
+
+  def getStats(self):
+    return {
+      "recordings": self.Recordings,
+      "seconds": self.Seconds,
+      "discarded": self.Discarded,
+      "errors": self.Errors,
+      "queued": self.Queue.qsize(),
+    }
+
+def parseTime(value):
+  if value is None or isinstance(value, (int, float)): return value
+  for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+    try:
+      return time.mktime(time.strptime(value, fmt))
+    except ValueError:
+      pass
+  raise ValueError("invalid time: " + value)
+
+# Recordings matching all given criteria, newest first. Every criterion is covered by an index:
+def findRecordings(db, SrcId = None, DstId = None, RptId = None, Since = None, Until = None, Limit = 100):
+  where = []
+  args = []
+  for column, value in (("src_id = ?", SrcId), ("dst_id = ?", DstId), ("rpt_id = ?", RptId), ("start >= ?", parseTime(Since)), ("start < ?", parseTime(Until))):
+    if value is not None:
+      where.append(column)
+      args.append(value)
+  sql = "SELECT start, duration, slot, repeater, rpt_id, call_type, src_id, dst_id, path FROM recordings"
+  if where: sql += " WHERE " + " AND ".join(where)
+  return db.execute(sql + " ORDER BY start DESC LIMIT ?", args + [Limit]).fetchall()
+
+if __name__ == "__main__":
+  HytConfig.applyOverrides(globals(), sys.argv[1:])
+  db = sqlite3.connect(INDEX)
+  start = time.monotonic()
+  rows = findRecordings(db, SRC_ID, DST_ID, RPT_ID, SINCE, UNTIL, LIMIT)
+  elapsed = time.monotonic() - start
+  for Start, duration, slot, repeater, RptId, CallType, SrcId, DstId, path in rows:
+    print("%s %6.1f s %s %-15s %s %s -> %s via %s  %s" % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(Start)), duration, slot, repeater,
+      HytCodec.decodeCallType(CallType) if CallType is not None else "?", SrcId, DstId, RptId, path))
+  print("%d recordings (%.1f ms)" % (len(rows), elapsed * 1000))
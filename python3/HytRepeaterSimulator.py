@@ -0,0 +1,336 @@
+#!/usr/bin/python3
+
+# Hytera repeater simulator, stands in for the repeater at RPT_IP of HytAudioBridge, HytMumbleBridge
+# and HytTextBridge (Linux, the virtual repeaters use 127.x.y.z addresses).
+#
+# Every virtual repeater listens on the SMS, RCP and RTP ports of both timeslots. It answers wake-calls
+# and keep-alives, ACKs control and text packets with a valid HDAP checksum and plays scripted calls:
+# QSO data on the RCP port at the start of a call, then 20 ms RTP frames (a u-law tone) until its end,
+# optionally with packet loss and jitter. Audio the bridge sends is checked for frame rate drift and
+# interarrival jitter.
+#
+# Scenarios: "idle" (keep-alives only), "calls" (back-to-back calls on both timeslots at once),
+# "alternate" (back-to-back calls taking turns between the timeslots) or SCENARIO_FILE with one call
+# per line: start time in seconds, timeslot (1/2), call type (0 private, 1 group, 2 all), source id,
+# destination id, duration in seconds, e.g. "0.5 1 1 2620101 2428 3". Lines starting with # are ignored.
+#
+# Settings can be given on the command line, e.g. HytRepeaterSimulator.py REPEATERS=20 LOSS=0.02
+# Point the bridge at it with e.g. HytAudioBridge.py LOCAL_IP=127.0.0.1 RPT_IP=127.1.0.1
+
+import asyncio
+import ipaddress
+import random
+import signal
+import sys
+import time
+import numpy as np
+import HytCodec
+import HytConfig
+import HytDSP
+from HytPacer import FramePacer, POLICY_CATCHUP
+
+# Address of the bridge (LOCAL_IP of the bridge):
+BRIDGE_IP = "127.0.0.1"
+
+# Address of the first virtual repeater (RPT_IP of the bridge), the next ones count up from there:
+REPEATER_IP = "127.1.0.1"
+REPEATERS = 1
+
+# Repeater n talks to BRIDGE_IP + n instead of BRIDGE_IP. Needed when one bridge process serves
+# several repeaters, the ports are fixed so every repeater needs its own local address at the bridge:
+BRIDGE_PER_REPEATER = False
+
+# Repeater id in QSO data, repeater n uses REPEATER_ID + n:
+REPEATER_ID = 2620001
+
+# UDP ports (SMS, RCP, RTP) of the timeslots:
+SLOT_PORTS = [(30007, 30009, 30012), (30008, 30010, 30014)]
+
+# Calls:
+SCENARIO = "calls"
+SCENARIO_FILE = None
+CALL_DURATION = 5 # Seconds
+CALL_GAP = 1 # Seconds between two calls of a timeslot
+CALL_TYPE = 1 # 0: Private 1: Group 2: AllCall
+DST_ID = 2428
+SRC_IDS = [2620101, 2620102, 2620103] # Speakers taking turns
+STAGGER = True # Start the repeaters at random offsets within one call period instead of all at once
+TONE_FREQUENCY = 1000 # Hz
+
+# Impairments of the RTP stream to the bridge:
+LOSS = 0.0 # Probability a frame is lost
+JITTER = 0.0 # Frames are delayed by up to JITTER seconds (may reorder)
+
+# Seconds to run, 0 = until CTRL+C:
+RUN_TIME = 0
+
+# Interval in seconds to print stats, 0 = only on exit:
+STATS_INTERVAL = 10
+
+# Gap in seconds after which audio from the bridge counts as a new stream (the bridge pauses for the call setup):
+STREAM_GAP = 0.08
+
+FRAME_TIME = 0.02
+
+# Exit on CTRL+C:
+def signal_handler(signal, frame):
+  Loop.call_soon_threadsafe(Loop.stop)
+
+# Datagram protocol forwarding every received packet to a handler of the slot:
+class SimProtocol(asyncio.DatagramProtocol):
+  def __init__(self, handler, transport):
+    self.handler = handler
+    self.transport = transport
+
+  def datagram_received(self, data, addr):
+    self.handler(data, self.transport)
+
+  def error_received(self, exc):
+    pass # Bridge not running (yet)
+
+# Calls of one timeslot as (start offset, call type, source id, destination id, duration), in start order:
+def generateCalls(slot, offset):
+  if SCENARIO_FILE is not None:
+    for c in ScriptedCalls:
+      if c[0] == slot: yield (offset + c[1],) + c[2:]
+    return
+  if SCENARIO == "idle": return
+  period = CALL_DURATION + CALL_GAP
+  if SCENARIO == "alternate":
+    start = offset + slot * period
+    period *= 2
+  elif SCENARIO == "calls":
+    start = offset
+  else:
+    raise ValueError("unknown scenario " + SCENARIO)
+  n = 0
+  while True:
+    yield (start, CALL_TYPE, SRC_IDS[n % len(SRC_IDS)], DST_ID, CALL_DURATION)
+    start += period
+    n += 1
+
+def readScenarioFile(path):
+  calls = []
+  with open(path) as f:
+    for line in f:
+      line = line.strip()
+      if len(line) == 0 or line.startswith("#"): continue
+      t, slot, ct, src, dst, duration = line.split()
+      calls.append((int(slot) - 1, float(t), int(ct), int(src), int(dst), float(duration)))
+  calls.sort(key=lambda c: c[1])
+  return calls
+
+# One timeslot of a virtual repeater:
+class SimSlot:
+  def __init__(self, name, RptIP, BridgeIP, RptId, ports, calls):
+    self.name = name
+    self.RptIP = RptIP
+    self.BridgeIP = BridgeIP
+    self.RptId = RptId
+    self.SMS_Port, self.RCP_Port, self.RTP_Port = ports
+    self.Calls = calls
+    self.NextCall = next(self.Calls, None)
+    self.CallEnd = None # Start offset + duration of the running call, None if idle
+
+    self.RCP_Seq = 0
+    self.RTP_Seq = random.randrange(0, 2**16)
+    self.RTP_Timestamp = random.randrange(0, 2**32)
+    self.ToneIndex = 0
+
+    # Reusable packets:
+    self.QSOPacket = bytearray(HytCodec.QSO_DATA_SIZE)
+    self.AckPacket = bytearray(HytCodec.ACK_SIZE)
+    self.RTPPacket = bytearray(HytCodec.RTP_HEADER_SIZE + len(ToneFrames[0]))
+
+    # QSO data waiting for the bridge's ACK, seq -> send time:
+    self.PendingQSO = {}
+
+    # Audio from the bridge, current stream:
+    self.StreamStart = None
+    self.StreamFrames = 0
+    self.LastArrival = None
+
+    self.Transports = {}
+
+  async def start(self, loop):
+    for port, handler in ((self.SMS_Port, self.processSMSPacket), (self.RCP_Port, self.processRCPPacket), (self.RTP_Port, self.processRTPPacket)):
+      transport, _ = await loop.create_datagram_endpoint(lambda: SimProtocol(handler, None), local_addr=(self.RptIP, port))
+      transport.get_protocol().transport = transport
+      self.Transports[port] = transport
+
+  def close(self):
+    for t in self.Transports.values(): t.close()
+
+  def send(self, port, packet):
+    self.Transports[port].sendto(packet, (self.BridgeIP, port))
+
+  # Wake-call, keep-alive, ACK and checksum handling shared by all ports. Returns True if handled:
+  def processControlPacket(self, data, transport):
+    if not HytCodec.isHyteraPacket(data): return False
+    t = data[3]
+    if t == HytCodec.TYPE_WAKECALL or t == HytCodec.TYPE_KEEPALIVE:
+      Stats["keepalives"] += 1
+      transport.sendto(HytCodec.IDLE_KEEPALIVE_PACKET, (self.BridgeIP, transport.get_extra_info('sockname')[1]))
+    elif t == HytCodec.TYPE_ACK:
+      sent = self.PendingQSO.pop(data[5], None)
+      if sent is not None: AckLatencies.append(time.monotonic() - sent)
+    elif t == HytCodec.TYPE_DATA:
+      n = len(data)
+      if n < HytCodec.HYT_HEADER_SIZE + 3 or data[n - 1] != HytCodec.HDAP_END or HytCodec.HDAPChecksum(data, HytCodec.HYT_HEADER_SIZE + 1, n - 2) != data[n - 2]:
+        Stats["bad_checksums"] += 1
+        return True
+      Stats["acked_packets"] += 1
+      HytCodec.encodeACK(self.AckPacket, data[5])
+      transport.sendto(self.AckPacket, (self.BridgeIP, transport.get_extra_info('sockname')[1]))
+      return False # Caller looks at the content
+    return True
+
+  def processSMSPacket(self, data, transport):
+    if self.processControlPacket(data, transport): return
+    if data[6] == HytCodec.HDAP_TMP:
+      Stats["texts"] += 1
+      text = bytes(data[HytCodec.HYT_HEADER_SIZE + HytCodec.TMP_HEADER.size:len(data) - 2]).decode("utf-16le", "replace")
+      print(self.name, ": text message:", text)
+
+  def processRCPPacket(self, data, transport):
+    if self.processControlPacket(data, transport): return
+    if data[6] == HytCodec.HDAP_RCP and len(data) == HytCodec.PTT_SIZE:
+      Stats["ptt_on" if data[12] else "ptt_off"] += 1
+    elif data[6] == HytCodec.HDAP_RCP and len(data) == HytCodec.CALL_SETUP_SIZE:
+      Stats["call_setups"] += 1
+
+  def processRTPPacket(self, data, transport):
+    if not HytCodec.isRTPAudio(data):
+      self.processControlPacket(data, transport)
+      return
+    now = time.monotonic()
+    Stats["bridge_frames"] += 1
+    if self.LastArrival is None or now - self.LastArrival > STREAM_GAP:
+      self.endStream()
+      self.StreamStart = now
+    else:
+      # Interarrival jitter (RFC 3550 style, against the nominal frame time):
+      global BridgeJitter
+      BridgeJitter += (abs(now - self.LastArrival - FRAME_TIME) - BridgeJitter) / 16
+    self.StreamFrames += 1
+    self.LastArrival = now
+
+  # Add the finished stream from the bridge to the drift totals:
+  def endStream(self):
+    if self.StreamFrames > 1:
+      Stats["stream_time"] += self.LastArrival - self.StreamStart
+      Stats["stream_nominal_time"] += (self.StreamFrames - 1) * FRAME_TIME
+    self.StreamFrames = 0
+
+  def startCall(self, call):
+    self.RCP_Seq = (self.RCP_Seq + 1) & 0xFF
+    HytCodec.encodeQSOData(self.QSOPacket, self.RCP_Seq, self.RptId, call[1], call[3], call[2])
+    self.send(self.RCP_Port, self.QSOPacket)
+    self.PendingQSO[self.RCP_Seq] = time.monotonic()
+    Stats["calls"] += 1
+
+  def sendFrame(self):
+    self.RTP_Seq = (self.RTP_Seq + 1) & 0xFFFF
+    self.RTP_Timestamp = (self.RTP_Timestamp + len(ToneFrames[0])) & 0xFFFFFFFF
+    self.ToneIndex = (self.ToneIndex + 1) % len(ToneFrames)
+    Stats["frames"] += 1
+    if random.random() < LOSS:
+      Stats["lost_frames"] += 1
+      return
+    HytCodec.encodeRTPHeader(self.RTPPacket, self.RTP_Seq, self.RTP_Timestamp)
+    self.RTPPacket[HytCodec.RTP_HEADER_SIZE:] = ToneFrames[self.ToneIndex]
+    if JITTER > 0:
+      Loop.call_later(random.uniform(0, JITTER), self.send, self.RTP_Port, bytes(self.RTPPacket))
+    else:
+      self.send(self.RTP_Port, self.RTPPacket)
+
+  # One frame period, t is the time since start in seconds:
+  def tick(self, t):
+    if self.CallEnd is not None and t >= self.CallEnd: self.CallEnd = None
+    if self.CallEnd is None and self.NextCall is not None and t >= self.NextCall[0]:
+      self.startCall(self.NextCall)
+      self.CallEnd = self.NextCall[0] + self.NextCall[4]
+      self.NextCall = next(self.Calls, None)
+    if self.CallEnd is not None: self.sendFrame()
+
+# Nearest rank percentile:
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+def printStats():
+  elapsed = max(time.monotonic() - StartTime, 1e-3)
+  unacked = sum(len(s.PendingQSO) for s in Slots)
+  print("Repeaters: %d, slots %d, running %.0f s, CPU %.1f%%, %d late ticks" % (REPEATERS, len(Slots), elapsed,
+    100 * (time.process_time() - StartCPU) / elapsed, Pacer.getStats()["late_frames"]))
+  print("To bridge: %d calls, %d RTP frames, %d lost" % (Stats["calls"], Stats["frames"], Stats["lost_frames"]))
+  print("QSO ACKs: %d of %d, latency p50 %s ms, p99 %s ms" % (len(AckLatencies), len(AckLatencies) + unacked,
+    "%.1f" % (percentile(AckLatencies, 50) * 1000) if AckLatencies else "-", "%.1f" % (percentile(AckLatencies, 99) * 1000) if AckLatencies else "-"))
+  drift = (Stats["stream_time"] / Stats["stream_nominal_time"] - 1) * 1e6 if Stats["stream_nominal_time"] > 0 else 0
+  print("From bridge: %d RTP frames, drift %+.0f ppm, jitter %.2f ms" % (Stats["bridge_frames"], drift, BridgeJitter * 1000))
+  print("Control: %d keep-alives, %d ACKed packets, %d bad checksums, %d call setups, %d PTT on, %d PTT off, %d texts" % (Stats["keepalives"],
+    Stats["acked_packets"], Stats["bad_checksums"], Stats["call_setups"], Stats["ptt_on"], Stats["ptt_off"], Stats["texts"]))
+
+async def tickTask():
+  global LastStatsTime
+  Pacer.start()
+  start = time.monotonic_ns()
+  while True:
+    now = time.monotonic_ns()
+    for i in range(Pacer.poll(now)):
+      t = (now - start) / 1000000000
+      for s in Slots: s.tick(t)
+    if RUN_TIME > 0 and (now - start) / 1000000000 >= RUN_TIME:
+      Loop.stop()
+      return
+    if STATS_INTERVAL > 0 and time.monotonic() - LastStatsTime >= STATS_INTERVAL:
+      printStats()
+      LastStatsTime = time.monotonic()
+    await asyncio.sleep(Pacer.timeToNextFrame())
+
+def offsetIP(ip, n):
+  return str(ipaddress.ip_address(ip) + n)
+
+# Settings from the command line (NAME=VALUE, see HytConfig.py):
+HytConfig.applyOverrides(globals(), sys.argv[1:])
+
+print("HytRepeaterSimulator 0.01")
+ScriptedCalls = readScenarioFile(SCENARIO_FILE) if SCENARIO_FILE is not None else []
+
+# One second of the tone in 20 ms u-law frames, played in a loop:
+Tone = (np.sin(2 * np.pi * TONE_FREQUENCY * np.arange(8000) / 8000) * 8000).astype(np.int16)
+ToneFrames = [HytDSP.ulawEncode(Tone[i:i + 160]).tobytes() for i in range(0, 8000, 160)]
+
+Stats = dict.fromkeys(("calls", "frames", "lost_frames", "bridge_frames", "stream_time", "stream_nominal_time", "keepalives",
+  "acked_packets", "bad_checksums", "call_setups", "ptt_on", "ptt_off", "texts"), 0)
+AckLatencies = []
+BridgeJitter = 0.0
+
+Loop = asyncio.new_event_loop()
+asyncio.set_event_loop(Loop)
+Slots = []
+for n in range(REPEATERS):
+  RptIP = offsetIP(REPEATER_IP, n)
+  BridgeIP = offsetIP(BRIDGE_IP, n) if BRIDGE_PER_REPEATER else BRIDGE_IP
+  offset = random.uniform(0, CALL_DURATION + CALL_GAP) if STAGGER and n > 0 else 0
+  for i, ports in enumerate(SLOT_PORTS):
+    s = SimSlot("%s TS%d" % (RptIP, i + 1), RptIP, BridgeIP, REPEATER_ID + n, ports, generateCalls(i, offset))
+    Loop.run_until_complete(s.start(Loop))
+    Slots.append(s)
+print("Simulating", REPEATERS, "repeaters from", REPEATER_IP, "for bridge", BRIDGE_IP, "(one address per repeater)" if BRIDGE_PER_REPEATER else "")
+
+signal.signal(signal.SIGINT, signal_handler)
+signal.signal(signal.SIGTERM, signal_handler)
+Pacer = FramePacer(8000, 160, POLICY_CATCHUP)
+StartTime = LastStatsTime = time.monotonic()
+StartCPU = time.process_time()
+Task = Loop.create_task(tickTask())
+Loop.run_forever()
+
+print("Exit!")
+for s in Slots: s.endStream()
+printStats()
+Task.cancel()
+for s in Slots: s.close()
+Loop.close()
+sys.exit(0)
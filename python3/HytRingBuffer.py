@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+
+# Fixed-capacity single-producer/single-consumer byte ring buffer.
+# The producer (e.g. playFile() or the Mumble callback thread) only advances WritePos, the consumer
+# (the playout tick) only advances ReadPos. Both are plain ints, so no lock is needed under the GIL.
+# Frames are copied straight from the ring into a caller supplied buffer (e.g. the payload of a
+# preallocated RTP packet) without intermediate bytes objects.
+
+import time
+
+# What write() does when the data does not fit:
+OVERFLOW_DROP = 0 # Store what fits and drop the rest
+OVERFLOW_BLOCK = 1 # Wait until the consumer made room (backpressure)
+
+class RingBuffer:
+  def __init__(self, Capacity, Policy = OVERFLOW_DROP):
+    self.Capacity = Capacity
+    self.Policy = Policy
+    self.Buffer = bytearray(Capacity)
+    self.View = memoryview(self.Buffer)
+    self.ReadPos = 0 # Total bytes ever read, only written by the consumer
+    self.WritePos = 0 # Total bytes ever written, only written by the producer
+    self.HighWaterMark = 0 # Maximum fill level seen
+    self.DroppedBytes = 0 # Bytes lost to OVERFLOW_DROP or a write timeout
+
+  def __len__(self):
+    return self.WritePos - self.ReadPos
+
+  def free(self):
+    return self.Capacity - (self.WritePos - self.ReadPos)
+
+  # Append data. Returns the number of bytes stored.
+  # With OVERFLOW_BLOCK the call waits for free space, at most timeout seconds if given.
+  def write(self, data, timeout = None):
+    src = memoryview(data).cast('B')
+    total = len(src)
+    done = 0
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while done < total:
+      n = min(total - done, self.free())
+      if n == 0:
+        if self.Policy != OVERFLOW_BLOCK or (deadline is not None and time.monotonic() >= deadline):
+          self.DroppedBytes += total - done
+          break
+        time.sleep(0.005)
+        continue
+      pos = self.WritePos % self.Capacity
+      first = min(n, self.Capacity - pos)
+      self.View[pos:pos + first] = src[done:done + first]
+      if first < n: self.View[0:n - first] = src[done + first:done + n]
+      done += n
+      self.WritePos += n # Publish only after the bytes are in place
+      level = self.WritePos - self.ReadPos
+      if level > self.HighWaterMark: self.HighWaterMark = level
+    return done
+
+  # Move up to len(dest) bytes into dest (a writable buffer, e.g. a memoryview slice of a packet).
+  # Returns the number of bytes copied.
+  def readInto(self, dest):
+    n = min(len(dest), self.WritePos - self.ReadPos)
+    if n == 0: return 0
+    pos = self.ReadPos % self.Capacity
+    first = min(n, self.Capacity - pos)
+    dest[0:first] = self.View[pos:pos + first]
+    if first < n: dest[first:n] = self.View[0:n - first]
+    self.ReadPos += n
+    return n
+
+  # Discard everything queued (consumer side):
+  def clear(self):
+    self.ReadPos = self.WritePos
+
+  def getStats(self):
+    return {
+      "level": len(self),
+      "capacity": self.Capacity,
+      "high_water_mark": self.HighWaterMark,
+      "dropped_bytes": self.DroppedBytes,
+    }
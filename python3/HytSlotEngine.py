@@ -0,0 +1,392 @@
+#!/usr/bin/python3
+
+# Asyncio engine driving many AudioSlots (RCP+RTP of one timeslot each) from a single event loop.
+# One loop with datagram endpoints and two timer tasks replaces the four OS threads per timeslot,
+# so a single process can serve many repeaters and timeslots without fighting over the GIL.
+
+import asyncio
+import threading
+import time
+import traceback
+from HytPacer import FramePacer, POLICY_CATCHUP
+from HytRingBuffer import RingBuffer, OVERFLOW_DROP
+from HytJitterBuffer import JitterBuffer
+import HytCodec
+import HytDSP
+
+# Interval in seconds between idle keep-alive packets sent to the repeater:
+KEEPALIVE_INTERVAL = 2
+
+# Time in seconds between call setup and PTT when starting a transmission:
+CALL_SETUP_DELAY = 0.1
+
+# Default capacity of the transmit queue in seconds of audio:
+TX_BUFFER_SECONDS = 60
+
+# Send idle frames (all 0xFF) while not transmitting. The RTP stream then never stops, as with the
+# original bridge; with False the slot only sends audio during a transmission (plus keep-alives):
+SEND_IDLE_FRAMES = True
+
+# Datagram protocol forwarding every received packet to a handler method of the slot:
+class SlotProtocol(asyncio.DatagramProtocol):
+  def __init__(self, slot, handler):
+    self.slot = slot
+    self.handler = handler
+    self.Packets = 0
+
+  # Times the handler when the slot exports metrics (see AsyncAudioSlot.registerMetrics()):
+  def datagram_received(self, data, addr):
+    self.Packets += 1
+    h = self.slot.PacketTime
+    if h is None:
+      self.handler(data)
+      return
+    start = time.perf_counter_ns()
+    self.handler(data)
+    end = time.perf_counter_ns()
+    h.observe((end - start) / 1000000000)
+    self.slot.LastRxNs = end
+
+  def error_received(self, exc):
+    print(self.slot.name, ": socket error:", exc)
+
+# Audio (RCP+RTP) for one timeslot, driven by a SlotEngine.
+# Subclasses override processRCPPacket() to handle control packets and processRxAudio() to handle
+# received u-law audio, which arrives reordered and gap-filled through the jitter buffer. Idle frames
+# (all 0xFF, "Empty RTP") go to processRxIdle() instead, so they cost no recording, resampling or forwarding.
+class AsyncAudioSlot:
+  def __init__(self, name, LocalIP, RptIP, RCP_Port, RTP_Port, TxBufferSeconds = TX_BUFFER_SECONDS, TxOverflowPolicy = OVERFLOW_DROP):
+    # Portnummern merken:
+    self.name = name
+    self.LocalIP = LocalIP
+    self.RptIP = RptIP
+    self.RCP_Port = RCP_Port
+    self.RTP_Port = RTP_Port
+
+    # Constants:
+    self.WakeCallPacket = HytCodec.WAKE_CALL_PACKET
+    self.IdleKeepAlivePacket = HytCodec.IDLE_KEEPALIVE_PACKET
+    self.PCMSAMPLERATE = 8000
+    self.RTP_DATA_SIZE = 160
+
+    # Tx-Buffer (u-law bytes, filled by one producer thread, drained by the playout tick):
+    self.TxBufferULaw = RingBuffer(TxBufferSeconds * self.PCMSAMPLERATE, TxOverflowPolicy)
+    self.PTT = False
+    self.CallSetupTime = None # Monotonic time the pending call setup was sent, None if none pending
+    self.RTP_Seq = int(time.time() * self.PCMSAMPLERATE)
+    self.RTP_Timestamp = self.RTP_Seq
+
+    # Preallocated RTP packet, the payload is filled in place for every frame:
+    self.RTPPacket = bytearray(HytCodec.RTP_HEADER_SIZE + self.RTP_DATA_SIZE)
+    self.RTPPayload = memoryview(self.RTPPacket)[HytCodec.RTP_HEADER_SIZE:]
+    self.IdlePayload = b'\xff' * self.RTP_DATA_SIZE
+
+    self.RCP_Seq = self.RTP_Seq
+    self.CallType = 0 # 0: Private 1: Group 2: AllCall
+    self.DstId = 0
+
+    # Reusable control packets:
+    self.AckPacket = bytearray(HytCodec.ACK_SIZE)
+    self.CallSetupPacket = bytearray(HytCodec.CALL_SETUP_SIZE)
+    self.PTTPacket = bytearray(HytCodec.PTT_SIZE)
+    self.RxRTPInfo = HytCodec.RTPInfo()
+
+    # Optional HytMixer.AudioMixer feeding the Tx-Buffer with one mixed frame per tick,
+    # gated by an optional HytDSP.EnergyVAD so background noise does not key the repeater:
+    self.TxMixer = None
+    self.TxVAD = None
+    self.SendIdleFrames = SEND_IDLE_FRAMES
+
+    # Rx jitter buffer, filled by processRTPPacket() and drained by tick():
+    self.RxJitter = JitterBuffer(self.PCMSAMPLERATE)
+    self.RxIdleFrames = 0
+    self.TxFrames = 0
+    self.TickErrors = 0 # Exceptions raised by tick(), see SlotEngine.tickSlots()
+    self.LastTickError = None
+
+    # Histograms of packet handling time and receive jitter, set by registerMetrics():
+    self.PacketTime = None
+    self.JitterHistogram = None
+    self.LastRxNs = None # time.perf_counter_ns() of the last packet from the repeater
+
+    # Transports and protocols, created by start():
+    self.RCP_Transport = self.RCP_Protocol = None
+    self.RTP_Transport = self.RTP_Protocol = None
+    self.Engine = None # SlotEngine driving this slot, set by SlotEngine.addSlot()
+
+  # Bind sockets on the engine's loop. Must run inside the loop.
+  async def start(self):
+    loop = asyncio.get_running_loop()
+    self.RCP_Transport, self.RCP_Protocol = await loop.create_datagram_endpoint(lambda: SlotProtocol(self, self.processRCPPacket), local_addr=(self.LocalIP, self.RCP_Port))
+    self.RTP_Transport, self.RTP_Protocol = await loop.create_datagram_endpoint(lambda: SlotProtocol(self, self.processRTPPacket), local_addr=(self.LocalIP, self.RTP_Port))
+    self.sendRCP(self.WakeCallPacket)
+    self.sendRTP(self.WakeCallPacket)
+
+  # Compatibility with the threaded AudioSlot of older versions: code still starting the four thread
+  # functions with _thread.start_new_thread() gets the slot added to the default engine (once). The
+  # threads then just wait until the engine stops, all the work happens on the engine.
+  def runOnEngine(self):
+    with CompatLock:
+      if self.Engine is None: getDefaultEngine().addSlot(self)
+      engine = self.Engine
+    engine.Stopped.wait()
+
+  def RCP_Rx_Thread(self, threadName):
+    self.runOnEngine()
+
+  def RTP_Rx_Thread(self, threadName):
+    self.runOnEngine()
+
+  def TxIdleMsgThread(self, threadName):
+    self.runOnEngine()
+
+  def TxAudioThread(self, threadName):
+    self.runOnEngine()
+
+  def close(self):
+    if self.RCP_Transport: self.RCP_Transport.close()
+    if self.RTP_Transport: self.RTP_Transport.close()
+    self.RCP_Transport = self.RTP_Transport = None
+
+  def sendRCP(self, packet):
+    if self.RCP_Transport: self.RCP_Transport.sendto(packet, (self.RptIP, self.RCP_Port))
+
+  def sendRTP(self, packet):
+    if self.RTP_Transport: self.RTP_Transport.sendto(packet, (self.RptIP, self.RTP_Port))
+
+  def getNextRCPSeq(self):
+    self.RCP_Seq = (self.RCP_Seq + 1) & 0xFF
+    return self.RCP_Seq
+
+  def sendACK(self, seq):
+    HytCodec.encodeACK(self.AckPacket, seq)
+    self.sendRCP(self.AckPacket)
+
+  def sendCallSetup(self, CallType, DstId):
+    HytCodec.encodeCallSetup(self.CallSetupPacket, self.getNextRCPSeq(), CallType, DstId)
+    self.sendRCP(self.CallSetupPacket)
+
+  def sendPTT(self, onoff):
+    HytCodec.encodePTT(self.PTTPacket, self.getNextRCPSeq(), onoff)
+    self.sendRCP(self.PTTPacket)
+
+  def sendAudioFrame(self):
+    n = self.TxBufferULaw.readInto(self.RTPPayload)
+    if n < self.RTP_DATA_SIZE: self.RTPPayload[n:] = self.IdlePayload[n:] # Pad with silence
+    self.RTP_Seq = (self.RTP_Seq + 1) & 0xFFFF
+    self.RTP_Timestamp = (self.RTP_Timestamp + self.RTP_DATA_SIZE) & 0xFFFFFFFF
+    HytCodec.encodeRTPHeader(self.RTPPacket, self.RTP_Seq, self.RTP_Timestamp)
+    self.sendRTP(self.RTPPacket)
+    self.TxFrames += 1
+
+  # Received RCP packet, override in subclass:
+  def processRCPPacket(self, data):
+    pass
+
+  # Received RTP packet, queue audio in the jitter buffer:
+  def processRTPPacket(self, data):
+    if HytCodec.isRTPAudio(data):
+      info = HytCodec.decodeRTPHeader(data, self.RxRTPInfo)
+      self.RxJitter.push(info.Seq, info.Timestamp, memoryview(data)[HytCodec.RTP_HEADER_SIZE:], time.monotonic())
+      if self.JitterHistogram is not None: self.JitterHistogram.observe(self.RxJitter.Jitter)
+
+  # Received u-law audio in playout order, override in subclass:
+  def processRxAudio(self, payload):
+    pass
+
+  # Received idle frame (including frames concealing a loss), override in subclass if the timing matters:
+  def processRxIdle(self, payload):
+    pass
+
+  def sendKeepAlive(self):
+    self.sendRCP(self.IdleKeepAlivePacket)
+    self.sendRTP(self.IdleKeepAlivePacket)
+
+  def getMetricLabels(self):
+    return {"slot": self.name, "repeater": self.RptIP}
+
+  # Export the stats of this slot to a HytMetrics.Registry and time its packet handling:
+  def registerMetrics(self, registry):
+    labels = self.getMetricLabels()
+    for port in ("rcp", "rtp"):
+      registry.counter("hyt_slot_rx_packets_total", "Packets received from the repeater", dict(labels, port=port),
+        fn=lambda port=port: getattr(getattr(self, port.upper() + "_Protocol"), "Packets", 0))
+    registry.gauge("hyt_slot_last_rx_age_seconds", "Seconds since the last packet from the repeater (keep-alives every few seconds)", labels,
+      fn=lambda: (time.perf_counter_ns() - self.LastRxNs) / 1000000000 if self.LastRxNs is not None else None)
+    registry.counter("hyt_slot_tx_frames_total", "RTP frames sent to the repeater", labels, fn=lambda: self.TxFrames)
+    registry.gauge("hyt_slot_tx_queue_seconds", "Audio in the transmit queue", labels, fn=lambda: len(self.TxBufferULaw) / self.PCMSAMPLERATE)
+    registry.gauge("hyt_slot_ptt", "1 while transmitting", labels, fn=lambda: self.PTT)
+    registry.counter("hyt_slot_tick_errors_total", "Exceptions raised while processing a frame tick", labels, fn=lambda: self.TickErrors)
+    registry.counter("hyt_slot_rx_idle_frames_total", "Received idle frames (all 0xFF)", labels, fn=lambda: self.RxIdleFrames)
+    j = self.RxJitter
+    registry.counter("hyt_slot_rx_frames_total", "RTP frames received", labels, fn=lambda: j.Received)
+    registry.counter("hyt_slot_rx_played_frames_total", "Frames played out by the jitter buffer", labels, fn=lambda: j.Played)
+    registry.counter("hyt_slot_rx_lost_frames_total", "Frames lost (concealed) in the jitter buffer", labels, fn=lambda: j.Lost)
+    registry.counter("hyt_slot_rx_late_drops_total", "Frames dropped for arriving after their playout time", labels, fn=lambda: j.LateDrops)
+    registry.counter("hyt_slot_rx_duplicates_total", "Duplicate frames dropped", labels, fn=lambda: j.Duplicates)
+    registry.counter("hyt_slot_rx_resyncs_total", "Talkspurts restarted after a sequence or timestamp jump", labels, fn=lambda: j.Resyncs)
+    registry.gauge("hyt_slot_rx_delay_seconds", "Playout delay of the jitter buffer", labels, fn=lambda: j.Delay)
+    registry.gauge("hyt_slot_rx_depth_seconds", "Audio held in the jitter buffer", labels, fn=j.getDepth)
+    self.JitterHistogram = registry.histogram("hyt_slot_rx_jitter_seconds", "Interarrival jitter estimate (RFC 3550), sampled per RTP packet", labels)
+    self.PacketTime = registry.histogram("hyt_slot_packet_handling_seconds", "Time to handle one received packet", labels)
+
+  # Called by the engine once per audio frame period with the monotonic time in seconds. Handles call setup, PTT and sends one frame.
+  def tick(self, now):
+    for payload in self.RxJitter.pull(now):
+      if payload == self.IdlePayload:
+        self.RxIdleFrames += 1
+        self.processRxIdle(payload)
+      else: self.processRxAudio(payload)
+
+    # Take one mixed frame, but only when the previous one is gone (e.g. not during call setup):
+    if self.TxMixer is not None and len(self.TxBufferULaw) < self.RTP_DATA_SIZE:
+      frame = self.TxMixer.mixFrame()
+      if frame is not None:
+        if self.TxVAD is None: self.TxBufferULaw.write(HytDSP.ulawEncode(frame))
+        else:
+          for f in self.TxVAD.process(frame): self.TxBufferULaw.write(HytDSP.ulawEncode(f))
+
+    if len(self.TxBufferULaw) > 0:
+      if not self.PTT:
+        if self.CallSetupTime is None:
+          self.sendCallSetup(self.CallType, self.DstId)
+          self.CallSetupTime = now
+        if now - self.CallSetupTime < CALL_SETUP_DELAY: return # Give repeater time to set up the call
+        self.sendPTT(True)
+        self.PTT = True
+        self.CallSetupTime = None
+    else:
+      if self.PTT:
+        self.sendPTT(False)
+        self.sendPTT(False)
+        self.PTT = False
+      elif not self.SendIdleFrames:
+        self.RTP_Timestamp = (self.RTP_Timestamp + self.RTP_DATA_SIZE) & 0xFFFFFFFF # Time goes on
+        return
+    self.sendAudioFrame()
+
+# Event loop with all registered slots. Runs either in the calling thread (run())
+# or in one background thread (startThread()).
+class SlotEngine:
+  def __init__(self, PCMSampleRate = 8000, FrameSize = 160, PacerPolicy = POLICY_CATCHUP):
+    self.PCMSAMPLERATE = PCMSampleRate
+    self.RTP_DATA_SIZE = FrameSize
+    self.Pacer = FramePacer(PCMSampleRate, FrameSize, PacerPolicy)
+    self.Slots = []
+    self.loop = asyncio.new_event_loop()
+    self.Thread = None
+    self.Tasks = []
+    self.Stopped = threading.Event() # Set when the loop has stopped and closed the slots
+
+    # Set by registerMetrics():
+    self.Metrics = None
+    self.Lateness = None
+    self.TickTime = None
+
+  # Register and bind a slot. Thread-safe, may be called before or after the loop is running.
+  def addSlot(self, slot):
+    if self.Thread is not None or self.loop.is_running():
+      asyncio.run_coroutine_threadsafe(self._addSlot(slot), self.loop).result()
+    else:
+      self.loop.run_until_complete(self._addSlot(slot))
+    return slot
+
+  async def _addSlot(self, slot):
+    await slot.start()
+    self.Slots.append(slot)
+    slot.Engine = self
+    if self.Metrics is not None: slot.registerMetrics(self.Metrics)
+
+  def removeSlot(self, slot):
+    def _remove():
+      if slot in self.Slots: self.Slots.remove(slot)
+      slot.close()
+      slot.Engine = None
+      if self.Metrics is not None: self.Metrics.unregister(slot.getMetricLabels())
+    self.loop.call_soon_threadsafe(_remove)
+
+  # Export pacer stats and the stats of all slots, present and future, to a HytMetrics.Registry:
+  def registerMetrics(self, registry):
+    p = self.Pacer
+    registry.gauge("hyt_engine_slots", "Slots driven by the engine", fn=lambda: len(self.Slots))
+    registry.counter("hyt_engine_frames_total", "Frame ticks released by the pacer", fn=lambda: p.Frames)
+    registry.counter("hyt_engine_late_wakeups_total", "Pacer wake-ups more than one frame period late", fn=lambda: p.LateFrames)
+    registry.counter("hyt_engine_skipped_frames_total", "Frame ticks dropped by the pacer", fn=lambda: p.SkippedFrames)
+    self.Lateness = registry.histogram("hyt_engine_tick_lateness_seconds", "Lateness of the pacer wake-ups")
+    self.TickTime = registry.histogram("hyt_engine_tick_seconds", "Time to process one frame tick of all slots")
+    self.Metrics = registry
+    for slot in list(self.Slots): slot.registerMetrics(registry)
+
+  async def keepAliveTask(self):
+    while True:
+      for slot in self.Slots: slot.sendKeepAlive()
+      await asyncio.sleep(KEEPALIVE_INTERVAL)
+
+  # One frame tick of all slots. An exception in one slot is logged and counted, the others keep running.
+  # Repeated errors are printed only when the message changes, so a broken slot does not flood the log at 50 Hz:
+  def tickSlots(self, now):
+    for slot in self.Slots:
+      try:
+        slot.tick(now)
+      except Exception as e:
+        slot.TickErrors += 1
+        if repr(e) != slot.LastTickError:
+          slot.LastTickError = repr(e)
+          print(slot.name, ": error in tick:")
+          traceback.print_exc()
+
+  # Ticks that are overdue run back to back, each with the current time (not the time of the wake-up),
+  # so timeouts in tick() see the time that actually passed:
+  async def playoutTask(self):
+    self.Pacer.start()
+    while True:
+      due = self.Pacer.poll(time.monotonic_ns())
+      if due > 0 and self.TickTime is not None:
+        self.Lateness.observe(self.Pacer.LastLatenessNs / 1000000000)
+        start = time.perf_counter_ns()
+        for i in range(due): self.tickSlots(time.monotonic())
+        self.TickTime.observe((time.perf_counter_ns() - start) / 1000000000 / due)
+      else:
+        for i in range(due): self.tickSlots(time.monotonic())
+      await asyncio.sleep(self.Pacer.timeToNextFrame())
+
+  def _run(self):
+    self.Stopped.clear()
+    asyncio.set_event_loop(self.loop)
+    self.Tasks = [self.loop.create_task(self.keepAliveTask()), self.loop.create_task(self.playoutTask())]
+    self.loop.run_forever()
+    # Stopped, clean up:
+    for t in self.Tasks: t.cancel()
+    self.loop.run_until_complete(asyncio.gather(*self.Tasks, return_exceptions=True))
+    for slot in self.Slots: slot.close()
+    self.loop.run_until_complete(asyncio.sleep(0)) # Let the transports close their sockets
+    self.Tasks = []
+    self.Stopped.set()
+
+  # Run the engine in the calling thread until stop() is called:
+  def run(self):
+    self._run()
+
+  # Run the engine in one background (daemon) thread:
+  def startThread(self):
+    if self.Thread is None:
+      self.Thread = threading.Thread(target=self._run, name="SlotEngine", daemon=True)
+      self.Thread.start()
+    return self.Thread
+
+  def stop(self):
+    self.loop.call_soon_threadsafe(self.loop.stop)
+    if self.Thread is not None and self.Thread is not threading.current_thread():
+      self.Thread.join()
+      self.Thread = None
+
+# Engine shared by all slots of a process:
+DefaultEngine = None
+CompatLock = threading.Lock() # Serializes AsyncAudioSlot.runOnEngine()
+
+def getDefaultEngine():
+  global DefaultEngine
+  if DefaultEngine is None:
+    DefaultEngine = SlotEngine()
+    DefaultEngine.startThread()
+  return DefaultEngine
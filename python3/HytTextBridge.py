@@ -4,9 +4,16 @@
 
 import socket
 import _thread
+import threading
+import queue
 import time
 import signal
 import sys
+import collections
+import HytCodec
+import HytConfig
+import HytMetrics
+import HytTextStore
 
 # IP-Adresse vom Repeater:
 #LOCAL_IP = "127.0.0.1"
@@ -18,46 +25,147 @@ RPT_IP = "192.168.0.201"
 SMS_PORT_TS1 = 30007
 SMS_PORT_TS2 = 30008
 
+# Seconds to wait for the repeater's ACK of a text message and number of retries before giving up:
+ACK_TIMEOUT = 1.0
+MAX_RETRIES = 3
+
+# Max. messages waiting to be sent per timeslot, sendText() blocks when the queue is full:
+TX_QUEUE_SIZE = 1000
+
+# Max. length of the UTF-16LE encoded text in bytes:
+MAX_TEXT_SIZE = 512
+
+# Received text messages are stored in this SQLite database (None: not stored) and optionally appended to a JSON Lines file:
+TEXT_DB = "texts.sqlite"
+TEXT_JSONL = None
+
+# Seconds a received message is remembered to drop retransmits by the repeater (its ACK got lost):
+DEDUPE_WINDOW = 30
+
+# Receive buffer of the SMS sockets in bytes, holds a burst of messages while the Rx thread is busy (Linux caps it at net.core.rmem_max):
+RX_BUFFER_SIZE = 4 << 20
+
+# Prometheus metrics on http://METRICS_IP:METRICS_PORT/metrics (see HytMetrics.py), None: off:
+METRICS_IP = "127.0.0.1"
+METRICS_PORT = 9702
+
 # Bei STRG+C beenden:
 def signal_handler(signal, frame):
   print("Abort!")
+  TextSlot1.stop()
+  TextSlot2.stop()
+  if Store is not None: Store.close() # Write the messages still queued
   sys.exit(0)
 
 class TextSlot:
-  def __init__(self, name, RptIP, SMS_Port):
+  def __init__(self, name, RptIP, SMS_Port, Store = None):
     # Portnummern merken:
     self.name = name
     self.RptIP = RptIP
     self.SMS_Port = SMS_Port
+    self.Store = Store # HytTextStore.TextStore for received messages or None
 
     # Constants:
-    self.WakeCallPacket = bytes.fromhex('324200050000')
-    self.IdleKeepAlivePacket = bytes.fromhex('324200020000')
+    self.WakeCallPacket = HytCodec.WAKE_CALL_PACKET
+    self.IdleKeepAlivePacket = HytCodec.IDLE_KEEPALIVE_PACKET
 
     self.SMS_Seq = 0
 
+    # Reusable packet buffers:
+    self.AckPacket = bytearray(HytCodec.ACK_SIZE)
+    self.TextPacket = bytearray(HytCodec.TMP_OVERHEAD + MAX_TEXT_SIZE)
+
+    # Outbound messages (SrcId, DstId, encoded text), sent one at a time by SMS_Tx_Thread:
+    self.TxQueue = queue.Queue(TX_QUEUE_SIZE)
+    self.PendingSeq = None # Sequence number of the message waiting for its ACK
+    self.AckEvent = threading.Event()
+
+    # Received messages within DEDUPE_WINDOW, (seq, request id, src id) -> time, oldest first:
+    self.RecentMessages = collections.OrderedDict()
+    self.RxMessage = HytCodec.TextMessage()
+    self.RxLock = threading.Lock() # Held while a received packet is handled, see stop()
+    self.Stopped = False
+
+    # Stats:
+    self.SentMessages = 0
+    self.AckedMessages = 0
+    self.Retries = 0
+    self.FailedMessages = 0
+    self.ReceivedMessages = 0
+    self.Duplicates = 0
+    self.BadChecksums = 0
+    self.RxPackets = 0
+    self.LastRxNs = None # time.perf_counter_ns() of the last packet from the repeater
+    self.PacketTime = None # Histogram of the packet handling time, set by registerMetrics()
+
     # Socket anlegen:
     self.SMS_Sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.SMS_Sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RX_BUFFER_SIZE)
 
     # Socket an Ports binden:
     self.SMS_Sock.bind((LOCAL_IP, SMS_Port))
     _thread.start_new_thread(self.SMS_Rx_Thread, (name,))
     _thread.start_new_thread(self.TxIdleMsgThread, (name,))
+    _thread.start_new_thread(self.SMS_Tx_Thread, (name,))
+
+  # Stop handling received packets, so nothing reaches the store after it is closed. Returns once
+  # the packet being handled is done. Text messages received later are not ACKed, the sender repeats them:
+  def stop(self):
+    with self.RxLock:
+      self.Stopped = True
 
   def getNextSMSSeq(self):
     self.SMS_Seq = (self.SMS_Seq + 1) & 0xFF
     return self.SMS_Seq
 
   def sendACK(self, seq):
-    AckPacket = bytearray.fromhex('324200010100')
-    AckPacket[5] = seq;
-    self.SMS_Sock.sendto(AckPacket, (self.RptIP, self.SMS_Port))
+    HytCodec.encodeACK(self.AckPacket, seq)
+    self.SMS_Sock.sendto(self.AckPacket, (self.RptIP, self.SMS_Port))
 
+  # ACKs valid data packets at once, then hands new text messages to the store. Nothing in here blocks,
+  # so a burst of messages is only limited by the socket's receive buffer:
   def SMS_Rx_Thread(self, threadName):
     #print(threadName, "SMS_Rx_Thread started")
     while True:
-      data, addr = self.SMS_Sock.recvfrom(1024)
+      data, addr = self.SMS_Sock.recvfrom(2048)
       #print(threadName, "SMS_Rx_Thread: received message:", data)
+      self.RxPackets += 1
+      with self.RxLock:
+        if self.Stopped: continue
+        if self.PacketTime is None:
+          self.processSMSPacket(data, addr)
+          continue
+        start = time.perf_counter_ns()
+        self.processSMSPacket(data, addr)
+        end = time.perf_counter_ns()
+      self.PacketTime.observe((end - start) / 1000000000)
+      self.LastRxNs = end
+
+  def processSMSPacket(self, data, addr):
+    if not HytCodec.isHyteraPacket(data): return
+    if data[3] == HytCodec.TYPE_ACK:
+      if data[5] == self.PendingSeq: self.AckEvent.set()
+    elif data[3] == HytCodec.TYPE_DATA:
+      if not HytCodec.isValidHDAP(data):
+        self.BadChecksums += 1 # No ACK, the repeater sends it again
+        return
+      self.sendACK(data[5])
+      if HytCodec.isTextMessage(data): self.processTextMessage(data, addr)
+
+  def processTextMessage(self, data, addr):
+    now = time.time()
+    msg = HytCodec.decodeTextMessage(data, self.RxMessage)
+    recent = self.RecentMessages
+    while recent and next(iter(recent.values())) < now - DEDUPE_WINDOW: recent.popitem(last=False)
+    key = (msg.Seq, msg.RequestId, msg.SrcId)
+    if key in recent:
+      self.Duplicates += 1
+      return
+    recent[key] = now
+    self.ReceivedMessages += 1
+    print(self.name, ":", msg)
+    if self.Store is not None:
+      self.Store.put(HytTextStore.TextRecord(now, self.name, addr[0], msg.Seq, msg.SrcId, msg.DstId, msg.Text))
 
   def TxIdleMsgThread(self, threadName):
     #print(threadName, "TxIdleMsgThread started")
@@ -66,38 +174,89 @@ class TextSlot:
       self.SMS_Sock.sendto(self.IdleKeepAlivePacket, (self.RptIP, self.SMS_Port))
       time.sleep(2)
 
+  # Queue a text message, returns at once. Blocks only while TX_QUEUE_SIZE messages are waiting:
   def sendText(self, SrcId, DstId, text):
-    packet = bytearray.fromhex('3242000000040900a1000e300000040a0000000a000000')
-    packet[5] = packet[14] = self.getNextSMSSeq()
-    packet[10] = 12 + len(text) * 2
-    packet[16] = (DstId >> 16) & 0xFF
-    packet[17] = (DstId >> 8) & 0xFF
-    packet[18] = DstId & 0xFF
-    packet[20] = (SrcId >> 16) & 0xFF
-    packet[21] = (SrcId >> 8) & 0xFF
-    packet[22] = SrcId & 0xFF
-    packet += bytes(text, "utf-16le")
-    packet.append(0) #ChkSum
-    packet.append(3)
-    for i in range(0, 256):
-      packet[len(packet) - 2] = i
-      self.SMS_Sock.sendto(packet, (self.RptIP, self.SMS_Port))
-      time.sleep(0.1)
+    encoded = bytes(text, "utf-16le")
+    if len(encoded) > MAX_TEXT_SIZE: raise ValueError("text too long")
+    self.TxQueue.put((SrcId, DstId, encoded))
+
+  # Send the queued messages one at a time, each until the repeater ACKs it or MAX_RETRIES are used up:
+  def SMS_Tx_Thread(self, threadName):
+    while True:
+      SrcId, DstId, text = self.TxQueue.get()
+      seq = self.getNextSMSSeq()
+      n = HytCodec.encodeTextMessage(self.TextPacket, seq, SrcId, DstId, text)
+      self.AckEvent.clear()
+      self.PendingSeq = seq
+      self.SentMessages += 1
+      for i in range(MAX_RETRIES + 1):
+        if i > 0: self.Retries += 1
+        self.SMS_Sock.sendto(memoryview(self.TextPacket)[:n], (self.RptIP, self.SMS_Port))
+        if self.AckEvent.wait(ACK_TIMEOUT): break
+      if self.AckEvent.is_set(): self.AckedMessages += 1
+      else:
+        self.FailedMessages += 1
+        print(threadName, ": no ACK for text message to", DstId)
+      self.PendingSeq = None
+      self.TxQueue.task_done()
+
+  # Wait until all queued messages are sent (ACKed or given up):
+  def flush(self):
+    self.TxQueue.join()
+
+  # Export the stats of this timeslot to a HytMetrics.Registry and time its packet handling:
+  def registerMetrics(self, registry):
+    labels = {"slot": self.name, "repeater": self.RptIP}
+    registry.counter("hyt_text_rx_packets_total", "Packets received from the repeater", labels, fn=lambda: self.RxPackets)
+    registry.gauge("hyt_text_last_rx_age_seconds", "Seconds since the last packet from the repeater (keep-alives every few seconds)", labels,
+      fn=lambda: (time.perf_counter_ns() - self.LastRxNs) / 1000000000 if self.LastRxNs is not None else None)
+    registry.counter("hyt_text_sent_total", "Text messages sent", labels, fn=lambda: self.SentMessages)
+    registry.counter("hyt_text_acked_total", "Sent text messages ACKed by the repeater", labels, fn=lambda: self.AckedMessages)
+    registry.counter("hyt_text_retries_total", "Text message retransmissions", labels, fn=lambda: self.Retries)
+    registry.counter("hyt_text_failed_total", "Text messages given up after MAX_RETRIES", labels, fn=lambda: self.FailedMessages)
+    registry.gauge("hyt_text_tx_queue", "Text messages waiting to be sent", labels, fn=self.TxQueue.qsize)
+    registry.counter("hyt_text_received_total", "Text messages received", labels, fn=lambda: self.ReceivedMessages)
+    registry.counter("hyt_text_duplicates_total", "Retransmitted text messages dropped", labels, fn=lambda: self.Duplicates)
+    registry.counter("hyt_text_bad_checksums_total", "Data packets with a bad checksum", labels, fn=lambda: self.BadChecksums)
+    self.PacketTime = registry.histogram("hyt_text_packet_handling_seconds", "Time to handle one received packet", labels)
+
+  def printStats(self):
+    print(self.name, ": %d text messages, %d ACKed, %d retries, %d failed, %d queued" % (self.SentMessages, self.AckedMessages,
+      self.Retries, self.FailedMessages, self.TxQueue.qsize()))
+    print(self.name, ": %d received, %d duplicates, %d bad checksums" % (self.ReceivedMessages, self.Duplicates, self.BadChecksums))
+
+# Settings from the command line (NAME=VALUE, see HytConfig.py), e.g. LOCAL_IP/RPT_IP for HytRepeaterSimulator.py:
+HytConfig.applyOverrides(globals(), sys.argv[1:])
 
 print("HytTextBridge 0.01")
+Store = HytTextStore.TextStore(TEXT_DB, TEXT_JSONL) if TEXT_DB is not None else None
 signal.signal(signal.SIGINT, signal_handler)
 
-TextSlot1 = TextSlot("TS1", RPT_IP, SMS_PORT_TS1)
-TextSlot2 = TextSlot("TS2", RPT_IP, SMS_PORT_TS2)
+TextSlot1 = TextSlot("TS1", RPT_IP, SMS_PORT_TS1, Store)
+TextSlot2 = TextSlot("TS2", RPT_IP, SMS_PORT_TS2, Store)
+
+if METRICS_PORT is not None:
+  Metrics = HytMetrics.Registry()
+  TextSlot1.registerMetrics(Metrics)
+  TextSlot2.registerMetrics(Metrics)
+  if Store is not None: Store.registerMetrics(Metrics)
+  Metrics.serve(METRICS_PORT, METRICS_IP)
 
 print("Waiting...")
 time.sleep(5)
 print("Sending...")
 TextSlot1.sendText(2623305, 2623305, "Dies ist ein wirklich richtig langer Test mit satzzeichen!")
-time.sleep(10)
 TextSlot1.sendText(123456, 2623266, "Dies ist ein langer Test")
+TextSlot1.flush()
 
 time.sleep(40)
 
 print("Exit!")
+TextSlot1.stop()
+TextSlot2.stop()
+TextSlot1.printStats()
+TextSlot2.printStats()
+if Store is not None:
+  Store.close()
+  print("Stored %(stored)d text messages in %(batches)d batches (max. %(max_batch)d)" % Store.getStats())
 sys.exit(0)
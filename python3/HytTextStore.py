@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+
+# Persistent store for received text messages (see HytTextBridge.py).
+# The receive threads only put messages into a queue, one writer thread takes them out in batches and
+# writes each batch to SQLite with a single commit and, optionally, appends it to a JSON Lines file.
+# The queue is unbounded, so a burst of messages never blocks the sockets; the batches grow instead,
+# which keeps the number of commits (the expensive part) low.
+# Errors (full disk, locked database) never stop the writer: messages are kept and retried, and spilled
+# to a JSON Lines file next to the database if that takes too long or the store is closed meanwhile.
+
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+  id INTEGER PRIMARY KEY,
+  time REAL NOT NULL,
+  slot TEXT NOT NULL,
+  repeater TEXT NOT NULL,
+  seq INTEGER NOT NULL,
+  src_id INTEGER NOT NULL,
+  dst_id INTEGER NOT NULL,
+  text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_time ON messages (time);
+CREATE INDEX IF NOT EXISTS messages_src ON messages (src_id, time);
+CREATE INDEX IF NOT EXISTS messages_dst ON messages (dst_id, time);
+"""
+
+# One message as JSON Lines record:
+def toJson(r):
+  return json.dumps({"time": r.Time, "slot": r.Slot, "repeater": r.Repeater, "seq": r.Seq,
+    "src_id": r.SrcId, "dst_id": r.DstId, "text": r.Text}, ensure_ascii=False) + "\n"
+
+# Received text message:
+class TextRecord:
+  __slots__ = ('Time', 'Slot', 'Repeater', 'Seq', 'SrcId', 'DstId', 'Text')
+
+  def __init__(self, Time, Slot, Repeater, Seq, SrcId, DstId, Text):
+    self.Time = Time
+    self.Slot = Slot
+    self.Repeater = Repeater
+    self.Seq = Seq
+    self.SrcId = SrcId
+    self.DstId = DstId
+    self.Text = Text
+
+class TextStore:
+  def __init__(self, DbPath, JsonPath = None, BatchSize = 500, BatchDelay = 0.2, RetryDelay = 1.0, MaxPending = 100000):
+    self.DbPath = DbPath
+    self.JsonPath = JsonPath
+    self.BatchSize = BatchSize # Max. messages per commit
+    self.BatchDelay = BatchDelay # Seconds to wait for more messages before committing a batch
+    self.RetryDelay = RetryDelay # Seconds between attempts while the database or JSON file fails
+    self.MaxPending = MaxPending # Messages kept for retrying before they are spilled to SpillPath
+    self.SpillPath = DbPath + ".unsaved.jsonl"
+    self.Queue = queue.SimpleQueue()
+    self.Lock = threading.Lock() # Orders put() and close()
+    self.SpillLock = threading.Lock() # spill() is called by the writer and by put() after close()
+    self.Closed = False
+
+    # Stats:
+    self.Stored = 0
+    self.Batches = 0
+    self.MaxBatch = 0
+    self.Errors = 0
+    self.Spilled = 0
+    self.LastErrors = {} # Target ("db", "json", ...) -> message of its last error, cleared when it works again
+
+    self.Thread = threading.Thread(target=self.writerThread, name="TextStore", daemon=True)
+    self.Thread.start()
+
+  # Called by the receive threads, never blocks (except for a message arriving after close(), which is
+  # spilled at once because the writer is gone):
+  def put(self, rec):
+    with self.Lock:
+      if not self.Closed:
+        self.Queue.put(rec)
+        return
+    self.spill([rec])
+
+  # Write everything queued so far and stop the writer:
+  def close(self):
+    with self.Lock:
+      if self.Closed: return
+      self.Closed = True
+      self.Queue.put(None)
+    self.Thread.join()
+
+  # A failing database or file is retried, the error is printed once (and again when it changes):
+  def onError(self, target, what, e):
+    self.Errors += 1
+    if self.LastErrors.get(target) != str(e):
+      self.LastErrors[target] = str(e)
+      print("TextStore: %s failed: %s" % (what, e))
+
+  def onSuccess(self, target):
+    if self.LastErrors.pop(target, None) is not None: print("TextStore: %s works again" % target)
+
+  def openDb(self):
+    db = None
+    try:
+      db = sqlite3.connect(self.DbPath)
+      db.execute("PRAGMA journal_mode=WAL")
+      db.execute("PRAGMA synchronous=NORMAL")
+      db.executescript(SCHEMA)
+      return db
+    except sqlite3.Error as e:
+      if db is not None: db.close()
+      self.onError("db", "opening " + self.DbPath, e)
+      return None
+
+  # Messages that can not be written to the database go to a JSON Lines file next to it:
+  def spill(self, records):
+    with self.SpillLock:
+      try:
+        with open(self.SpillPath, "a", encoding="utf-8") as f:
+          f.write("".join(toJson(r) for r in records))
+        self.Spilled += len(records)
+        print("TextStore: %d messages written to %s" % (len(records), self.SpillPath))
+      except OSError as e:
+        self.onError("spill", "writing " + self.SpillPath, e)
+        print("TextStore: %d messages lost" % len(records))
+
+  def writerThread(self):
+    db = self.openDb()
+    jsonfile = None
+    pending = [] # Messages not yet committed (batch collected now plus those of failed attempts)
+    lines = [] # JSON lines not yet written
+    done = False
+    while not done:
+      batch = []
+      try:
+        batch.append(self.Queue.get(timeout=self.RetryDelay if pending or lines else None))
+        deadline = time.monotonic() + self.BatchDelay
+        while len(batch) < self.BatchSize and batch[-1] is not None:
+          batch.append(self.Queue.get(timeout=max(0, deadline - time.monotonic())))
+      except queue.Empty:
+        pass
+      if batch and batch[-1] is None:
+        done = True
+        batch.pop()
+      pending += batch
+      if self.JsonPath is not None: lines += [toJson(r) for r in batch]
+
+      if pending:
+        if db is None: db = self.openDb()
+        if db is not None:
+          try:
+            with db:
+              db.executemany("INSERT INTO messages (time, slot, repeater, seq, src_id, dst_id, text) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(r.Time, r.Slot, r.Repeater, r.Seq, r.SrcId, r.DstId, r.Text) for r in pending])
+            self.Stored += len(pending)
+            self.Batches += 1
+            self.MaxBatch = max(self.MaxBatch, len(pending))
+            pending = []
+            self.onSuccess("db")
+          except sqlite3.Error as e:
+            self.onError("db", "writing %d messages to %s" % (len(pending), self.DbPath), e)
+        if len(pending) > self.MaxPending:
+          self.spill(pending)
+          pending = []
+
+      if lines:
+        try:
+          if jsonfile is None: jsonfile = open(self.JsonPath, "a", encoding="utf-8")
+          jsonfile.write("".join(lines))
+          jsonfile.flush()
+          lines = []
+          self.onSuccess("json")
+        except OSError as e:
+          self.onError("json", "writing " + self.JsonPath, e)
+          if len(lines) > self.MaxPending: lines = lines[-self.MaxPending:] # The database has them
+
+    if pending: self.spill(pending)
+    # The database or the spill file has these messages, only the JSON copy is missing:
+    if lines: print("TextStore: %d messages not written to %s" % (len(lines), self.JsonPath))
+    if jsonfile is not None:
+      try:
+        jsonfile.close()
+      except OSError as e:
+        self.onError("json", "closing " + self.JsonPath, e)
+    if db is not None: db.close()
+
+  # Export the stats to a HytMetrics.Registry:
+  def registerMetrics(self, registry):
+    registry.counter("hyt_text_stored_total", "Text messages written to the store", fn=lambda: self.Stored)
+    registry.counter("hyt_text_store_batches_total", "Commits of the text store", fn=lambda: self.Batches)
+    registry.counter("hyt_text_store_errors_total", "Failed writes of the text store (retried)", fn=lambda: self.Errors)
+    registry.counter("hyt_text_spilled_total", "Text messages written to the spill file instead of the database", fn=lambda: self.Spilled)
+    registry.gauge("hyt_text_store_queue", "Text messages waiting to be written", fn=self.Queue.qsize)
+
+  def getStats(self):
+    return {
+      "stored": self.Stored,
+      "batches": self.Batches,
+      "max_batch": self.MaxBatch,
+      "errors": self.Errors,
+      "spilled": self.Spilled,
+    }
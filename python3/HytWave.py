@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+
+# WAV files holding G.711 u-law (format tag 7), one byte per sample exactly as received in the RTP
+# payload. Half the size of 16 bit PCM and no conversion while recording; sox, ffmpeg, VLC and
+# Audacity play them as they are, HytWaveConvert.py turns them into PCM or FLAC.
+# The wave module of the standard library only handles PCM, so this writes and reads the chunks itself:
+# RIFF header, fmt (18 bytes, as required for formats other than PCM), fact (number of samples) and data.
+
+import struct
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_MULAW = 7
+
+RIFF_HEADER = struct.Struct('<4sI4s') # "RIFF", size, "WAVE"
+CHUNK_HEADER = struct.Struct('<4sI') # id, size
+FMT_CHUNK = struct.Struct('<HHIIHH') # format tag, channels, sample rate, bytes per second, block align, bits per sample
+ULAW_HEADER = struct.Struct('<4sI4s4sIHHIIHHH4sII4sI') # RIFF header, fmt chunk with cbSize = 0, fact chunk, data chunk header
+
+# Writes u-law audio to an open binary file (seekable, the sizes are filled in by close()):
+class ULawWaveWriter:
+  def __init__(self, f, SampleRate = 8000):
+    self.f = f
+    self.SampleRate = SampleRate
+    self.Samples = 0
+    f.write(self.getHeader())
+
+  def getHeader(self):
+    n = self.Samples
+    return ULAW_HEADER.pack(b'RIFF', ULAW_HEADER.size - 8 + n + (n & 1), b'WAVE', b'fmt ', 18, WAVE_FORMAT_MULAW, 1, self.SampleRate,
+      self.SampleRate, 1, 8, 0, b'fact', 4, n, b'data', n)
+
+  def write(self, ulaw):
+    self.f.write(ulaw)
+    self.Samples += len(ulaw)
+
+  # Fill in the sizes, the file itself stays open:
+  def close(self):
+    if self.Samples & 1: self.f.write(b'\0') # Chunks are padded to an even size
+    self.f.seek(0)
+    self.f.write(self.getHeader())
+    self.f.seek(0, 2)
+
+# Contents of a WAV file:
+class WaveInfo:
+  __slots__ = ('FormatTag', 'Channels', 'SampleRate', 'BitsPerSample', 'Data')
+
+  def __init__(self):
+    self.FormatTag = self.Channels = self.SampleRate = self.BitsPerSample = 0
+    self.Data = b''
+
+# Read a PCM or u-law WAV file, raises ValueError if it is none:
+def readWave(path):
+  with open(path, 'rb') as f:
+    buf = f.read()
+  riff, size, wave = RIFF_HEADER.unpack_from(buf)
+  if riff != b'RIFF' or wave != b'WAVE': raise ValueError(path + ": not a WAV file")
+  info = WaveInfo()
+  pos = RIFF_HEADER.size
+  while pos + CHUNK_HEADER.size <= len(buf):
+    ChunkId, ChunkSize = CHUNK_HEADER.unpack_from(buf, pos)
+    pos += CHUNK_HEADER.size
+    if ChunkId == b'fmt ':
+      info.FormatTag, info.Channels, info.SampleRate, _, _, info.BitsPerSample = FMT_CHUNK.unpack_from(buf, pos)
+    elif ChunkId == b'data':
+      info.Data = buf[pos:pos + ChunkSize]
+    pos += ChunkSize + (ChunkSize & 1)
+  if info.FormatTag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_MULAW): raise ValueError(path + ": unsupported format %d" % info.FormatTag)
+  return info
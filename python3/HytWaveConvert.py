@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+
+# Batch conversion of u-law recordings (see HytWave.py) to 16 bit PCM WAV or FLAC, in parallel.
+# PCM is written with the wave module, FLAC by sox (as in script/ulaw2wav.sh), which reads u-law WAV directly.
+# Files that are no u-law WAV (e.g. already converted) are skipped. With the index of HytRecorder.py
+# given, the paths of converted recordings are updated in it.
+#
+# Usage: HytWaveConvert.py file.wav|directory [...] [NAME=VALUE ...]
+#   e.g. HytWaveConvert.py rec/2026/09 FORMAT=flac INDEX=rec/recordings.sqlite
+
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import wave
+import HytConfig
+import HytDSP
+import HytWave
+
+# Output format, "pcm" (WAV) or "flac":
+FORMAT = "pcm"
+
+# Keep the u-law file (PCM output is then named <name>.pcm.wav):
+KEEP_SOURCE = False
+
+# Index of HytRecorder.py to update, None: none:
+INDEX = None
+
+# Processes converting files in parallel, 0 = one per CPU:
+PROCESSES = 0
+
+# Settings the workers need. They are handed over by the pool initializer, as workers started with
+# spawn or forkserver (macOS, Windows, Linux from Python 3.14) import this module afresh and would
+# otherwise see the defaults instead of the command line:
+WORKER_SETTINGS = ("FORMAT", "KEEP_SOURCE")
+
+def initWorker(settings):
+  globals().update(settings)
+
+# Worker: convert one file, returns (source, output, error), output None if skipped or failed.
+# A failed file is reported and its source kept:
+def convertFile(path):
+  try:
+    info = HytWave.readWave(path)
+  except (OSError, ValueError):
+    return path, None, None
+  if info.FormatTag != HytWave.WAVE_FORMAT_MULAW: return path, None, None
+  base = path[:-4] if path.lower().endswith('.wav') else path
+  try:
+    return path, writeOutput(path, base, info), None
+  except OSError as e:
+    return path, None, str(e)
+
+def writeOutput(path, base, info):
+  if FORMAT == "flac":
+    out = base + '.flac'
+    try:
+      subprocess.run(["sox", path, "-b", "16", out], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as e:
+      if os.path.exists(out): os.remove(out)
+      raise OSError("sox: " + e.stderr.decode(errors="replace").strip()) from e
+  else:
+    out = base + '.pcm.wav' if KEEP_SOURCE else path
+    w = wave.open(out + '.tmp', 'wb')
+    w.setparams((info.Channels, 2, info.SampleRate, 0, 'NONE', 'not compressed'))
+    w.writeframes(HytDSP.ulaw2lin(info.Data, 2))
+    w.close()
+    os.replace(out + '.tmp', out)
+  if not KEEP_SOURCE and out != path: os.remove(path)
+  return out
+
+def findFiles(args):
+  for arg in args:
+    if os.path.isdir(arg):
+      for root, dirs, files in os.walk(arg):
+        dirs.sort()
+        for name in sorted(files):
+          if name.lower().endswith('.wav') and not name.lower().endswith('.pcm.wav'): yield os.path.join(root, name)
+    else: yield arg
+
+if __name__ == "__main__":
+  paths = [a for a in sys.argv[1:] if '=' not in a]
+  HytConfig.applyOverrides(globals(), [a for a in sys.argv[1:] if '=' in a])
+  if FORMAT not in ("pcm", "flac"):
+    print("Unknown format:", FORMAT)
+    sys.exit(1)
+  if FORMAT == "flac" and shutil.which("sox") is None:
+    print("FLAC needs sox")
+    sys.exit(1)
+  converted = skipped = failed = 0
+  db = sqlite3.connect(INDEX) if INDEX is not None else None
+  IndexDir = os.path.dirname(os.path.abspath(INDEX)) if INDEX is not None else None
+  settings = {name: globals()[name] for name in WORKER_SETTINGS}
+  with multiprocessing.Pool(PROCESSES or None, initializer=initWorker, initargs=(settings,)) as pool:
+    for path, out, error in pool.imap_unordered(convertFile, findFiles(paths), chunksize=16):
+      if error is not None:
+        print(path + ":", error)
+        failed += 1
+        continue
+      if out is None:
+        skipped += 1
+        continue
+      converted += 1
+      if db is not None and out != path and not KEEP_SOURCE:
+        db.execute("UPDATE recordings SET path = ? WHERE path = ?", (os.path.relpath(os.path.abspath(out), IndexDir),
+          os.path.relpath(os.path.abspath(path), IndexDir)))
+  if db is not None:
+    db.commit()
+    db.close()
+  print("%d files converted, %d skipped, %d failed" % (converted, skipped, failed))
+  if failed: sys.exit(1)
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+# Throughput of HytCaptureAnalyzer on a synthetic capture: REPEATERS repeaters (Ethernet/IPv4) with a
+# PC sending idle audio on both timeslots all the time and the repeaters sending back-to-back calls
+# (QSO data + RTP) with LOSS frames lost. Checks the decoded calls and losses against what was written,
+# then analyzes FILES copies of the capture in parallel.
+#
+# Usage: python3 bench/bench_analyzer.py [NAME=VALUE ...]   e.g. SECONDS=600 FILES=8
+
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HytCodec
+import HytConfig
+import HytCaptureAnalyzer
+
+REPEATERS = 4
+SECONDS = 300 # Capture length
+CALL_DURATION = 8
+CALL_GAP = 2
+LOSS = 0.01
+FILES = 4 # Copies analyzed in parallel
+FORMAT = "pcap" # or "pcapng"
+
+ETHERNET_IPV4_UDP = struct.Struct('>6s6sHBBHHHBBH4s4sHHHH')
+PCAP_RECORD = struct.Struct('<IIII')
+PCAPNG_EPB = struct.Struct('<IIIIIII')
+
+def frame(src, dst, port, payload):
+  n = len(payload)
+  return ETHERNET_IPV4_UDP.pack(b'\x02' * 6, b'\x04' * 6, 0x0800, 0x45, 0, 28 + n, 0, 0, 64, 17, 0, src, dst, port, port, 8 + n, 0) + payload
+
+def writeCapture(path, rnd):
+  pc = bytes([192, 168, 4, 10])
+  packets = [] # (time, frame)
+  calls = 0
+  lost = 0
+  for r in range(REPEATERS):
+    rpt = bytes([192, 168, 4, 32 + r])
+    for ts, (rcp, rtp) in enumerate(((30009, 30012), (30010, 30014))):
+      rtp_header = bytearray(HytCodec.RTP_HEADER_SIZE)
+      idle = b'\xff' * 160
+      seq = rnd.randrange(65536)
+      for i in range(int(SECONDS / 0.02)):
+        seq = (seq + 1) & 0xFFFF
+        HytCodec.encodeRTPHeader(rtp_header, seq, i * 160 & 0xFFFFFFFF)
+        packets.append((i * 0.02 + rnd.uniform(0, 0.002), frame(pc, rpt, rtp, bytes(rtp_header) + idle)))
+      t = rnd.uniform(0, CALL_GAP)
+      qso = bytearray(HytCodec.QSO_DATA_SIZE)
+      while t + CALL_DURATION < SECONDS:
+        calls += 1
+        HytCodec.encodeQSOData(qso, calls & 0xFF, 2620001 + r, 1, 2428, 2620100 + calls)
+        packets.append((t, frame(rpt, pc, rcp, bytes(qso))))
+        voice = bytes(rnd.randrange(0, 0xFF) for i in range(160))
+        for i in range(int(CALL_DURATION / 0.02)):
+          seq = (seq + 1) & 0xFFFF
+          if rnd.random() < LOSS and i > 0:
+            lost += 1
+            continue
+          HytCodec.encodeRTPHeader(rtp_header, seq, int((t + i * 0.02) * 8000) & 0xFFFFFFFF)
+          packets.append((t + 0.05 + i * 0.02, frame(rpt, pc, rtp, bytes(rtp_header) + voice)))
+        t += CALL_DURATION + CALL_GAP
+  packets.sort(key=lambda p: p[0])
+  with open(path, 'wb') as f:
+    if FORMAT == "pcapng":
+      f.write(struct.pack('<IIIHHqI', 0x0A0D0D0A, 28, 0x1A2B3C4D, 1, 0, -1, 28))
+      f.write(struct.pack('<IIHHII', 1, 20, 1, 0, 65535, 20))
+    else:
+      f.write(struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+    base = 1700000000
+    for t, data in packets:
+      if FORMAT == "pcapng":
+        us = int((base + t) * 1000000)
+        pad = (4 - len(data) % 4) % 4
+        blen = 32 + len(data) + pad
+        f.write(PCAPNG_EPB.pack(6, blen, 0, us >> 32, us & 0xFFFFFFFF, len(data), len(data)) + data + bytes(pad) + struct.pack('<I', blen))
+      else:
+        f.write(PCAP_RECORD.pack(base + int(t), int(t % 1 * 1000000), len(data), len(data)) + data)
+  return calls, lost
+
+HytConfig.applyOverrides(globals(), sys.argv[1:])
+HytCaptureAnalyzer.WRITE_WAV = False
+
+with tempfile.TemporaryDirectory(prefix="bench_analyzer_") as TempDir:
+  path = os.path.join(TempDir, "capture." + FORMAT)
+  calls, lost = writeCapture(path, random.Random(1))
+  size = os.path.getsize(path)
+  print("Capture: %.1f MB, %d repeaters, %.0f s, %d calls, %d frames lost" % (size / 1e6, REPEATERS, SECONDS, calls, lost))
+
+  r = HytCaptureAnalyzer.analyzeFile(path)
+  found = sum(s[4] for s in r["streams"])
+  print("Single file: %.1f MB/s, %.0f frames/s, %d calls, %d frames lost" % (size / 1e6 / r["seconds"], r["frames"] / r["seconds"], len(r["calls"]), found))
+  if len(r["calls"]) != calls or found != lost: print("MISMATCH: expected %d calls, %d frames lost" % (calls, lost))
+
+  paths = [path] + [os.path.join(TempDir, "copy%d.%s" % (i, FORMAT)) for i in range(1, FILES)]
+  for p in paths[1:]: os.link(path, p)
+  start = time.monotonic()
+  with multiprocessing.Pool(min(FILES, os.cpu_count())) as pool: results = pool.map(HytCaptureAnalyzer.analyzeFile, paths)
+  elapsed = time.monotonic() - start
+  print("%d files on %d CPUs: %.1f MB/s" % (FILES, os.cpu_count(), FILES * size / 1e6 / elapsed))
@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+
+# Microbenchmark: per-packet cost of the old hex-literal packet builders vs. HytCodec.
+# Usage: python3 bench/bench_codec.py [iterations]
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HytCodec
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+# Reference implementations as they were in the bridges:
+def oldCallSetup(seq, CallType, DstId):
+  packet = bytearray.fromhex('3242000000010241080500017c0900005e03')
+  packet[5] = seq
+  packet[11] = CallType
+  packet[12] = DstId & 0xFF
+  packet[13] = (DstId >> 8) & 0xFF
+  packet[14] = (DstId >> 16) & 0xFF
+  return packet
+
+def oldAudioFrame(seq, ts, payload):
+  rtp = bytearray.fromhex('90000000000000000000000000150003000000000000000000000000') + payload
+  rtp[2] = (seq >> 8) & 0xFF
+  rtp[3] = seq & 0xFF
+  rtp[4] = (ts >> 24) & 0xFF
+  rtp[5] = (ts >> 16) & 0xFF
+  rtp[6] = (ts >> 8) & 0xFF
+  rtp[7] = ts & 0xFF
+  return rtp
+
+def oldQSOData(data):
+  RptId = int("%02X%02X%02X" % (data[9], data[10], data[11]), 16)
+  CT = data[26]
+  DstId = int("%02X%02X%02X" % (data[30], data[29], data[28]), 16)
+  SrcId = int("%02X%02X%02X" % (data[34], data[33], data[32]), 16)
+  return RptId, CT, DstId, SrcId
+
+CallSetupBuf = bytearray(HytCodec.CALL_SETUP_SIZE)
+RTPBuf = bytearray(HytCodec.RTP_HEADER_SIZE + 160)
+RTPPayload = memoryview(RTPBuf)[HytCodec.RTP_HEADER_SIZE:]
+Payload = bytes(160)
+QSO = bytearray(HytCodec.QSO_DATA_SIZE)
+QSO[0:4] = bytes.fromhex('32420020')
+QSO[9:12] = bytes.fromhex('280237') # Repeater 2622007
+QSO[26] = 1 # Group call
+QSO[28:31] = bytes.fromhex('7c0900') # to 2428
+QSO[32:35] = bytes.fromhex('18f824') # from 2422808
+QSO = bytes(QSO)
+QSORec = HytCodec.QSOData()
+
+def newAudioFrame(seq, ts, payload):
+  RTPPayload[:] = payload
+  HytCodec.encodeRTPHeader(RTPBuf, seq, ts)
+  return RTPBuf
+
+Cases = [
+  ("call setup", lambda: oldCallSetup(1, 1, 2428), lambda: HytCodec.encodeCallSetup(CallSetupBuf, 1, 1, 2428)),
+  ("rtp frame", lambda: oldAudioFrame(1234, 56789, Payload), lambda: newAudioFrame(1234, 56789, Payload)),
+  ("qso decode", lambda: oldQSOData(QSO), lambda: HytCodec.decodeQSOData(QSO, QSORec)),
+]
+
+print("%-12s %12s %12s %8s" % ("packet", "old ns/pkt", "codec ns/pkt", "speedup"))
+for name, old, new in Cases:
+  t_old = min(timeit.repeat(old, number=N, repeat=3)) / N * 1e9
+  t_new = min(timeit.repeat(new, number=N, repeat=3)) / N * 1e9
+  print("%-12s %12.0f %12.0f %7.1fx" % (name, t_old, t_new, t_old / t_new))
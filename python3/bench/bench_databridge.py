@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+
+# End-to-end benchmark of HytDataBridge over the loopback radio emulator (Linux, uses 127.0.0.x).
+# Every scenario starts HytRadioEmulator.py, bridge A in client mode and bridge B in server mode
+# (forwarding to an echo server in this process) from scratch:
+#   bulk:        one circuit sends BULK_BYTES while the echo streams back
+#   interactive: ROUNDS request/response round trips of REQUEST_SIZE bytes on an idle link
+#   mixed:       the interactive round trips while a bulk transfer runs on another circuit
+# Reports goodput, p50/p99 round trip time, retransmits per packet and airtime use. At the emulator's
+# default bit rate a full run takes several minutes, radio.BIT_RATE=19200 gives a quick check.
+#
+# Usage: python3 bench/bench_databridge.py [scenario ...] [radio.NAME=VALUE ...] [bridge.NAME=VALUE ...] [NAME=VALUE ...]
+#   e.g. python3 bench/bench_databridge.py bulk radio.LOSS=0.05 bridge.TRANSMIT_WINDOW_SIZE=4 BULK_BYTES=32768
+# radio.* and bridge.* are passed to the emulator and both bridges, plain NAME=VALUE sets the constants below.
+
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import random
+
+DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, DIR)
+import HytConfig
+
+BULK_BYTES = 4096
+ROUNDS = 10
+REQUEST_SIZE = 32
+CLIENT_PORT = 18000 # Client mode port of bridge A, plus the number of the scenario (lingering connections block the port)
+TIMEOUT = 600 # Seconds per scenario
+LOG_DIR = None # Directory to keep the process logs in (overwritten per scenario), None: temporary
+
+# IP addresses, see HytRadioEmulator.py:
+STATION_A_IP = "127.0.0.2"
+STATION_B_IP = "127.0.0.3"
+EMULATOR_A_IP = "127.0.0.10"
+EMULATOR_B_IP = "127.0.0.11"
+
+# Echo server for bridge B, returns everything it receives:
+def startEchoServer():
+  server = socket.socket()
+  server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  server.bind(("127.0.0.1", 0))
+  server.listen()
+  def echo(c):
+    with c:
+      while True:
+        data = c.recv(65536)
+        if not data: break
+        c.sendall(data)
+  def serve():
+    while True:
+      c, addr = server.accept()
+      threading.Thread(target=echo, args=(c,), daemon=True).start()
+  threading.Thread(target=serve, daemon=True).start()
+  return server.getsockname()[1]
+
+def waitForLine(path, text, proc, timeout = 10):
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    with open(path) as f:
+      if text in f.read(): return
+    if proc.poll() is not None: break
+    time.sleep(0.05)
+  raise RuntimeError("%s did not start, see %s" % (os.path.basename(path), path))
+
+def start(name, script, args, LogDir, ready):
+  path = os.path.join(LogDir, name + ".log")
+  log = open(path, "w")
+  proc = subprocess.Popen([sys.executable, "-u", os.path.join(DIR, script)] + args, stdout=log, stderr=subprocess.STDOUT)
+  log.close()
+  waitForLine(path, ready, proc)
+  return proc, path
+
+def stop(proc):
+  if proc.poll() is None: proc.send_signal(signal.SIGINT)
+  try:
+    proc.wait(10)
+  except subprocess.TimeoutExpired:
+    proc.kill()
+    proc.wait()
+
+# Send data and read the echo, returns seconds until the last byte came back:
+def transfer(s, data):
+  t = time.monotonic()
+  sender = threading.Thread(target=s.sendall, args=(data,), daemon=True)
+  sender.start()
+  got = bytearray()
+  while len(got) < len(data):
+    chunk = s.recv(65536)
+    if not chunk: raise RuntimeError("connection closed after %d of %d bytes" % (len(got), len(data)))
+    got += chunk
+  sender.join()
+  if got != data: raise RuntimeError("echo does not match")
+  return time.monotonic() - t
+
+def connect():
+  s = socket.create_connection(("127.0.0.1", ClientPort))
+  s.settimeout(TIMEOUT)
+  return s
+
+def runBulk(result, rnd):
+  with connect() as s:
+    t = transfer(s, rnd.randbytes(BULK_BYTES))
+  result["goodput"] = BULK_BYTES / t
+  result["bytes"] = 2 * BULK_BYTES
+
+def runInteractive(result, rnd):
+  rtts = []
+  with connect() as s:
+    for i in range(ROUNDS): rtts.append(transfer(s, rnd.randbytes(REQUEST_SIZE)))
+  result["rtts"] = rtts
+  result["bytes"] = result.get("bytes", 0) + 2 * ROUNDS * REQUEST_SIZE
+
+def runMixed(result, rnd):
+  bulk = {}
+  thread = threading.Thread(target=runBulk, args=(bulk, random.Random(rnd.random())), daemon=True)
+  thread.start()
+  time.sleep(2) # Let the bulk transfer fill the window
+  runInteractive(result, rnd)
+  thread.join(TIMEOUT)
+  if "goodput" not in bulk: raise RuntimeError("bulk transfer did not finish")
+  result["goodput"] = bulk["goodput"]
+  result["bytes"] += bulk["bytes"]
+
+Scenarios = {"bulk": runBulk, "interactive": runInteractive, "mixed": runMixed}
+
+# Nearest rank percentile:
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+def parseStats(BridgeLogs, RadioLog):
+  stats = {"packets": 0, "retransmits": 0, "air_bytes": 0, "airtime": 0.0}
+  for path in BridgeLogs:
+    with open(path) as f:
+      m = re.findall(r"Radio \d+ datagrams, \d+ frames, (\d+) packets, (\d+) retransmits", f.read())
+    if m:
+      stats["packets"] += int(m[-1][0])
+      stats["retransmits"] += int(m[-1][1])
+  with open(RadioLog) as f:
+    log = f.read()
+  stats["air_bytes"] = sum(int(n) for n in re.findall(r"delivered \((\d+) bytes\)", log))
+  stats["airtime"] = sum(float(t) for t in re.findall(r"Channel \d+: ([\d.]+) s airtime", log))
+  return stats
+
+def runScenario(name, EchoPort, RadioArgs, BridgeArgs, LogDir):
+  global ClientPort
+  ClientPort = CLIENT_PORT + list(Scenarios).index(name)
+  radio, RadioLog = start("radio", "HytRadioEmulator.py", ["LINKS=[('%s', '%s', '%s', '%s')]" % (STATION_A_IP, EMULATOR_A_IP, STATION_B_IP, EMULATOR_B_IP)] + RadioArgs,
+    LogDir, "Link 0:")
+  procs = [radio]
+  try:
+    b, LogB = start("bridge_b", "HytDataBridge.py", ["LOCAL_RADIO_NET_IP=" + STATION_B_IP, "OTHER_STATION_IP=" + EMULATOR_B_IP, "ALLOW_CLIENT_MODE=False",
+      "DESTINATION_HOST=127.0.0.1", "DESTINATION_PORT=%d" % EchoPort, "STATS_INTERVAL=0", "METRICS_IP=" + STATION_B_IP] + BridgeArgs, LogDir, "Radio link 0")
+    procs.append(b)
+    a, LogA = start("bridge_a", "HytDataBridge.py", ["LOCAL_RADIO_NET_IP=" + STATION_A_IP, "OTHER_STATION_IP=" + EMULATOR_A_IP, "ALLOW_SERVER_MODE=False",
+      "LOCAL_CLIENT_NET_IP=127.0.0.1", "LOCAL_TCP_PORT=%d" % ClientPort, "STATS_INTERVAL=0", "METRICS_IP=" + STATION_A_IP] + BridgeArgs, LogDir, "Waiting for incoming")
+    procs.append(a)
+    result = {}
+    t = time.monotonic()
+    Scenarios[name](result, random.Random(1))
+    result["duration"] = time.monotonic() - t
+  finally:
+    for p in reversed(procs): stop(p)
+  result.update(parseStats([LogA, LogB], RadioLog))
+  return result
+
+def fmt(value, spec):
+  return spec % value if value is not None else "-"
+
+# Arguments:
+names = []
+RadioArgs = []
+BridgeArgs = []
+settings = []
+for arg in sys.argv[1:]:
+  if arg in Scenarios: names.append(arg)
+  elif arg.startswith("radio."): RadioArgs.append(arg[6:])
+  elif arg.startswith("bridge."): BridgeArgs.append(arg[7:])
+  else: settings.append(arg)
+HytConfig.applyOverrides(globals(), settings)
+if not names: names = list(Scenarios)
+
+EchoPort = startEchoServer()
+print("%-12s %9s %12s %9s %9s %12s %12s %9s" % ("scenario", "time s", "goodput B/s", "p50 ms", "p99 ms", "retransmits", "air B/byte", "airtime s"))
+with tempfile.TemporaryDirectory(prefix="bench_databridge_") as TempDir:
+  LogDir = LOG_DIR if LOG_DIR is not None else TempDir
+  os.makedirs(LogDir, exist_ok=True)
+  for name in names:
+    try:
+      r = runScenario(name, EchoPort, RadioArgs, BridgeArgs, LogDir)
+    except (RuntimeError, OSError) as e:
+      print("%-12s failed: %s" % (name, e))
+      for log in ("radio", "bridge_a", "bridge_b"):
+        path = os.path.join(LogDir, log + ".log")
+        if os.path.exists(path):
+          with open(path) as f: print("--- %s:\n%s" % (log, "".join(f.readlines()[-20:])))
+      continue
+    rtts = r.get("rtts")
+    print("%-12s %9.1f %12s %9s %9s %11.1f%% %12.2f %9.1f" % (name, r["duration"], fmt(r.get("goodput"), "%.0f"),
+      fmt(percentile(rtts, 50) * 1000 if rtts else None, "%.0f"), fmt(percentile(rtts, 99) * 1000 if rtts else None, "%.0f"),
+      100 * r["retransmits"] / max(1, r["packets"]), r["air_bytes"] / max(1, r["bytes"]), r["airtime"]))
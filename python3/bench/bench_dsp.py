@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+
+# Benchmark: cost per 20 ms frame (160 samples @ 8 kHz) of HytDSP vs. audioop (if still available).
+# Single frames show the per-call overhead, batches show the cost when many frames/slots are
+# processed with one call.
+# Usage: python3 bench/bench_dsp.py [iterations]
+
+import os
+import sys
+import timeit
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HytDSP
+
+warnings.simplefilter("ignore", DeprecationWarning)
+try:
+  import audioop
+except ImportError:
+  audioop = None
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+BATCH = 50 # Frames per batch, e.g. 50 slots or one second of audio
+
+rng = np.random.default_rng(1)
+pcm = rng.integers(-32768, 32767, 160 * BATCH, dtype=np.int16)
+ulaw = HytDSP.lin2ulaw(pcm.tobytes(), 2)
+frame_pcm = pcm[:160].tobytes()
+frame_ulaw = ulaw[:160]
+frame_pcm48 = np.repeat(pcm[:160], 6).tobytes()
+
+def perFrame(fn, frames = 1):
+  return min(timeit.repeat(fn, number=N, repeat=3)) / N / frames * 1e9
+
+Cases = [
+  ("ulaw2lin", lambda: audioop.ulaw2lin(frame_ulaw, 2), lambda: HytDSP.ulaw2lin(frame_ulaw, 2), lambda: HytDSP.ulawDecode(ulaw)),
+  ("lin2ulaw", lambda: audioop.lin2ulaw(frame_pcm, 2), lambda: HytDSP.lin2ulaw(frame_pcm, 2), lambda: HytDSP.ulawEncode(pcm)),
+  ("mul", lambda: audioop.mul(frame_pcm, 2, 0.7), lambda: HytDSP.mul(frame_pcm, 2, 0.7), lambda: HytDSP.gain(pcm, 0.7)),
+  ("ratecv 48->8", lambda: audioop.ratecv(frame_pcm48, 2, 1, 48000, 8000, None), lambda: HytDSP.ratecv(frame_pcm48, 2, 1, 48000, 8000, None), lambda: HytDSP.resample(np.repeat(pcm, 6), 48000, 8000)),
+]
+
+print("ns per 20 ms frame, batch = %d frames" % BATCH)
+print("%-14s %10s %10s %10s" % ("function", "audioop", "HytDSP", "batched"))
+for name, old, new, batched in Cases:
+  t_old = "%10.0f" % perFrame(old) if audioop else "%10s" % "n/a"
+  print("%-14s %s %10.0f %10.0f" % (name, t_old, perFrame(new), perFrame(batched, BATCH)))
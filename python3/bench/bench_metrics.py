@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+
+# Microbenchmark: cost of the HytMetrics updates on the hot path, of timing every received packet
+# (SlotProtocol with and without a PacketTime histogram) and of rendering a scrape for many slots.
+# Usage: python3 bench/bench_metrics.py [iterations]
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HytMetrics
+import HytSlotEngine
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+SLOTS = 64
+
+reg = HytMetrics.Registry()
+c = reg.counter("bench_total", "Counter", {"slot": "TS1"})
+g = reg.gauge("bench_gauge", "Gauge", {"slot": "TS1"})
+h = reg.histogram("bench_seconds", "Histogram", {"slot": "TS1"})
+
+# Slot stand-in with the fields SlotProtocol uses:
+class BenchSlot:
+  def __init__(self, PacketTime):
+    self.name = "TS1"
+    self.PacketTime = PacketTime
+    self.LastRxNs = None
+
+def handler(data):
+  pass
+
+Plain = HytSlotEngine.SlotProtocol(BenchSlot(None), handler)
+Timed = HytSlotEngine.SlotProtocol(BenchSlot(HytMetrics.Histogram({"slot": "TS1"})), handler)
+Packet = bytes(188)
+Addr = ("127.0.0.1", 30012)
+
+def perCall(fn, n = N):
+  return min(timeit.repeat(fn, number=n, repeat=3)) / n * 1e9
+
+Cases = [
+  ("Counter.inc()", lambda: c.inc()),
+  ("Gauge.set()", lambda: g.set(1.5)),
+  ("Histogram.observe()", lambda: h.observe(0.00042)),
+  ("datagram_received, untimed", lambda: Plain.datagram_received(Packet, Addr)),
+  ("datagram_received, timed", lambda: Timed.datagram_received(Packet, Addr)),
+]
+
+print("%-30s %10s" % ("", "ns/call"))
+for name, fn in Cases:
+  print("%-30s %10.0f" % (name, perCall(fn)))
+
+# A scrape of a bridge with many slots, about 20 series each:
+for i in range(SLOTS):
+  labels = {"slot": "TS%d" % (i % 2 + 1), "repeater": "127.1.0.%d" % (i // 2 + 1)}
+  for k in range(16): reg.counter("bench_slot_%d_total" % k, "Counter", labels, fn=lambda: 42)
+  reg.histogram("bench_slot_jitter_seconds", "Histogram", labels).observe(0.001)
+  reg.histogram("bench_slot_handling_seconds", "Histogram", labels).observe(0.00002)
+text = reg.render()
+print("render(), %d slots: %.2f ms, %d lines, %d bytes" % (SLOTS, perCall(reg.render, 50) / 1e6, text.count("\n"), len(text)))
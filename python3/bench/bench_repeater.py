@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+
+# Load test of the audio slot engine against HytRepeaterSimulator.py (Linux, uses 127.x.y.z).
+# For every repeater count the simulator is started with that many virtual repeaters playing
+# back-to-back calls on both timeslots. This process serves them like one HytAudioBridge process
+# serving many repeaters: one SlotEngine with two AsyncAudioSlots per repeater, each ACKing the
+# QSO data and echoing the received audio back to its timeslot (call setup, PTT, RTP).
+# Reports CPU use of the engine, late pacer ticks, frames lost/dropped in the jitter buffers and,
+# from the simulator, QSO ACK latency plus drift and jitter of the audio the engine sends.
+#
+# Usage: python3 bench/bench_repeater.py [repeaters ...] [sim.NAME=VALUE ...] [NAME=VALUE ...]
+#   e.g. python3 bench/bench_repeater.py 1 10 50 sim.LOSS=0.02 sim.JITTER=0.04 RUN_TIME=30
+# sim.* is passed to the simulator, plain NAME=VALUE sets the constants below.
+
+import ipaddress
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, DIR)
+import HytCodec
+import HytConfig
+from HytSlotEngine import SlotEngine, AsyncAudioSlot
+
+REPEATERS = [1, 10, 50]
+RUN_TIME = 20 # Seconds per repeater count
+LOG_DIR = None # Directory to keep the simulator logs in, None: temporary
+
+# IP addresses of the first repeater and of its bridge slots, both count up per repeater:
+REPEATER_IP = "127.1.0.1"
+BRIDGE_IP = "127.2.0.1"
+
+# Timeslot ports (RCP, RTP), see HytAudioBridge.py:
+SLOT_PORTS = [(30009, 30012), (30010, 30014)]
+
+# Bridge side of one timeslot: ACK QSO data and send the received audio back:
+class EchoSlot(AsyncAudioSlot):
+  def __init__(self, *args):
+    super().__init__(*args)
+    self.Calls = 0
+    self.RxFrames = 0
+
+  def processRCPPacket(self, data):
+    if HytCodec.isQSOData(data):
+      self.sendACK(data[5])
+      self.Calls += 1
+    elif HytCodec.isHyteraPacket(data) and data[3] == HytCodec.TYPE_DATA:
+      self.sendACK(data[5])
+
+  def processRxAudio(self, payload): # Idle frames are not echoed, so the echo ends with the call
+    self.RxFrames += 1
+    self.TxBufferULaw.write(payload)
+
+def offsetIP(ip, n):
+  return str(ipaddress.ip_address(ip) + n)
+
+def parseSimulator(path):
+  with open(path) as f:
+    log = f.read()
+  stats = {}
+  m = re.findall(r"latency p50 ([\d.-]+) ms, p99 ([\d.-]+) ms", log)
+  if m: stats["ack_p50"], stats["ack_p99"] = m[-1]
+  m = re.findall(r"From bridge: (\d+) RTP frames, drift ([+-]?\d+) ppm, jitter ([\d.]+) ms", log)
+  if m: stats["frames"], stats["drift"], stats["jitter"] = m[-1]
+  m = re.findall(r"CPU ([\d.]+)%", log)
+  if m: stats["sim_cpu"] = m[-1]
+  return stats
+
+def runLoad(n, SimArgs, LogDir):
+  engine = SlotEngine()
+  slots = []
+  for i in range(n):
+    for ts, (rcp, rtp) in enumerate(SLOT_PORTS):
+      slots.append(engine.addSlot(EchoSlot("Rpt %d TS%d" % (i, ts + 1), offsetIP(BRIDGE_IP, i), offsetIP(REPEATER_IP, i), rcp, rtp)))
+  path = os.path.join(LogDir, "simulator_%d.log" % n)
+  with open(path, "w") as log:
+    sim = subprocess.Popen([sys.executable, "-u", os.path.join(DIR, "HytRepeaterSimulator.py"), "REPEATERS=%d" % n,
+      "REPEATER_IP=" + REPEATER_IP, "BRIDGE_IP=" + BRIDGE_IP, "BRIDGE_PER_REPEATER=True", "STATS_INTERVAL=0",
+      "RUN_TIME=%s" % RUN_TIME] + SimArgs, stdout=log, stderr=subprocess.STDOUT)
+  engine.startThread()
+  start = time.monotonic()
+  StartCPU = time.process_time()
+  try:
+    sim.wait(RUN_TIME + 30)
+  except subprocess.TimeoutExpired:
+    sim.send_signal(signal.SIGINT)
+    sim.wait()
+  cpu = 100 * (time.process_time() - StartCPU) / (time.monotonic() - start)
+  engine.stop()
+  result = {"cpu": cpu, "late": engine.Pacer.getStats()["late_frames"], "calls": sum(s.Calls for s in slots),
+    "lost": sum(s.RxJitter.Lost for s in slots), "late_drops": sum(s.RxJitter.LateDrops for s in slots),
+    "received": sum(s.RxJitter.Received for s in slots)}
+  result.update(parseSimulator(path))
+  return result
+
+# Arguments:
+counts = []
+SimArgs = []
+settings = []
+for arg in sys.argv[1:]:
+  if arg.isdigit(): counts.append(int(arg))
+  elif arg.startswith("sim."): SimArgs.append(arg[4:])
+  else: settings.append(arg)
+HytConfig.applyOverrides(globals(), settings)
+if not counts: counts = REPEATERS
+
+print("%9s %7s %8s %7s %9s %9s %11s %9s %9s %10s %9s" % ("repeaters", "CPU %", "sim CPU", "late", "calls", "rx lost",
+  "late drops", "ACK p50", "ACK p99", "drift ppm", "jitter"))
+with tempfile.TemporaryDirectory(prefix="bench_repeater_") as TempDir:
+  LogDir = LOG_DIR if LOG_DIR is not None else TempDir
+  os.makedirs(LogDir, exist_ok=True)
+  for n in counts:
+    r = runLoad(n, SimArgs, LogDir)
+    if "frames" not in r:
+      print("%9d failed, simulator log:" % n)
+      with open(os.path.join(LogDir, "simulator_%d.log" % n)) as f: print("".join(f.readlines()[-20:]))
+      continue
+    print("%9d %7.1f %8s %7d %9d %9d %11d %9s %9s %10s %9s" % (n, r["cpu"], r.get("sim_cpu", "-"), r["late"], r["calls"],
+      r["lost"], r["late_drops"], r.get("ack_p50", "-"), r.get("ack_p99", "-"), r["drift"], r["jitter"]))
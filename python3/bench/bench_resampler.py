@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+
+# Benchmark: CPU per stream of the polyphase resampler used by the Mumble bridge.
+# Feeds 10 s of audio in 20 ms chunks (160 samples @ 8 kHz / 960 samples @ 48 kHz), as the bridge does,
+# and reports the time per chunk and the CPU share of one core needed per real-time stream.
+# Usage: python3 bench/bench_resampler.py [seconds]
+
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HytDSP
+
+warnings.simplefilter("ignore", DeprecationWarning)
+try:
+  import audioop
+except ImportError:
+  audioop = None
+
+SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+CHUNK_MS = 20
+
+def run(name, inrate, outrate):
+  chunk = inrate * CHUNK_MS // 1000
+  n = int(SECONDS * 1000 / CHUNK_MS)
+  x = (np.sin(2 * np.pi * 440 * np.arange(chunk * n) / inrate) * 8000).astype(np.int16)
+  chunks = [x[i * chunk:(i + 1) * chunk] for i in range(n)]
+  byteChunks = [c.tobytes() for c in chunks]
+
+  r = HytDSP.PolyphaseResampler(inrate, outrate)
+  t = time.perf_counter()
+  for c in chunks: r.process(c)
+  poly = (time.perf_counter() - t) / n
+
+  line = "%-10s polyphase %7.1f us/chunk %5.2f%% CPU/stream" % (name, poly * 1e6, poly * 100000 / CHUNK_MS)
+  if audioop:
+    state = None
+    t = time.perf_counter()
+    for c in byteChunks: _, state = audioop.ratecv(c, 2, 1, inrate, outrate, state)
+    ref = (time.perf_counter() - t) / n
+    line += " | audioop.ratecv %7.1f us/chunk %5.2f%% CPU/stream" % (ref * 1e6, ref * 100000 / CHUNK_MS)
+  print(line)
+
+run("8k->48k", 8000, 48000)
+run("48k->8k", 48000, 8000)
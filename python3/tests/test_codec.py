@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+# HytCodec: encoders give the bytes the original bridges sent, decoders read back what the encoders wrote.
+# Usage: python3 -m pytest tests (or python3 -m unittest discover -s tests)
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HytCodec
+
+class EncodeTest(unittest.TestCase):
+  # Packets of the original HytAudioBridge, seq in byte 5:
+  def testACK(self):
+    buf = bytearray(HytCodec.ACK_SIZE)
+    HytCodec.encodeACK(buf, 0x17)
+    self.assertEqual(buf, bytes.fromhex('324200010117'))
+
+  def testCallSetup(self):
+    buf = bytearray(HytCodec.CALL_SETUP_SIZE)
+    self.assertEqual(HytCodec.encodeCallSetup(buf, 0x01, 1, 2428), len(buf))
+    self.assertEqual(buf, bytes.fromhex('3242000000010241080500017c0900005e03'))
+    self.assertTrue(HytCodec.isValidHDAP(buf))
+
+  def testPTT(self):
+    buf = bytearray(HytCodec.PTT_SIZE)
+    HytCodec.encodePTT(buf, 0x00, False)
+    self.assertEqual(buf, bytes.fromhex('32420000000002410002000300ec03'))
+    HytCodec.encodePTT(buf, 0x00, True)
+    self.assertEqual(buf, bytes.fromhex('32420000000002410002000301eb03'))
+
+  def testRTPHeader(self):
+    buf = bytearray(HytCodec.RTP_HEADER_SIZE + 1)
+    HytCodec.encodeRTPHeader(buf, 0x1234, 0x89ABCDEF)
+    self.assertEqual(buf[:HytCodec.RTP_HEADER_SIZE], bytes.fromhex('90001234' '89abcdef' '00000000' '00150003') + bytes(12))
+    self.assertTrue(HytCodec.isRTPAudio(buf))
+    info = HytCodec.decodeRTPHeader(buf)
+    self.assertEqual((info.Seq, info.Timestamp, info.SSRC), (0x1234, 0x89ABCDEF, 0))
+
+class RoundTripTest(unittest.TestCase):
+  def testTextMessage(self):
+    text = "Grüße von DK7LST!"
+    buf = bytearray(HytCodec.TMP_OVERHEAD + 200)
+    n = HytCodec.encodeTextMessage(buf, 42, 2623305, 2623266, bytes(text, "utf-16le"))
+    data = bytes(buf[:n])
+    self.assertTrue(HytCodec.isHyteraPacket(data))
+    self.assertTrue(HytCodec.isValidHDAP(data))
+    self.assertTrue(HytCodec.isTextMessage(data))
+    msg = HytCodec.decodeTextMessage(data)
+    self.assertEqual((msg.Seq, msg.RequestId & 0xFF, msg.SrcId, msg.DstId, msg.Text), (42, 42, 2623305, 2623266, text))
+    # A flipped byte breaks the checksum:
+    bad = bytearray(data)
+    bad[HytCodec.TMP_OVERHEAD] ^= 0x01
+    self.assertFalse(HytCodec.isValidHDAP(bad))
+
+  def testQSOData(self):
+    buf = bytearray(HytCodec.QSO_DATA_SIZE)
+    self.assertEqual(HytCodec.encodeQSOData(buf, 7, 262100, 1, 2428, 2623305), HytCodec.QSO_DATA_SIZE)
+    self.assertTrue(HytCodec.isQSOData(buf))
+    qso = HytCodec.decodeQSOData(buf)
+    self.assertEqual((qso.Seq, qso.RptId, qso.CallType, qso.DstId, qso.SrcId), (7, 262100, 1, 2428, 2623305))
+    self.assertEqual(str(qso), "Grp call from 2623305 to 2428 via 262100")
+
+  def testDataHeader(self):
+    packed = HytCodec.DATA_HEADER.pack(0x1234, 0x56, 0x01, 0x55, 0xFFFF)
+    self.assertEqual(len(packed), 7)
+    self.assertEqual(HytCodec.DATA_HEADER.unpack(packed), (0x1234, 0x56, 0x01, 0x55, 0xFFFF))
+
+if __name__ == '__main__':
+  unittest.main()
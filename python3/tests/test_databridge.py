@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+# HytDataBridge: client data read while the radio payload size shrinks (prober backoff, bond link down)
+# with a partial packet held back for coalescing.
+# Usage: python3 -m pytest tests (or python3 -m unittest discover -s tests)
+
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HytDataBridge as Bridge
+from HytDataLink import PayloadSizeProber
+
+# Radio link without socket, only what the schedule needs to size packets:
+class FakeLink:
+  def __init__(self):
+    self.Prober = PayloadSizeProber(Bridge.RADIO_MIN_UDP_PAYLOAD_SIZE, Bridge.RADIO_MAX_UDP_PAYLOAD_SIZE, 512)
+
+class ShrinkingPayloadTest(unittest.TestCase):
+  def setUp(self):
+    self.link = FakeLink()
+    Bridge.ConList = {}
+    Bridge.SocketList = {}
+    Bridge.DirtyConnections = set()
+    Bridge.Schedule = Bridge.TxSchedule([self.link])
+    listener = socket.create_server(("127.0.0.1", 0))
+    self.client = socket.create_connection(listener.getsockname())
+    s, _ = listener.accept()
+    listener.close()
+    s.setblocking(0)
+    self.con = Bridge.Connection(s)
+    self.con.save()
+
+  def tearDown(self):
+    self.client.close()
+    self.con.Socket.close()
+
+  # Client sends less than a packet, it is held back; then the payload size drops to size:
+  def checkShrink(self, size):
+    self.client.sendall(b'x' * 300)
+    Bridge.processClientToRadio(self.con.Socket)
+    self.assertEqual(len(self.con.UnsentRadioBytes), 300)
+    self.link.Prober.PayloadSize = size
+    Bridge.Schedule.checkPayloadSize()
+    self.assertIn(self.con, Bridge.DirtyConnections) # Registration is re-checked
+    self.client.sendall(b'y' * 100)
+    Bridge.processClientToRadio(self.con.Socket) # Must neither raise nor disconnect
+    self.assertIn(self.con.VirtualCircuitId, Bridge.ConList)
+    self.assertIsNotNone(self.con.Socket)
+    queued = sum(len(p.getData()) for q in Bridge.Schedule.UnconfirmedPackets.values() for p in q)
+    self.assertEqual(queued + len(self.con.UnsentRadioBytes), 300) # Full packets went out, nothing lost
+    self.assertLess(len(self.con.UnsentRadioBytes), self.con.getMaxPacketData())
+
+  def test_room_zero(self):
+    self.checkShrink(300 + Bridge.HEADER_SIZE) # Exactly the held back bytes
+
+  def test_room_negative(self):
+    self.checkShrink(Bridge.RADIO_MIN_UDP_PAYLOAD_SIZE)
+
+  def test_payload_size_unchanged(self):
+    Bridge.Schedule.checkPayloadSize()
+    Bridge.DirtyConnections.clear()
+    Bridge.Schedule.checkPayloadSize()
+    self.assertEqual(len(Bridge.DirtyConnections), 0)
+
+if __name__ == "__main__":
+  unittest.main()
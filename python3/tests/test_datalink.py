@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+# HytDataLink: sliding window ARQ. A lost packet is reported through ack/sack, retransmitted once the
+# receiver has seen enough packets behind it, and delivered in order; sequence numbers wrap at 256.
+# Usage: python3 -m pytest tests (or python3 -m unittest discover -s tests)
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from HytDataLink import SendWindow, ReceiveWindow, RTTEstimator, FAST_RETRANSMIT_THRESHOLD, seqDiff
+
+# Packet as far as the windows care:
+class Packet:
+  def __init__(self, n):
+    self.n = n
+    self.FastRetransmitted = False
+
+class ARQTest(unittest.TestCase):
+  def setUp(self):
+    self.tx = SendWindow(8, 250) # Wraps after a few packets
+    self.rx = ReceiveWindow()
+    self.rx.sync(250)
+    self.delivered = []
+    self.sent = 0
+
+  def send(self, n, lost = ()):
+    packets = []
+    for i in range(n):
+      self.sent += 1
+      p = Packet(self.sent)
+      seq = self.tx.assign(p)
+      packets.append((seq, p))
+      if p.n not in lost: self.delivered += [q.n for q in self.rx.receive(seq, p)]
+    return packets
+
+  def testInOrder(self):
+    self.send(8)
+    self.assertTrue(self.tx.isFull())
+    acked, retransmit = self.tx.processAck(*self.rx.getAck())
+    self.assertEqual([p.n for p in acked], list(range(1, 9)))
+    self.assertEqual(retransmit, [])
+    self.assertEqual(self.delivered, list(range(1, 9)))
+    self.assertEqual(self.rx.getAck(), ((250 + 8) & 0xFF, 0))
+
+  def testLossFastRetransmit(self):
+    packets = self.send(2 + FAST_RETRANSMIT_THRESHOLD, lost = (2,))
+    ack, sack = self.rx.getAck()
+    self.assertEqual(ack, packets[1][0]) # Everything before the lost packet
+    self.assertEqual(sack, (1 << FAST_RETRANSMIT_THRESHOLD) - 1)
+    self.assertTrue(self.rx.hasGaps())
+    self.assertEqual(self.delivered, [1])
+
+    acked, retransmit = self.tx.processAck(ack, sack)
+    self.assertEqual(sorted(p.n for p in acked), [1] + list(range(3, 3 + FAST_RETRANSMIT_THRESHOLD)))
+    self.assertEqual([p.n for p in retransmit], [2])
+    self.assertEqual(self.tx.count(), 1)
+    self.assertEqual(self.tx.processAck(ack, sack), ([], [])) # Same ACK again: retransmitted only once
+
+    seq, p = packets[1]
+    self.delivered += [q.n for q in self.rx.receive(seq, p)] # Retransmit arrives
+    self.assertEqual(self.delivered, list(range(1, 3 + FAST_RETRANSMIT_THRESHOLD)))
+    acked, retransmit = self.tx.processAck(*self.rx.getAck())
+    self.assertEqual([p.n for p in acked], [2])
+    self.assertEqual(self.tx.count(), 0)
+
+  # Too few packets behind the gap: no fast retransmit, the retransmit timer has to do it:
+  def testLossBelowThreshold(self):
+    self.send(FAST_RETRANSMIT_THRESHOLD, lost = (1,))
+    acked, retransmit = self.tx.processAck(*self.rx.getAck())
+    self.assertEqual(len(acked), FAST_RETRANSMIT_THRESHOLD - 1)
+    self.assertEqual(retransmit, [])
+    self.assertEqual(self.tx.count(), 1)
+
+  def testDuplicateAndStale(self):
+    packets = self.send(3)
+    seq, p = packets[0]
+    self.assertEqual(self.rx.receive(seq, p), []) # Our ACK got lost, the sender repeats
+    self.assertEqual(self.rx.Duplicates, 1)
+    ack, sack = self.rx.getAck()
+    self.tx.processAck(ack, sack)
+    self.send(1)
+    self.assertEqual(self.tx.processAck(packets[0][0], 0), ([], [])) # Old ACK from before
+    self.assertEqual(self.tx.count(), 1)
+
+  def testSeqDiffWraps(self):
+    self.assertEqual(seqDiff(2, 250), 8)
+    self.assertEqual(seqDiff(250, 2), -8)
+
+class RTTEstimatorTest(unittest.TestCase):
+  def testBackoff(self):
+    rtt = RTTEstimator(InitialRTO = 10, MinRTO = 1, MaxRTO = 60)
+    self.assertEqual([rtt.getTimeout(n) for n in range(1, 6)], [10, 20, 40, 60, 60])
+    rtt.sample(2.0)
+    self.assertEqual(rtt.RTO, 2.0 + 4 * 1.0)
+    for i in range(50): rtt.sample(2.0)
+    self.assertAlmostEqual(rtt.RTO, 2.0, delta=0.01) # Steady RTT, variation goes away
+    rtt.sample(0.1)
+    self.assertGreaterEqual(rtt.RTO, 1) # Never below MinRTO
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+# HytDSP: G.711 tables match the reference code, the resampler works on chunks of any size.
+# Usage: python3 -m pytest tests (or python3 -m unittest discover -s tests)
+
+import os
+import sys
+import unittest
+import warnings
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HytDSP
+
+try:
+  with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    import audioop
+except ImportError:
+  audioop = None # Python 3.13 and later
+
+# Sample by sample G.711 u-law as in the CCITT reference code (g711.c), which audioop uses:
+SEG_UEND = [0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF]
+
+def refLinearToULaw(sample):
+  pcm = sample >> 2 # 14 bit
+  if pcm < 0:
+    pcm = -pcm
+    mask = 0x7F
+  else:
+    mask = 0xFF
+  pcm = min(pcm, HytDSP.ULAW_CLIP) + (HytDSP.ULAW_BIAS >> 2)
+  seg = next((i for i, end in enumerate(SEG_UEND) if pcm <= end), 8)
+  if seg >= 8: return 0x7F ^ mask
+  return ((seg << 4) | ((pcm >> (seg + 1)) & 0x0F)) ^ mask
+
+def refULawToLinear(u):
+  u = ~u & 0xFF
+  t = (((u & 0x0F) << 3) + HytDSP.ULAW_BIAS) << ((u & 0x70) >> 4)
+  return HytDSP.ULAW_BIAS - t if u & 0x80 else t - HytDSP.ULAW_BIAS
+
+class G711Test(unittest.TestCase):
+  def testDecodeTable(self):
+    self.assertEqual(HytDSP.ULAW_DECODE.tolist(), [refULawToLinear(u) for u in range(256)])
+    self.assertEqual((HytDSP.ULAW_DECODE[0x00], HytDSP.ULAW_DECODE[0x80], HytDSP.ULAW_DECODE[0xFF]), (-32124, 32124, 0))
+
+  def testEncodeTable(self):
+    samples = np.arange(-32768, 32768)
+    encoded = HytDSP.ulawEncode(samples)
+    self.assertEqual(encoded.tolist(), [refLinearToULaw(int(x)) for x in samples])
+    # Decoding and encoding again gives the same code (except 0x7F, the second code for zero):
+    codes = np.arange(256, dtype=np.uint8)
+    again = HytDSP.ulawEncode(HytDSP.ulawDecode(codes.tobytes()))
+    self.assertEqual([int(u) for u in codes if again[u] != u], [0x7F])
+
+  @unittest.skipIf(audioop is None, "audioop not available")
+  def testSameAsAudioop(self):
+    pcm = np.arange(-32768, 32768, dtype=np.int16).tobytes()
+    ulaw = bytes(range(256))
+    self.assertEqual(HytDSP.lin2ulaw(pcm, 2), audioop.lin2ulaw(pcm, 2))
+    self.assertEqual(HytDSP.ulaw2lin(ulaw, 2), audioop.ulaw2lin(ulaw, 2))
+    for factor in (0.5, 1.7, -2.0):
+      self.assertEqual(HytDSP.mul(pcm, 2, factor), audioop.mul(pcm, 2, factor))
+
+class PolyphaseResamplerTest(unittest.TestCase):
+  def testEmptyChunk(self):
+    r = HytDSP.PolyphaseResampler(8000, 48000)
+    self.assertEqual(len(r.process(np.zeros(0, dtype=np.int16))), 0)
+    self.assertEqual(r.processBytes(b''), b'')
+
+  # Chunks of any size, empty ones included, give the same output as one long buffer:
+  def testChunksMatchWholeBuffer(self):
+    x = (8000 * np.sin(np.arange(1600) * 0.05)).astype(np.int16)
+    for inrate, outrate in ((8000, 48000), (48000, 8000), (8000, 11025)):
+      whole = HytDSP.PolyphaseResampler(inrate, outrate).process(x)
+      r = HytDSP.PolyphaseResampler(inrate, outrate)
+      parts = [r.process(x[i:i + n]) for i, n in ((0, 7), (7, 0), (7, 160), (167, 0), (167, 1433))]
+      np.testing.assert_array_equal(np.concatenate(parts), whole)
+
+if __name__ == '__main__':
+  unittest.main()
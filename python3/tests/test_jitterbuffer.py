@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+
+# JitterBuffer: a call after a jump of the RTP sequence number or timestamp is played, not dropped or concealed.
+# Usage: python3 -m pytest tests (or python3 -m unittest discover -s tests)
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HytJitterBuffer
+
+FRAME = 160 # Samples per 20 ms frame
+PERIOD = FRAME / 8000
+
+# Feed n frames in real time starting at time t, pulling every frame period. Returns (payloads played, time after the last frame):
+def stream(jb, seq, ts, n, t, payload):
+  played = []
+  for i in range(n):
+    jb.push((seq + i) & 0xFFFF, (ts + i * FRAME) & 0xFFFFFFFF, payload, t)
+    played += jb.pull(t)
+    t += PERIOD
+  return played, t
+
+def drain(jb, t, seconds = 1.0):
+  played = []
+  for i in range(int(seconds / PERIOD)):
+    played += jb.pull(t)
+    t += PERIOD
+  return played, t
+
+class SequenceJumpTest(unittest.TestCase):
+  # Two calls, the second starting gap seconds after the first with its sequence number moved by jump:
+  def checkJump(self, jump, gap, resyncs):
+    jb = HytJitterBuffer.JitterBuffer()
+    first, t = stream(jb, 1000, 50000, 100, 0.0, b'\x01' * FRAME)
+    pause, t = drain(jb, t, gap)
+    second, t = stream(jb, 1000 + 100 + jump, 50000 + 100 * FRAME + int(gap * 8000), 500, t, b'\x02' * FRAME)
+    rest, t = drain(jb, t)
+    played = first + pause + second + rest
+    self.assertEqual(played.count(b'\x01' * FRAME), 100)
+    self.assertEqual(played.count(b'\x02' * FRAME), 500)
+    self.assertEqual(jb.LateDrops, 0)
+    self.assertEqual(jb.Lost, 0)
+    self.assertEqual(jb.Resyncs, resyncs)
+    self.assertEqual(jb.Delay, jb.MinDelay)
+
+  def test_forward_jump(self):
+    self.checkJump(5000, 0.0, 1)
+
+  def test_forward_jump_read_as_backward(self):
+    self.checkJump(40000, 0.0, 1) # More than half the sequence space ahead unwraps as a step back
+
+  def test_backward_jump(self):
+    self.checkJump(-3000, 0.0, 1)
+
+  def test_jump_after_pause(self):
+    self.checkJump(40000, 1.0, 0) # The idle timeout already started a new talkspurt
+
+  def test_timestamp_jump(self):
+    jb = HytJitterBuffer.JitterBuffer()
+    stream(jb, 1000, 50000, 100, 0.0, b'\x01' * FRAME)
+    second, t = stream(jb, 1100, 50000 + 100 * FRAME + 10 * 8000, 100, 2.0, b'\x02' * FRAME)
+    rest, t = drain(jb, t)
+    self.assertEqual((second + rest).count(b'\x02' * FRAME), 100)
+    self.assertEqual(jb.Resyncs, 1)
+
+  def test_loss_across_wrap_is_concealed(self):
+    jb = HytJitterBuffer.JitterBuffer()
+    stream(jb, 65500, 0, 20, 0.0, b'\x01' * FRAME)
+    stream(jb, 65500 + 23, 23 * FRAME, 20, 23 * PERIOD, b'\x01' * FRAME) # 3 frames lost
+    drain(jb, 43 * PERIOD)
+    self.assertEqual(jb.Resyncs, 0)
+    self.assertEqual(jb.Lost, 3)
+    self.assertEqual(jb.Played, 40)
+
+if __name__ == "__main__":
+  unittest.main()
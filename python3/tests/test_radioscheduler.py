@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+
+# RadioScheduler: a flow whose next packet does not fit the rest of a datagram does not block the others.
+# Usage: python3 -m pytest tests (or python3 -m unittest discover -s tests)
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from HytRadioScheduler import RadioScheduler, PRIORITY_INTERACTIVE, PRIORITY_BULK
+
+class RadioSchedulerTest(unittest.TestCase):
+  def setUp(self):
+    self.sched = RadioScheduler(Quantum = 500)
+    self.sizes = {} # Flow id -> list of packet sizes waiting
+
+  def add(self, FlowId, sizes, Priority = PRIORITY_INTERACTIVE):
+    self.sched.addFlow(FlowId, Priority)
+    self.sizes[FlowId] = list(sizes)
+    self.sched.activate(FlowId)
+
+  def headSize(self, FlowId):
+    q = self.sizes[FlowId]
+    return q[0] if q else None
+
+  def select(self, MaxSize = None):
+    FlowId = self.sched.select(self.headSize, MaxSize)
+    if FlowId is not None: self.sizes[FlowId].pop(0)
+    return FlowId
+
+  def testOversizedHeadIsSkipped(self):
+    self.add('big', [400])
+    self.add('small', [50])
+    self.add('bulk', [60], PRIORITY_BULK)
+    self.assertEqual(self.select(100), 'small')
+    self.assertEqual(self.select(100), 'bulk')
+    self.assertIsNone(self.select(100))
+    # The skipped flow kept its place and goes out once there is room:
+    self.assertEqual(self.select(), 'big')
+    self.assertIsNone(self.select())
+
+  def testFullSizePacketInOneRound(self):
+    self.add('a', [500, 500])
+    self.add('b', [500])
+    self.assertEqual([self.select() for i in range(3)], ['a', 'b', 'a'])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+
+# SlotEngine: the thread functions of the former threaded AudioSlot still start the slot, on the engine.
+# Usage: python3 -m pytest tests (or python3 -m unittest discover -s tests)
+
+import _thread
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HytSlotEngine
+
+def freePort():
+  with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+    s.bind(("127.0.0.1", 0))
+    return s.getsockname()[1]
+
+class CompatThreadsTest(unittest.TestCase):
+  def tearDown(self):
+    if HytSlotEngine.DefaultEngine is not None: HytSlotEngine.DefaultEngine.stop()
+    HytSlotEngine.DefaultEngine = None
+
+  def testThreadsRunSlotOnEngine(self):
+    slot = HytSlotEngine.AsyncAudioSlot("TS1", "127.0.0.1", "127.0.0.1", freePort(), freePort())
+    done = threading.Semaphore(0)
+    def start(fn):
+      fn("TS1")
+      done.release()
+    for fn in (slot.RCP_Rx_Thread, slot.RTP_Rx_Thread, slot.TxIdleMsgThread, slot.TxAudioThread):
+      _thread.start_new_thread(start, (fn,))
+    engine = HytSlotEngine.getDefaultEngine()
+    for i in range(100):
+      if slot.Engine is not None: break
+      time.sleep(0.01)
+    self.assertIs(slot.Engine, engine)
+    self.assertEqual(engine.Slots, [slot]) # Added once, not once per thread
+    engine.stop()
+    for i in range(4): self.assertTrue(done.acquire(timeout=2)) # The threads end with the engine
+    self.assertIsNone(slot.RCP_Transport)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+
+# TextStore: messages are written to the database, a message arriving after close() goes to the spill file.
+# Usage: python3 -m pytest tests (or python3 -m unittest discover -s tests)
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HytTextStore
+
+def record(seq, text):
+  return HytTextStore.TextRecord(1000.0 + seq, "TS1", "127.0.0.1", seq, 2623305, 2623266, text)
+
+class TextStoreTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.DbPath = os.path.join(self.dir.name, "text.db")
+
+  def tearDown(self):
+    self.dir.cleanup()
+
+  def testPutAfterCloseIsSpilled(self):
+    store = HytTextStore.TextStore(self.DbPath)
+    store.put(record(1, "queued"))
+    store.close()
+    store.put(record(2, "late"))
+    store.close() # Twice is fine
+    db = sqlite3.connect(self.DbPath)
+    self.assertEqual(db.execute("SELECT text FROM messages").fetchall(), [("queued",)])
+    db.close()
+    with open(store.SpillPath, encoding="utf-8") as f:
+      self.assertEqual([json.loads(l)["text"] for l in f], ["late"])
+    self.assertEqual(store.getStats()["spilled"], 1)
+
+if __name__ == '__main__':
+  unittest.main()